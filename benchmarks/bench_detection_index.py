@@ -0,0 +1,78 @@
+"""
+build time of the detection index over a synthetic VIIRS archive and the
+latency of random bbox + time window queries, against a scan of the whole
+archive in memory. fails if any query differs from the scan.
+
+    python -m benchmarks.bench_detection_index --detections 2000000 --queries 200
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import write_dataset
+from detection_index import CHUNK_ROWS, DetectionIndex, read_archive_chunks
+from merge_and_filter import VIIRS_FILE, parse_years
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", nargs="+", default=["2015-2016"])
+    parser.add_argument("--fires", type=int, default=200, help="fires a year")
+    parser.add_argument("--detections", type=int, default=1_000_000, help="detections a year")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_detection_index_")
+    try:
+        years = parse_years(args.years)
+        write_dataset(os.path.join(work_dir, "data"), years, args.fires, args.detections, vertices=(20, 40), seed=args.seed)
+        archive = os.path.join(work_dir, "data", VIIRS_FILE)
+
+        start = time.perf_counter()
+        index = DetectionIndex(os.path.join(work_dir, "index"))
+        index.add_archive(archive, args.chunk_rows)
+        build = time.perf_counter() - start
+        print(f"   build: {len(index)} detections in {len(index.manifest['segments'])} segments in {build:.2f}s")
+
+        scan = next(read_archive_chunks(archive, len(index)))
+        lons, lats, times = scan['LONGITUDE'].to_numpy(), scan['LATITUDE'].to_numpy(), scan['date_time'].to_numpy()
+        rng = np.random.default_rng(args.seed)
+        first = np.datetime64(f"{years[0]}-01-01")
+        latencies, scan_latencies, consistent = [], [], True
+        for _ in range(args.queries):
+            minx, miny = rng.uniform(-124, -102), rng.uniform(31, 47)
+            bbox = (minx, miny, minx + rng.uniform(0.05, 2.0), miny + rng.uniform(0.05, 1.5))
+            begin = first + np.timedelta64(int(rng.integers(0, 365 * len(years))), 'D')
+            end = begin + np.timedelta64(int(rng.integers(1, 60)), 'D')
+
+            started = time.perf_counter()
+            result = index.query(bbox=bbox, start=begin, end=end)
+            latencies.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            match = (lons >= bbox[0]) & (lons <= bbox[2]) & (lats >= bbox[1]) & (lats <= bbox[3]) & (times >= begin) & (times < end)
+            expected = scan['source_row'].to_numpy()[match]
+            scan_latencies.append(time.perf_counter() - started)
+            consistent &= np.array_equal(np.sort(result['source_row'].to_numpy()), np.sort(expected))
+
+        for label, values in (("   index", latencies), ("    scan", scan_latencies)):
+            values = 1000 * np.array(values)
+            print(f"{label}: {args.queries} bbox + time queries, median {np.median(values):.2f} ms, "
+                  f"p95 {np.percentile(values, 95):.2f} ms")
+        print(f"matches scan: {'ok' if consistent else 'FAILED'}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if not consistent:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+compares the fixed ThreadPool(40) + per-task backoff used by the GEE fetch
+with the adaptive RequestScheduler, against a fake Earth Engine that throttles
+above a concurrency and rate limit.
+
+    python -m benchmarks.bench_ee_scheduler --requests 2000 --capacity 15
+"""
+import argparse
+import time
+from multiprocessing.pool import ThreadPool
+
+from benchmarks.fake_ee import FakeEarthEngine
+from ee_scheduler import RequestScheduler
+
+
+def run_fixed(client, n_requests, threads=40, max_retries=3):
+    def task(i):
+        backoff_time = 0.1
+        for _ in range(max_retries + 1):
+            try:
+                return client.get_info(i)
+            except Exception:
+                time.sleep(backoff_time)
+                backoff_time *= 2
+        return None
+
+    with ThreadPool(threads) as pool:
+        return pool.map(task, range(n_requests))
+
+
+def run_scheduled(client, n_requests, scheduler, threads=40):
+    def task(i):
+        try:
+            return scheduler.call(client.get_info, i)
+        except Exception:
+            return None
+
+    with ThreadPool(threads) as pool:
+        return pool.map(task, range(n_requests))
+
+
+def report(name, client, results, elapsed):
+    completed = sum(result is not None for result in results)
+    print(f"{name:>10}: {completed}/{len(results)} completed in {elapsed:.1f}s "
+          f"({completed / elapsed:.0f} req/s), {client.calls} calls, {client.throttled} throttled, {client.errors} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--capacity", type=int, default=15, help="concurrent calls before the fake throttles")
+    parser.add_argument("--rate-limit", type=int, default=None, help="calls per second before the fake throttles")
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--rate", type=float, default=400.0, help="scheduler token bucket rate")
+    args = parser.parse_args()
+
+    def make_client():
+        return FakeEarthEngine(latency=args.latency, capacity=args.capacity, rate_limit=args.rate_limit, error_rate=args.error_rate)
+
+    client = make_client()
+    start = time.perf_counter()
+    results = run_fixed(client, args.requests)
+    report("fixed", client, results, time.perf_counter() - start)
+
+    client = make_client()
+    scheduler = RequestScheduler(rate=args.rate, latency_target=4 * args.latency,
+                                 backoff={"throttle": (0.1, 2.0, 8), "transient": (0.05, 1.0, 3)})
+    start = time.perf_counter()
+    results = run_scheduled(client, args.requests, scheduler)
+    report("adaptive", client, results, time.perf_counter() - start)
+    print(scheduler.summary())
+
+
+if __name__ == "__main__":
+    main()
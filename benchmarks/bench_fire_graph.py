@@ -0,0 +1,82 @@
+"""
+times the bulk FireGraph builder against the per-row iterrows loop that
+initialize_graph used, on the 2015 fire with the most observations (or on a
+synthetic fire when the filtered store is not available).
+
+    python -m benchmarks.bench_fire_graph --year 2015
+    python -m benchmarks.bench_fire_graph --synthetic 200000
+"""
+import argparse
+import time
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from fire_graph import build_fire_graph
+from grid import DEFAULT_GRID
+
+
+def largest_fire(year):
+    from filtered_store import read_observations
+
+    fires = read_observations(columns=['uniquefire'], years=year)
+    uniquefire = fires['uniquefire'].value_counts().idxmax()
+    return uniquefire, read_observations(years=year, uniquefire=uniquefire).drop(columns=['year'])
+
+
+def synthetic_fire(n, seed=0):
+    rng = np.random.default_rng(seed)
+    days = rng.integers(0, 60, n)
+    # the front moves east over the days of the fire
+    return pd.DataFrame({
+        'observation_id': np.arange(n),
+        'LATITUDE': 64.0 + rng.normal(0, 0.15, n),
+        'LONGITUDE': -150.0 + days * 0.01 + rng.normal(0, 0.05, n),
+        'date_time': pd.Timestamp('2015-06-01') + pd.to_timedelta(days * 24 + rng.integers(0, 24, n), unit='h'),
+        'FRP': rng.gamma(2.0, 10.0, n),
+    })
+
+
+def legacy_graph(observations):
+    graph = nx.Graph()
+    for _, row in observations.iterrows():
+        cell = DEFAULT_GRID.snap_point(row['LATITUDE'], row['LONGITUDE'])
+        if cell not in graph:
+            graph.add_node(cell, **row.to_dict(), feature=0)
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--year", type=int, default=2015)
+    parser.add_argument("--synthetic", type=int, default=None, help="use a synthetic fire with this many observations")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        name, observations = "synthetic", synthetic_fire(args.synthetic)
+    else:
+        name, observations = largest_fire(args.year)
+    print(f"{name}: {len(observations)} observations")
+
+    start = time.perf_counter()
+    graph = build_fire_graph(observations)
+    elapsed = time.perf_counter() - start
+    print(f"    bulk: {elapsed:.3f}s, {len(graph)} cells, {graph.spatial.nnz // 2} spatial edges, "
+          f"{graph.temporal.nnz} temporal edges ({len(observations) / elapsed:,.0f} observations/s)")
+
+    start = time.perf_counter()
+    view = graph.to_networkx()
+    print(f"networkx view: {time.perf_counter() - start:.3f}s")
+
+    start = time.perf_counter()
+    legacy = legacy_graph(observations)
+    legacy_elapsed = time.perf_counter() - start
+    print(f"  legacy: {legacy_elapsed:.3f}s, {legacy.number_of_nodes()} cells, no edges "
+          f"({len(observations) / legacy_elapsed:,.0f} observations/s)")
+
+    assert set(view.nodes) == set(legacy.nodes)
+
+
+if __name__ == "__main__":
+    main()
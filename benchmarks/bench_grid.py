@@ -0,0 +1,68 @@
+"""
+throughput of snapping VIIRS-like points to the shared 375 m grid, compared
+with the per-point degree rounding WildfirePerimeter used before. fails if the
+vectorized path falls under --min-rate points per second.
+
+    python -m benchmarks.bench_grid --points 5000000
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from grid import DEFAULT_GRID, cell_id, cell_row_col
+
+
+def synthetic_points(n, seed=0):
+    """points clustered around fire-like centres across CONUS and Alaska."""
+    rng = np.random.default_rng(seed)
+    n_fires = max(1, n // 1000)
+    centre_lats = np.concatenate([rng.uniform(25, 49, n_fires - n_fires // 10), rng.uniform(58, 68, n_fires // 10)])
+    centre_lons = np.concatenate([rng.uniform(-124, -67, n_fires - n_fires // 10), rng.uniform(-160, -141, n_fires // 10)])
+    fire = rng.integers(0, n_fires, n)
+    return centre_lats[fire] + rng.normal(0, 0.05, n), centre_lons[fire] + rng.normal(0, 0.05, n)
+
+
+def legacy_snap(lats, lons):
+    return [(round(lat / 0.00335) * 0.00335, round(lon / 0.00335) * 0.00335) for lat, lon in zip(lats, lons)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=5_000_000)
+    parser.add_argument("--legacy-points", type=int, default=200_000, help="sample size for the per-point baseline")
+    parser.add_argument("--min-rate", type=float, default=1e6, help="minimum points per second")
+    args = parser.parse_args()
+
+    lats, lons = synthetic_points(args.points)
+
+    start = time.perf_counter()
+    rows, cols = DEFAULT_GRID.snap(lats, lons)
+    ids = cell_id(rows, cols)
+    elapsed = time.perf_counter() - start
+    rate = args.points / elapsed
+    print(f"    grid: {args.points} points in {elapsed:.2f}s ({rate:,.0f} points/s), "
+          f"{len(np.unique(ids))} distinct cells")
+
+    sample = slice(0, args.legacy_points)
+    start = time.perf_counter()
+    legacy_snap(lats[sample].tolist(), lons[sample].tolist())
+    legacy_elapsed = time.perf_counter() - start
+    print(f"  legacy: {args.legacy_points} points in {legacy_elapsed:.2f}s "
+          f"({args.legacy_points / legacy_elapsed:,.0f} points/s)")
+
+    # every cell centre must snap back to its own cell, and ids must round-trip
+    centre_lats, centre_lons = DEFAULT_GRID.cell_centers(rows[sample], cols[sample])
+    check_rows, check_cols = DEFAULT_GRID.snap(centre_lats, centre_lons)
+    unpacked_rows, unpacked_cols = cell_row_col(ids)
+    consistent = (np.array_equal(check_rows, rows[sample]) and np.array_equal(check_cols, cols[sample])
+                  and np.array_equal(unpacked_rows, rows) and np.array_equal(unpacked_cols, cols))
+    print(f"round trip: {'ok' if consistent else 'FAILED'}")
+
+    if not consistent or rate < args.min_rate:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
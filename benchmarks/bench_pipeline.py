@@ -0,0 +1,231 @@
+"""
+end-to-end benchmark of the pipeline on synthetic data: merge_and_filter,
+create_wildfire_perimeters, initialize_graph, count_rectangles_within and
+the batched feature fetch against a fake Earth Engine with tunable latency.
+results go to a JSON file named after the commit so runs of different
+versions can be compared.
+
+    python -m benchmarks.bench_pipeline --fires 200 --detections 500000
+    python -m benchmarks.bench_pipeline --data-dir /tmp/synthetic --ee-latency 0.5 --compare benchmark_results/old.json
+
+stages whose module cannot be imported here (ee, sklearn, ...) are recorded
+as skipped instead of failing the run.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from unittest import mock
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from benchmarks.fake_ee import FakeEarthEngine
+from benchmarks.synthetic import write_dataset
+from filtered_store import read_observations
+from merge_and_filter import VIIRS_FILE, parse_years, process_year
+from timing import StageTimer
+
+RESULTS_DIR = "./benchmark_results"
+# collections date_availability sizes up, all present in the fake
+AVAILABILITY = ('era5_one_day', 'era5_daily', 'modis_ndvi', 'pop_density', 'ndwi', 'burn_severity', 'fire_history')
+
+
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_merge_and_filter(timer, details, year, data_dir, work_dir, join_processes):
+    """times process_year on the synthetic archive; its own stage timings are added to details."""
+    store_dir = os.path.join(work_dir, "observations")
+    with timer.stage("merge_and_filter"):
+        _, _, _, year_timer = process_year(year, data_dir, work_dir, store_dir, show_progress=False, join_processes=join_processes)
+    timer.items["merge_and_filter"] = timer.items.get("merge_and_filter", 0) + year_timer.items["spatial join"]
+    for name, seconds in year_timer.timings.items():
+        details.timings[name] = details.timings.get(name, 0.0) + seconds
+        if name in year_timer.items:
+            details.items[name] = details.items.get(name, 0) + year_timer.items[name]
+    return read_observations(store_dir, years=year).drop(columns=['year'])
+
+
+def bench_create_perimeters(timer, observations, perimeters):
+    from perimeter_creation import create_wildfire_perimeters
+
+    with timer.stage("create_wildfire_perimeters", items=len(observations)):
+        fires = create_wildfire_perimeters(observations, perimeters)
+        # the mapping is lazy, build every fire as the old eager version did
+        fires = {uniquefire: fires[uniquefire] for uniquefire in fires}
+    return fires
+
+
+def bench_graphs(timer, fires):
+    with timer.stage("initialize_graph", items=sum(len(fire.viirs_observations) for fire in fires.values())):
+        for fire in fires.values():
+            fire.initialize_graph()
+
+
+def bench_count_rectangles(timer, perimeters, cell_size=375):
+    from google_earth_engine_scraper import count_rectangles_within
+
+    with timer.stage("count_rectangles_within", items=len(perimeters)):
+        counts = [count_rectangles_within(geometry, cell_size, cell_size) for geometry in perimeters.geometry]
+    return counts
+
+
+def fake_feature_functions(client, feature_columns):
+    """date_availability and retrieve_external_features_batch answered by the fake client."""
+    def date_availability(date_str):
+        return client.get_info({name: 7 if name == 'era5_daily' else 1 for name in AVAILABILITY})
+
+    def retrieve_external_features_batch(date_str, observations, availability, include_static=True):
+        ids, lats, lons = (np.array(column) for column in zip(*observations))
+        values = {column: lats + lons + k for k, column in enumerate(feature_columns)}
+        rows = pd.DataFrame(values, columns=feature_columns)
+        rows['observation_id'] = ids
+        return client.get_info(rows)
+
+    return date_availability, retrieve_external_features_batch
+
+
+def bench_feature_fetch(timer, observations, client, work_dir, use_cache=True, batch_size=None):
+    import fetch_gee_external_features_by_obs as fetch
+    from ee_scheduler import RequestScheduler
+    from feature_cache import FeatureCache
+
+    date_availability, retrieve_batch = fake_feature_functions(client, fetch.FEATURE_COLUMNS)
+    scheduler = RequestScheduler(rate=fetch.REQUESTS_PER_SECOND, max_concurrency=fetch.MAX_CONCURRENCY,
+                                 latency_target=4 * client.latency,
+                                 backoff={"throttle": (0.1, 2.0, 8), "transient": (0.05, 1.0, 3)})
+    cache = FeatureCache(os.path.join(work_dir, "feature_cache.sqlite")) if use_cache else None
+    patched = dict(date_availability=date_availability, retrieve_external_features_batch=retrieve_batch,
+                   scheduler=scheduler, feature_cache=cache, static_values=None, weather_cube=None,
+                   completed_count=0, start_time=time.time())
+
+    # progress printing is part of the fetch, but not of the report
+    with mock.patch.multiple(fetch, **patched), contextlib.redirect_stdout(io.StringIO()):
+        with timer.stage("feature fetch", items=len(observations)):
+            features = fetch.main_batched(observations, batch_size=batch_size or fetch.BATCH_SIZE)
+    if cache is not None:
+        cache.close()
+    return features
+
+
+def compare(results, previous):
+    """prints each stage's time against a previous results file."""
+    print(f"compared with {previous.get('commit')} ({previous.get('created')}):")
+    width = max((len(name) for name in results['stages']), default=0)
+    for name, stage in results['stages'].items():
+        if name in previous.get('stages', {}):
+            before = previous['stages'][name]['seconds']
+            ratio = before / stage['seconds'] if stage['seconds'] > 0 else float('inf')
+            print(f"  {name:<{width}}  {before:8.2f}s -> {stage['seconds']:8.2f}s  ({ratio:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark on synthetic VIIRS and perimeter data.")
+    parser.add_argument("--years", nargs="+", default=["2015"])
+    parser.add_argument("--fires", type=int, default=200, help="fires a year")
+    parser.add_argument("--detections", type=int, default=500_000, help="detections a year")
+    parser.add_argument("--perimeters-per-fire", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=None, help="where the synthetic data lives, generated there if missing")
+    parser.add_argument("--join-workers", type=int, default=1)
+    parser.add_argument("--fetch-observations", type=int, default=20_000, help="observations sent through the feature fetch")
+    parser.add_argument("--no-cache", action="store_true", help="fetch without the feature cache")
+    parser.add_argument("--ee-latency", type=float, default=0.05, help="mean seconds per fake Earth Engine call")
+    parser.add_argument("--ee-capacity", type=int, default=20, help="concurrent calls before the fake throttles")
+    parser.add_argument("--ee-error-rate", type=float, default=0.0)
+    parser.add_argument("--out", default=None, help=f"results file, under {RESULTS_DIR} by default")
+    parser.add_argument("--compare", default=None, help="a previous results file to compare against")
+    args = parser.parse_args()
+
+    years = parse_years(args.years)
+    timer = StageTimer()
+    details = StageTimer()
+    skipped = {}
+    generate_seconds = None
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    data_dir = args.data_dir or os.path.join(work_dir, "data")
+
+    def optional(name, fn, *arguments):
+        try:
+            return fn(*arguments)
+        except ImportError as error:
+            skipped[name] = str(error)
+            return None
+
+    try:
+        if not os.path.exists(os.path.join(data_dir, VIIRS_FILE)):
+            start = time.perf_counter()
+            write_dataset(data_dir, years, args.fires, args.detections, args.perimeters_per_fire, seed=args.seed)
+            generate_seconds = time.perf_counter() - start
+            print(f"generated synthetic data in {generate_seconds:.2f}s")
+
+        client = FakeEarthEngine(latency=args.ee_latency, jitter=args.ee_latency / 3, capacity=args.ee_capacity,
+                                 error_rate=args.ee_error_rate, seed=args.seed)
+        for year in years:
+            observations = bench_merge_and_filter(timer, details, year, data_dir, work_dir, args.join_workers)
+            perimeters = gpd.read_file(os.path.join(data_dir, "perimeters", f"US_HIST_FIRE_PERIM_{year}_DD83.shp"), engine="pyogrio")
+
+            fires = optional("create_wildfire_perimeters", bench_create_perimeters, timer, observations, perimeters)
+            if fires is not None:
+                bench_graphs(timer, fires)
+            else:
+                skipped["initialize_graph"] = "needs create_wildfire_perimeters"
+            optional("count_rectangles_within", bench_count_rectangles, timer, perimeters)
+            optional("feature fetch", bench_feature_fetch, timer, observations.head(args.fetch_observations),
+                     client, work_dir, not args.no_cache)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    details.report("merge_and_filter stages:")
+    timer.report("Stage timings:")
+    for name, reason in skipped.items():
+        print(f"  skipped {name}: {reason}")
+
+    def stages(stage_timer):
+        return {name: {'seconds': seconds,
+                       'items': stage_timer.items.get(name),
+                       'per_second': stage_timer.items[name] / seconds if name in stage_timer.items and seconds > 0 else None}
+                for name, seconds in stage_timer.timings.items()}
+
+    results = {
+        'benchmark': 'pipeline',
+        'commit': git_commit(),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': vars(args),
+        'generate_seconds': generate_seconds,
+        'stages': stages(timer),
+        'merge_and_filter_stages': stages(details),
+        'skipped': skipped,
+        'fake_ee': {'calls': client.calls, 'throttled': client.throttled, 'errors': client.errors},
+    }
+
+    out = args.out or os.path.join(RESULTS_DIR, f"pipeline-{results['commit'] or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"results written to {out}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
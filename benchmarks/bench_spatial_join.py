@@ -0,0 +1,74 @@
+"""
+times sjoin_within, gpd.sjoin(predicate="within") over chunks of points on a
+process pool, against a single gpd.sjoin on a year of VIIRS detections and
+its largest perimeters (or on synthetic detections and perimeters when the
+raw data is not available), and checks that both joins return the same
+frame. every run gets its own copy of the perimeters, so the spatial index
+built and cached by one run is not reused by the next.
+
+    python -m benchmarks.bench_spatial_join --year 2015 --processes 1 4
+    python -m benchmarks.bench_spatial_join --synthetic 2000000
+"""
+import argparse
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from spatial_join import sjoin_within
+
+
+def year_data(year):
+    from merge_and_filter import load_largest_perimeters, load_viirs_year
+
+    return load_viirs_year(year), load_largest_perimeters(year)
+
+
+def synthetic_data(n, n_fires=300, seed=0):
+    rng = np.random.default_rng(seed)
+    cx, cy = rng.uniform(-124, -100, n_fires), rng.uniform(30, 48, n_fires)
+
+    # lobed perimeters with a few hundred to a few thousand vertices
+    perimeters = []
+    for i in range(n_fires):
+        angles = np.linspace(0, 2 * np.pi, int(rng.integers(200, 6000)), endpoint=False)
+        radius = 0.1 * (1 + 0.3 * np.sin(3 * angles + i) + 0.02 * rng.standard_normal(len(angles)))
+        perimeters.append(shapely.Polygon(np.column_stack([cx[i] + radius * np.cos(angles), cy[i] + radius * np.sin(angles)])))
+    perimeters = gpd.GeoDataFrame({'uniquefire': [f"F{i}" for i in range(n_fires)]}, geometry=perimeters, crs=4269)
+
+    # half the detections scattered over the west, half around the fires
+    lon, lat = rng.uniform(-124, -100, n), rng.uniform(30, 48, n)
+    burning = rng.integers(0, n_fires, n // 2)
+    lon[:n // 2] = cx[burning] + rng.normal(0, 0.07, n // 2)
+    lat[:n // 2] = cy[burning] + rng.normal(0, 0.07, n // 2)
+    detections = gpd.GeoDataFrame({'FRP': rng.gamma(2.0, 10.0, n)}, geometry=gpd.points_from_xy(lon, lat), crs=4269)
+    return detections, perimeters
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--year", type=int, default=2015)
+    parser.add_argument("--synthetic", type=int, default=None, help="use this many synthetic detections")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1])
+    args = parser.parse_args()
+
+    detections, perimeters = synthetic_data(args.synthetic) if args.synthetic else year_data(args.year)
+    print(f"{len(detections)} detections, {len(perimeters)} perimeters")
+
+    start = time.perf_counter()
+    expected = gpd.sjoin(detections, perimeters.copy(), how="inner", predicate="within")
+    elapsed = time.perf_counter() - start
+    print(f"    gpd.sjoin: {elapsed:.3f}s, {len(expected)} rows ({len(detections) / elapsed:,.0f} points/s)")
+
+    for processes in args.processes:
+        start = time.perf_counter()
+        joined = sjoin_within(detections, perimeters.copy(), processes=processes)
+        elapsed = time.perf_counter() - start
+        print(f"sjoin_within x{processes}: {elapsed:.3f}s, {len(joined)} rows ({len(detections) / elapsed:,.0f} points/s)")
+        pd.testing.assert_frame_equal(joined, expected)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+throughput of the batched spread simulator in cell updates per second (the
+ignition draws simulate makes, one per burning cell and unburned neighbour),
+for the configured grid with members run as batches over worker processes,
+against the same members run one at a time. fails if a certain spread (every
+probability 1) does not reach every cell at its Chebyshev distance from the
+ignition.
+
+    python -m benchmarks.bench_spread_sim --members 64 --batch-size 16 --workers 4
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from spread_sim import CONFIG_PATH, build_layers, load_config, run_ensemble, simulate
+
+
+def certain_spread_ok(shape=(64, 96), duration=3):
+    ignitions = np.array([[0, 0], [shape[0] // 2, shape[1] // 3], [shape[0] - 1, shape[1] - 1]])
+    arrival, _, _ = simulate(np.ones((8,) + shape, dtype=np.float32), ignitions, sum(shape), duration)
+    rows, cols = np.indices(shape)
+    return all(np.array_equal(arrival[m], np.maximum(abs(rows - r), abs(cols - c))) for m, (r, c) in enumerate(ignitions))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default=CONFIG_PATH)
+    parser.add_argument("--members", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=300, help="steps a run, the config's runtime if 0")
+    parser.add_argument("--serial-members", type=int, default=8, help="members of the one-at-a-time baseline")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    cells = int(np.prod(build_layers(config)['elevation'].shape))
+
+    def run(members, batch_size, workers):
+        start = time.perf_counter()
+        arrival, steps_run, updates = run_ensemble(config, members, batch_size, workers, steps=args.steps or None)
+        elapsed = time.perf_counter() - start
+        return elapsed, updates / elapsed, steps_run, updates
+
+    elapsed, rate, steps_run, updates = run(args.members, args.batch_size, args.workers)
+    print(f" batched: {args.members} members on {cells} cells, {steps_run} steps, {updates:,} cell updates "
+          f"in {elapsed:.2f}s ({rate:,.0f} cells/s, batches of {args.batch_size} on {args.workers} workers)")
+    elapsed, serial_rate, steps_run, updates = run(args.serial_members, 1, 1)
+    print(f"  serial: {args.serial_members} members on {cells} cells, {steps_run} steps, {updates:,} cell updates "
+          f"in {elapsed:.2f}s ({serial_rate:,.0f} cells/s)")
+    print(f" speedup: {rate / serial_rate:.2f}x")
+
+    ok = certain_spread_ok()
+    print(f"certain spread: {'ok' if ok else 'FAILED'}")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
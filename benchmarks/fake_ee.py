@@ -0,0 +1,64 @@
+import random
+import threading
+import time
+
+
+class FakeEEException(Exception):
+    """stands in for ee.EEException, carrying the same error messages."""
+
+
+class FakeEarthEngine:
+    """
+    local stand-in for Earth Engine request handling. every call sleeps for a
+    latency drawn around `latency` and fails with Earth Engine's throttling
+    message when more than `capacity` calls are in flight, when more than
+    `rate_limit` calls arrive per second, or at random with `throttle_rate`.
+    `error_rate` injects transient backend errors.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.02, capacity=20, rate_limit=None,
+                 throttle_rate=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.capacity = capacity
+        self.rate_limit = rate_limit
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.in_flight = 0
+        self.calls = 0
+        self.throttled = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._window_start = time.monotonic()
+        self._window_calls = 0
+        self._lock = threading.Lock()
+
+    def _admit(self):
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start, self._window_calls = now, 0
+            self._window_calls += 1
+
+            if (self.in_flight >= self.capacity
+                    or (self.rate_limit is not None and self._window_calls > self.rate_limit)
+                    or self._random.random() < self.throttle_rate):
+                self.throttled += 1
+                raise FakeEEException("Too many concurrent aggregations.")
+            if self._random.random() < self.error_rate:
+                self.errors += 1
+                raise FakeEEException("Internal error.")
+
+            self.in_flight += 1
+            return max(0.0, self._random.gauss(self.latency, self.jitter))
+
+    def get_info(self, payload=None):
+        """simulates one getInfo round trip and echoes the payload back."""
+        latency = self._admit()
+        try:
+            time.sleep(latency)
+            return payload
+        finally:
+            with self._lock:
+                self.in_flight -= 1
@@ -0,0 +1,168 @@
+"""
+synthetic VIIRS archives and fire perimeter shapefiles, laid out like ./data
+so every stage of the pipeline can run without the real downloads.
+
+every fire has a centre, a start day and a duration. its detections spread
+out from the centre over the days it burns, its perimeters are lobed
+polygons of growing size (the largest one contains all of its detections)
+and a share of the detections is background noise away from any fire.
+
+    python -m benchmarks.synthetic --data-dir /tmp/synthetic --years 2015 --fires 200 --detections 500000
+"""
+import argparse
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from merge_and_filter import VIIRS_FILE, parse_years
+
+# detections and fires are drawn from the western US
+LONGITUDES = (-124.0, -100.0)
+LATITUDES = (31.0, 49.0)
+CRS = "EPSG:4326"
+# overpass times (HHMM) of the two VIIRS passes a day
+OVERPASSES = np.array([900, 2100])
+
+
+def synthetic_fires(n_fires, year, seed=0, max_radius=0.15):
+    """one row per fire: uniquefire, centre, start date, duration in days and final radius in degrees."""
+    rng = np.random.default_rng([seed, year])
+    return pd.DataFrame({
+        'uniquefire': [f"{year}-SYN-{i:06d}" for i in range(n_fires)],
+        'lon': rng.uniform(*LONGITUDES, n_fires),
+        'lat': rng.uniform(*LATITUDES, n_fires),
+        'start': pd.Timestamp(f"{year}-01-01") + pd.to_timedelta(rng.integers(0, 330, n_fires), unit='D'),
+        'days': rng.integers(2, 35, n_fires),
+        'radius': max_radius * rng.uniform(0.1, 1.0, n_fires) ** 2,
+    })
+
+
+def lobed_polygon(lon, lat, radius, vertices, phase=0.0, rng=None):
+    """a star-shaped polygon with three lobes and some noise, inscribed radius of at least 0.64 * radius."""
+    rng = rng or np.random.default_rng()
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    r = radius * (1 + 0.2 * np.sin(3 * angles + phase) + 0.05 * rng.random(vertices)) / 1.25
+    return shapely.Polygon(np.column_stack([lon + r * np.cos(angles), lat + r * np.sin(angles)]))
+
+
+def synthetic_perimeters(fires, perimeters_per_fire=2, vertices=(100, 4000), seed=0):
+    """
+    perimeter polygons with the columns of US_HIST_FIRE_PERIM_{year}_DD83. the
+    perimeters of a fire grow towards its final radius, mapped on days spread
+    over its duration.
+    """
+    rng = np.random.default_rng(seed)
+    rows, geometries = [], []
+    for fire in fires.itertuples(index=False):
+        phase = rng.uniform(0, 2 * np.pi)
+        for k in range(perimeters_per_fire):
+            growth = (k + 1) / perimeters_per_fire
+            n_vertices = int(rng.integers(*vertices) * growth) + 8
+            geometries.append(lobed_polygon(fire.lon, fire.lat, fire.radius * growth, n_vertices, phase, rng))
+            mapped = fire.start + pd.Timedelta(days=int(round(growth * fire.days)))
+            rows.append({
+                'agency': 'SYN',
+                'mapmethod': 'Synthetic',
+                'datecurren': mapped.strftime('%Y-%m-%d'),
+                'uniquefire': fire.uniquefire,
+                'fireyear': str(fire.start.year),
+                'incidentna': fire.uniquefire.split('-')[-1],
+                'perimeterd': mapped.strftime('%Y-%m-%d'),
+                'firecode': '',
+                'state': '',
+                'latest': 'Y' if k == perimeters_per_fire - 1 else 'N',
+            })
+    perimeters = gpd.GeoDataFrame(rows, geometry=geometries, crs=CRS)
+    perimeters['gisacres'] = perimeters.to_crs("EPSG:5070").area / 4046.8564224
+    return perimeters
+
+
+def synthetic_viirs(fires, n_detections, background=0.3, seed=0):
+    """
+    VIIRS detections with the columns of the FIRMS archive. a `background`
+    share is scattered over the whole region and year, the rest belong to a
+    fire and lie within its final perimeter, further out the later they burn.
+    """
+    rng = np.random.default_rng(seed)
+    n_background = int(n_detections * background)
+    n_fire = n_detections - n_background
+
+    fire = rng.integers(0, len(fires), n_fire)
+    elapsed = rng.random(n_fire)
+    days = np.floor(elapsed * fires['days'].to_numpy()[fire]).astype(np.int64)
+    # inside the inscribed circle of the final perimeter
+    distance = 0.6 * fires['radius'].to_numpy()[fire] * np.sqrt(elapsed * rng.random(n_fire))
+    angle = rng.uniform(0, 2 * np.pi, n_fire)
+    year = fires['start'].iloc[0].year
+
+    lon = np.concatenate([fires['lon'].to_numpy()[fire] + distance * np.cos(angle), rng.uniform(*LONGITUDES, n_background)])
+    lat = np.concatenate([fires['lat'].to_numpy()[fire] + distance * np.sin(angle), rng.uniform(*LATITUDES, n_background)])
+    dates = np.concatenate([
+        (fires['start'].to_numpy()[fire] + days.astype('timedelta64[D]')).astype('datetime64[D]'),
+        np.datetime64(f"{year}-01-01") + rng.integers(0, 365, n_background).astype('timedelta64[D]'),
+    ])
+    order = np.argsort(dates, kind='stable')
+    lon, lat, dates = lon[order], lat[order], dates[order]
+
+    n = len(lon)
+    hhmm = OVERPASSES[rng.integers(0, len(OVERPASSES), n)] + rng.integers(0, 50, n)
+    frp = rng.gamma(1.5, 8.0, n)
+    return gpd.GeoDataFrame({
+        'LATITUDE': lat,
+        'LONGITUDE': lon,
+        'BRIGHTNESS': 300 + 10 * rng.gamma(2.0, 2.0, n),
+        'SCAN': rng.uniform(0.32, 0.8, n),
+        'TRACK': rng.uniform(0.36, 0.78, n),
+        # shapefiles written here hold dates as text, in the format load_viirs_year filters on
+        'ACQ_DATE': pd.to_datetime(dates).strftime('%Y/%m/%d'),
+        'ACQ_TIME': [f"{t:04d}" for t in hhmm],
+        'SATELLITE': 'N',
+        'INSTRUMENT': 'VIIRS',
+        'CONFIDENCE': rng.choice(['l', 'n', 'h'], n, p=[0.05, 0.8, 0.15]),
+        'VERSION': '2',
+        'BRIGHT_T31': 270 + 20 * rng.random(n),
+        'FRP': frp,
+        'DAYNIGHT': np.where(hhmm < 1500, 'N', 'D'),
+        'TYPE': rng.choice([0, 2], n, p=[0.97, 0.03]),
+    }, geometry=gpd.points_from_xy(lon, lat), crs=CRS)
+
+
+def write_dataset(data_dir, years, n_fires, n_detections, perimeters_per_fire=2, vertices=(100, 4000), background=0.3, seed=0):
+    """
+    writes a VIIRS archive spanning `years` and one perimeter shapefile per
+    year under data_dir, with n_fires fires and n_detections detections a
+    year. returns {year: fires table}.
+    """
+    os.makedirs(os.path.join(data_dir, "perimeters"), exist_ok=True)
+    fires, archives = {}, []
+    for year in years:
+        fires[year] = synthetic_fires(n_fires, year, seed)
+        perimeters = synthetic_perimeters(fires[year], perimeters_per_fire, vertices, seed + year)
+        perimeters.to_file(os.path.join(data_dir, "perimeters", f"US_HIST_FIRE_PERIM_{year}_DD83.shp"), engine="pyogrio")
+        archives.append(synthetic_viirs(fires[year], n_detections, background, seed + year))
+    archive = pd.concat(archives, ignore_index=True)
+    archive.to_file(os.path.join(data_dir, VIIRS_FILE), engine="pyogrio")
+    return fires
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic VIIRS archive and perimeter shapefiles.")
+    parser.add_argument("--data-dir", required=True)
+    parser.add_argument("--years", nargs="+", default=["2015"])
+    parser.add_argument("--fires", type=int, default=200, help="fires a year")
+    parser.add_argument("--detections", type=int, default=500_000, help="detections a year")
+    parser.add_argument("--perimeters-per-fire", type=int, default=2)
+    parser.add_argument("--background", type=float, default=0.3, help="share of detections outside any fire")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    years = parse_years(args.years)
+    write_dataset(args.data_dir, years, args.fires, args.detections, args.perimeters_per_fire, background=args.background, seed=args.seed)
+    print(f"wrote {args.fires} fires and {args.detections} detections a year for {years} to {args.data_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from grid import DEFAULT_GRID, cell_id
+
+DETECTION_INDEX_DIR = "./data_filtered/detection_index"
+
+# Layout of the index (every array is a .npy, memory-mapped on read):
+#   detection_index/manifest.json                   segments, their sources, time range and bucket extent
+#   detection_index/segments/<name>/buckets.npy     sorted ids of the spatial buckets present in the segment
+#   detection_index/segments/<name>/keys.npy        (bucket position << 32 | minute) of every detection, sorted
+#   detection_index/segments/<name>/<column>.npy    detection columns in key order
+#   detection_index/fires/year=2015.parquet         uniquefire -> (segment, position) postings, from the observation store
+#
+# segments are immutable: new archives are added as new segments and compact()
+# merges them, so the index grows without a full rebuild.
+
+# a bucket is a square of BUCKET_CELLS x BUCKET_CELLS grid cells (6 km at 375 m)
+BUCKET_CELLS = 16
+CHUNK_ROWS = 5_000_000
+MINUTE_NS = 60 * 10 ** 9
+TIME_BITS = 32
+COLUMNS = {'LATITUDE': np.float64, 'LONGITUDE': np.float64, 'date_time': np.int64, 'FRP': np.float32, 'source_row': np.int64}
+# degrees between added vertices when a query region is projected onto the grid
+SEGMENTIZE_DEGREES = 0.01
+
+
+def bucket_ids(rows, cols):
+    return cell_id(np.floor_divide(rows, BUCKET_CELLS), np.floor_divide(cols, BUCKET_CELLS))
+
+
+def _expand(starts, stops):
+    """concatenation of the ranges starts[k] .. stops[k], vectorized."""
+    lengths = stops - starts
+    keep = lengths > 0
+    starts, lengths = starts[keep], lengths[keep]
+    if len(lengths) == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return offsets + np.arange(lengths.sum())
+
+
+def build_segment(path, detections, grid=DEFAULT_GRID):
+    """
+    writes one segment for a frame with LATITUDE, LONGITUDE, date_time, FRP and
+    source_row columns. detections are sorted by spatial bucket and then by
+    time, and returns the segment's manifest entry (without its name).
+    """
+    lats = detections['LATITUDE'].to_numpy(np.float64)
+    lons = detections['LONGITUDE'].to_numpy(np.float64)
+    times = detections['date_time'].to_numpy().astype('datetime64[ns]').view(np.int64)
+    rows, cols = grid.snap(lats, lons)
+    buckets = bucket_ids(rows, cols)
+    minutes = times // MINUTE_NS
+    if len(minutes) and (minutes.min() < 0 or minutes.max() >= 1 << TIME_BITS):
+        raise ValueError("detection times must fall between 1970 and 10136")
+
+    order = np.lexsort((minutes, buckets))
+    unique_buckets, positions = np.unique(buckets[order], return_inverse=True)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "buckets.npy"), unique_buckets)
+    np.save(os.path.join(tmp_path, "keys.npy"), (positions.astype(np.int64) << TIME_BITS) | minutes[order])
+    arrays = {'LATITUDE': lats, 'LONGITUDE': lons, 'date_time': times,
+              'FRP': detections['FRP'].to_numpy(), 'source_row': detections['source_row'].to_numpy()}
+    for column, dtype in COLUMNS.items():
+        np.save(os.path.join(tmp_path, f"{column}.npy"), np.ascontiguousarray(arrays[column][order], dtype=dtype))
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+    bucket_rows = np.floor_divide(rows, BUCKET_CELLS)
+    bucket_cols = np.floor_divide(cols, BUCKET_CELLS)
+    return {
+        'rows': int(len(order)),
+        'start': int(times.min()) if len(times) else None, 'end': int(times.max()) if len(times) else None,
+        'bucket_rows': [int(bucket_rows.min()), int(bucket_rows.max())] if len(times) else None,
+        'bucket_cols': [int(bucket_cols.min()), int(bucket_cols.max())] if len(times) else None,
+    }
+
+
+def read_archive_chunks(path, chunk_rows=CHUNK_ROWS):
+    """
+    the VIIRS archive at path as frames of at most chunk_rows detections with
+    the indexed columns. source_row is the feature id, which is also the index
+    of the rows load_viirs_year (and so the observation store) keeps.
+    """
+    import pyogrio
+
+    from merge_and_filter import acquisition_datetimes
+
+    total = pyogrio.read_info(path)['features']
+    for skip in range(0, total, chunk_rows):
+        frame = pyogrio.read_dataframe(path, columns=['LATITUDE', 'LONGITUDE', 'ACQ_DATE', 'ACQ_TIME', 'FRP'],
+                                       read_geometry=False, fid_as_index=True, skip_features=skip, max_features=chunk_rows)
+        yield pd.DataFrame({
+            'LATITUDE': frame['LATITUDE'].to_numpy(np.float64), 'LONGITUDE': frame['LONGITUDE'].to_numpy(np.float64),
+            'date_time': acquisition_datetimes(frame['ACQ_DATE'], frame['ACQ_TIME']).to_numpy(),
+            'FRP': frame['FRP'].to_numpy(np.float32), 'source_row': frame.index.to_numpy(np.int64),
+        })
+
+
+class DetectionIndex:
+    """
+    on-disk spatio-temporal index over VIIRS detections. queries combine a
+    region (lon/lat bbox or polygon), a time range and a uniquefire; the
+    buckets that can hold the region are found with searchsorted on the
+    bucket ids, the time range within each of them with searchsorted on the
+    keys, and only those postings are read from the memory-mapped columns
+    before the exact region and time tests.
+    """
+
+    def __init__(self, root=DETECTION_INDEX_DIR, grid=DEFAULT_GRID):
+        self.root = root
+        self.grid = grid
+        os.makedirs(os.path.join(root, "segments"), exist_ok=True)
+        os.makedirs(os.path.join(root, "fires"), exist_ok=True)
+        manifest_path = os.path.join(root, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as file:
+                self.manifest = json.load(file)
+        else:
+            self.manifest = {'bucket_cells': BUCKET_CELLS, 'next_segment': 0, 'segments': []}
+        if self.manifest['bucket_cells'] != BUCKET_CELLS:
+            raise ValueError(f"{root} was built with {self.manifest['bucket_cells']} cell buckets, not {BUCKET_CELLS}")
+        self._segments = {}
+        self._fires = None
+
+    def __len__(self):
+        return sum(segment['rows'] for segment in self.manifest['segments'])
+
+    def _write_manifest(self):
+        path = os.path.join(self.root, "manifest.json")
+        with open(path + ".tmp", "w") as file:
+            json.dump(self.manifest, file, indent=1)
+        os.replace(path + ".tmp", path)
+
+    def _segment(self, name):
+        if name not in self._segments:
+            directory = os.path.join(self.root, "segments", name)
+            self._segments[name] = {array: np.asarray(np.load(os.path.join(directory, f"{array}.npy"), mmap_mode='r'))
+                                    for array in ['buckets', 'keys'] + list(COLUMNS)}
+        return self._segments[name]
+
+    # --- updates
+
+    def add_detections(self, detections, source, signature=None):
+        """adds a frame of detections (see build_segment) as a new segment; returns its name."""
+        name = f"{self.manifest['next_segment']:06d}"
+        entry = build_segment(os.path.join(self.root, "segments", name), detections, self.grid)
+        entry.update(name=name, source=source, signature=signature)
+        self.manifest['next_segment'] += 1
+        self.manifest['segments'].append(entry)
+        self._write_manifest()
+        return name
+
+    def add_archive(self, path, chunk_rows=CHUNK_ROWS):
+        """
+        indexes a VIIRS archive file, chunk_rows detections a segment. a file
+        already indexed with the same size and modification time is skipped;
+        if it changed, its old segments are replaced.
+        """
+        source = os.path.basename(path)
+        stat = os.stat(path)
+        signature = [stat.st_size, int(stat.st_mtime)]
+        existing = [segment for segment in self.manifest['segments'] if segment['source'] == source]
+        if existing and all(segment['signature'] == signature for segment in existing):
+            return []
+        if existing:
+            self.remove_source(source)
+        return [self.add_detections(chunk, source, signature) for chunk in read_archive_chunks(path, chunk_rows)]
+
+    def remove_source(self, source):
+        """drops the segments of a source and the fire postings into them."""
+        names = {segment['name'] for segment in self.manifest['segments'] if segment['source'] == source}
+        self.manifest['segments'] = [segment for segment in self.manifest['segments'] if segment['name'] not in names]
+        self._write_manifest()
+        for year_path in self._fire_files():
+            postings = pd.read_parquet(year_path)
+            postings[~postings['segment'].isin(names)].to_parquet(year_path, index=False)
+        for name in names:
+            self._segments.pop(name, None)
+            shutil.rmtree(os.path.join(self.root, "segments", name), ignore_errors=True)
+        self._fires = None
+
+    def _fire_files(self):
+        directory = os.path.join(self.root, "fires")
+        return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(".parquet")]
+
+    def add_fire_assignments(self, observations, year, source):
+        """
+        records which detections belong to which uniquefire: observations is a
+        frame with a uniquefire column indexed by the source feature id, like
+        read_observations returns. replaces the postings of `year`.
+        """
+        fids = observations.index.to_numpy(np.int64)
+        found = np.zeros(len(fids), dtype=bool)
+        segment_names = np.empty(len(fids), dtype=object)
+        positions = np.zeros(len(fids), dtype=np.int64)
+        for segment in self.manifest['segments']:
+            if segment['source'] != source:
+                continue
+            source_rows = self._segment(segment['name'])['source_row']
+            order = np.argsort(source_rows, kind='stable')
+            at = np.minimum(np.searchsorted(source_rows[order], fids), max(len(order) - 1, 0))
+            hit = ~found & (len(order) > 0) & (source_rows[order][at] == fids)
+            segment_names[hit] = segment['name']
+            positions[hit] = order[at[hit]]
+            found |= hit
+        if not found.all():
+            print(f"Fire assignments: {(~found).sum()} of {len(fids)} observations of {year} are not in {source}")
+
+        postings = pd.DataFrame({'uniquefire': observations['uniquefire'].astype(str).to_numpy()[found],
+                                 'segment': segment_names[found], 'position': positions[found]})
+        path = os.path.join(self.root, "fires", f"year={int(year)}.parquet")
+        postings.sort_values(['uniquefire', 'segment', 'position']).to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+        self._fires = None
+
+    def compact(self):
+        """
+        merges the segments of each source into one, remapping the fire
+        postings. returns the names of the new segments.
+        """
+        by_source = {}
+        for segment in self.manifest['segments']:
+            by_source.setdefault(segment['source'], []).append(segment)
+        merged_names = []
+        for source, segments in by_source.items():
+            if len(segments) > 1:
+                merged_names.append(self._merge_segments(source, segments))
+        return merged_names
+
+    def _merge_segments(self, source, segments):
+        frames, bases, base = [], {}, 0
+        for segment in segments:
+            arrays = self._segment(segment['name'])
+            frames.append(pd.DataFrame({column: np.asarray(arrays[column]) for column in COLUMNS}))
+            bases[segment['name']] = base
+            base += segment['rows']
+        merged = pd.concat(frames, ignore_index=True)
+        merged['date_time'] = merged['date_time'].to_numpy().view('datetime64[ns]')
+
+        # where each merged row lands in the new segment, from the same sort build_segment does
+        rows, cols = self.grid.snap(merged['LATITUDE'].to_numpy(), merged['LONGITUDE'].to_numpy())
+        order = np.lexsort((merged['date_time'].to_numpy().view(np.int64) // MINUTE_NS, bucket_ids(rows, cols)))
+        new_position = np.empty(len(order), dtype=np.int64)
+        new_position[order] = np.arange(len(order))
+
+        name = f"{self.manifest['next_segment']:06d}"
+        entry = build_segment(os.path.join(self.root, "segments", name), merged, self.grid)
+        entry.update(name=name, source=source, signature=segments[0]['signature'])
+
+        for year_path in self._fire_files():
+            postings = pd.read_parquet(year_path)
+            merging = postings['segment'].isin(bases).to_numpy()
+            if not merging.any():
+                continue
+            base_of = postings.loc[merging, 'segment'].map(bases).to_numpy(np.int64)
+            postings.loc[merging, 'position'] = new_position[base_of + postings.loc[merging, 'position'].to_numpy(np.int64)]
+            postings.loc[merging, 'segment'] = name
+            postings.sort_values(['uniquefire', 'segment', 'position']).to_parquet(year_path + ".tmp", index=False)
+            os.replace(year_path + ".tmp", year_path)
+
+        self.manifest['next_segment'] += 1
+        self.manifest['segments'] = [segment for segment in self.manifest['segments'] if segment['name'] not in bases] + [entry]
+        self._write_manifest()
+        for segment in segments:
+            self._segments.pop(segment['name'], None)
+            shutil.rmtree(os.path.join(self.root, "segments", segment['name']), ignore_errors=True)
+        self._fires = None
+        return name
+
+    # --- queries
+
+    def _fire_postings(self):
+        if self._fires is None:
+            files = self._fire_files()
+            postings = pd.concat([pd.read_parquet(path) for path in files], ignore_index=True) if files else \
+                pd.DataFrame({'uniquefire': [], 'segment': [], 'position': []})
+            postings = postings.sort_values(['uniquefire', 'segment', 'position'], kind='stable').reset_index(drop=True)
+            names, starts, counts = np.unique(postings['uniquefire'].to_numpy(str), return_index=True, return_counts=True)
+            self._fires = (postings, {name: (start, start + count) for name, start, count in zip(names, starts, counts)})
+        return self._fires
+
+    def _region_buckets(self, region):
+        """(bucket row range, bucket col range) that can hold detections in a lon/lat geometry."""
+        projected = self.grid.project_geometry(shapely.segmentize(region, SEGMENTIZE_DEGREES))
+        minx, miny, maxx, maxy = projected.bounds
+        row_min, col_min = self.grid.snap_xy(minx, miny)
+        row_max, col_max = self.grid.snap_xy(maxx, maxy)
+        # a cell of slack for points snapped on a cell edge
+        return (int(np.floor_divide(row_min - 1, BUCKET_CELLS)), int(np.floor_divide(row_max + 1, BUCKET_CELLS))), \
+            (int(np.floor_divide(col_min - 1, BUCKET_CELLS)), int(np.floor_divide(col_max + 1, BUCKET_CELLS)))
+
+    def _candidates(self, segment, arrays, bucket_range, minute_range):
+        """postings of a segment in the buckets of the range and the minutes of the time range."""
+        if minute_range is None and bucket_range is None:
+            return np.arange(segment['rows'], dtype=np.int64)
+        buckets = arrays['buckets']
+        if bucket_range is None:
+            positions = np.arange(len(buckets), dtype=np.int64)
+        else:
+            (row_lo, row_hi), (col_lo, col_hi) = bucket_range
+            row_lo, row_hi = max(row_lo, segment['bucket_rows'][0]), min(row_hi, segment['bucket_rows'][1])
+            col_lo, col_hi = max(col_lo, segment['bucket_cols'][0]), min(col_hi, segment['bucket_cols'][1])
+            if row_lo > row_hi or col_lo > col_hi:
+                return np.zeros(0, dtype=np.int64)
+            bucket_rows = np.arange(row_lo, row_hi + 1)
+            positions = _expand(np.searchsorted(buckets, cell_id(bucket_rows, col_lo)),
+                                np.searchsorted(buckets, cell_id(bucket_rows, col_hi), side='right'))
+        first_minute, last_minute = minute_range or (0, (1 << TIME_BITS) - 1)
+        keys = arrays['keys']
+        return _expand(np.searchsorted(keys, (positions << TIME_BITS) | first_minute),
+                       np.searchsorted(keys, (positions << TIME_BITS) | last_minute, side='right'))
+
+    def query(self, bbox=None, polygon=None, start=None, end=None, uniquefire=None):
+        """
+        detections in a (minx, miny, maxx, maxy) lon/lat bbox and/or a lon/lat
+        polygon (boundary included), acquired in [start, end) and belonging to
+        a uniquefire (one name or a list), any of them optional. returns a
+        DataFrame sorted by date_time with LATITUDE, LONGITUDE, date_time, FRP,
+        source, source_row and, for uniquefire queries, uniquefire.
+        """
+        region = None
+        if bbox is not None:
+            region = shapely.box(*bbox)
+        if polygon is not None:
+            region = polygon if region is None else shapely.intersection(region, polygon)
+        start_ns = pd.Timestamp(start).value if start is not None else None
+        end_ns = pd.Timestamp(end).value if end is not None else None
+        minute_range = None
+        if start is not None or end is not None:
+            minute_range = (start_ns // MINUTE_NS if start is not None else 0,
+                            (end_ns - 1) // MINUTE_NS if end is not None else (1 << TIME_BITS) - 1)
+        bucket_range = self._region_buckets(region) if region is not None else None
+        if region is not None:
+            shapely.prepare(region)
+
+        fires = None
+        if uniquefire is not None:
+            postings, slices = self._fire_postings()
+            names = [uniquefire] if isinstance(uniquefire, str) else list(uniquefire)
+            rows = _expand(np.array([slices.get(name, (0, 0))[0] for name in names], dtype=np.int64),
+                           np.array([slices.get(name, (0, 0))[1] for name in names], dtype=np.int64))
+            fires = postings.iloc[rows]
+
+        frames = []
+        for segment in self.manifest['segments']:
+            if segment['rows'] == 0:
+                continue
+            if start_ns is not None and segment['end'] < start_ns or end_ns is not None and segment['start'] >= end_ns:
+                continue
+            arrays = self._segment(segment['name'])
+            names = None
+            if fires is not None:
+                in_segment = fires[fires['segment'] == segment['name']]
+                if len(in_segment) == 0:
+                    continue
+                positions = in_segment['position'].to_numpy(np.int64)
+                names = in_segment['uniquefire'].to_numpy()
+            else:
+                positions = self._candidates(segment, arrays, bucket_range, minute_range)
+            if len(positions) == 0:
+                continue
+
+            lats, lons, times = arrays['LATITUDE'][positions], arrays['LONGITUDE'][positions], arrays['date_time'][positions]
+            keep = np.ones(len(positions), dtype=bool)
+            if start_ns is not None:
+                keep &= times >= start_ns
+            if end_ns is not None:
+                keep &= times < end_ns
+            if region is not None:
+                keep[keep] = shapely.intersects_xy(region, lons[keep], lats[keep])
+            positions = positions[keep]
+            frame = pd.DataFrame({
+                'LATITUDE': lats[keep], 'LONGITUDE': lons[keep], 'date_time': times[keep].view('datetime64[ns]'),
+                'FRP': arrays['FRP'][positions], 'source': segment['source'], 'source_row': arrays['source_row'][positions],
+            })
+            if names is not None:
+                frame['uniquefire'] = names[keep]
+            frames.append(frame)
+
+        if not frames:
+            columns = ['LATITUDE', 'LONGITUDE', 'date_time', 'FRP', 'source', 'source_row'] + (['uniquefire'] if fires is not None else [])
+            return pd.DataFrame(columns=columns)
+        result = pd.concat(frames, ignore_index=True)
+        return result.sort_values(['date_time', 'source_row'], kind='stable').reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from filtered_store import OBSERVATIONS_DIR, read_observations
+    from merge_and_filter import DATA_DIR, VIIRS_FILE, parse_years
+
+    parser = argparse.ArgumentParser(description="Build, update and query the spatio-temporal index of VIIRS detections.")
+    parser.add_argument("--root", default=DETECTION_INDEX_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="index new or changed archive files")
+    add.add_argument("archives", nargs="*", default=[os.path.join(DATA_DIR, VIIRS_FILE)])
+    add.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    assign = commands.add_parser("assign", help="record uniquefire postings from the observation store")
+    assign.add_argument("--years", nargs="+", default=["2015"])
+    assign.add_argument("--store-dir", default=OBSERVATIONS_DIR)
+    assign.add_argument("--source", default=VIIRS_FILE)
+    commands.add_parser("compact", help="merge the segments of each source")
+    query = commands.add_parser("query")
+    query.add_argument("--bbox", type=float, nargs=4, metavar=("MINX", "MINY", "MAXX", "MAXY"))
+    query.add_argument("--start")
+    query.add_argument("--end")
+    query.add_argument("--uniquefire")
+    args = parser.parse_args()
+
+    index = DetectionIndex(args.root)
+    if args.command == "add":
+        for archive in args.archives:
+            added = index.add_archive(archive, args.chunk_rows)
+            print(f"{archive}: {len(added)} new segments" if added else f"{archive}: already indexed")
+        print(f"{len(index)} detections in {len(index.manifest['segments'])} segments")
+    elif args.command == "assign":
+        for year in parse_years(args.years):
+            observations = read_observations(args.store_dir, columns=['uniquefire'], years=year)
+            index.add_fire_assignments(observations, year, args.source)
+            print(f"{year}: {len(observations)} fire assignments")
+    elif args.command == "compact":
+        merged = index.compact()
+        print(f"compacted into segments {', '.join(merged)}" if merged else "nothing to compact")
+    else:
+        started = time.perf_counter()
+        result = index.query(args.bbox, None, args.start, args.end, args.uniquefire)
+        print(result)
+        print(f"{len(result)} detections in {1000 * (time.perf_counter() - started):.1f} ms")
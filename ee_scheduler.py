@@ -0,0 +1,186 @@
+import random
+import re
+import threading
+import time
+
+SUCCESS = 'success'
+THROTTLE = 'throttle'
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+
+# patterns of Earth Engine / HTTP error messages, matched case-insensitively
+THROTTLE_PATTERN = re.compile(r'\b429\b|too many requests|too many concurrent|quota|rate limit|resource exhausted', re.IGNORECASE)
+TRANSIENT_PATTERN = re.compile(r'\b50[0234]\b|timed out|timeout|deadline|internal error|service unavailable|connection', re.IGNORECASE)
+
+# (base seconds, cap seconds, max retries) per error type
+BACKOFF = {
+    THROTTLE: (2.0, 60.0, 6),
+    TRANSIENT: (0.5, 10.0, 3),
+}
+
+
+def classify_error(error):
+    """
+    sorts an exception into throttle (back off hard, shrink concurrency),
+    transient (retry soon) or permanent (do not retry).
+    """
+    message = str(error)
+    if THROTTLE_PATTERN.search(message):
+        return THROTTLE
+    if isinstance(error, (TimeoutError, ConnectionError)) or TRANSIENT_PATTERN.search(message):
+        return TRANSIENT
+    if isinstance(error, (ValueError, KeyError, TypeError, IndexError)):
+        # missing data for a date or a malformed response, retrying won't help
+        return PERMANENT
+    return TRANSIENT
+
+
+class TokenBucket:
+    """blocking token bucket allowing `rate` tokens per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, cost=1):
+        cost = min(cost, self.capacity)
+        while True:
+            with self._lock:
+                now = self._clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                wait = (cost - self.tokens) / self.rate
+            self._sleep(wait)
+
+
+class AIMDLimiter:
+    """
+    concurrency limit with additive increase / multiplicative decrease.
+
+    every success grows the limit by `increase / limit` (about +increase per
+    window of requests). a throttle multiplies it by `decrease`, and a success
+    slower than `latency_target` multiplies it by `latency_decrease`. decreases
+    are applied at most once per cooldown (by default the smoothed request
+    latency) so a burst of failures from the same window only counts once.
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=40, increase=1.0, decrease=0.5,
+                 latency_target=None, latency_decrease=0.9, cooldown=None, clock=time.monotonic):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.latency_decrease = latency_decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.smoothed_latency = None
+        self._clock = clock
+        self._last_decrease = float('-inf')
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def _shrink(self, factor):
+        now = self._clock()
+        cooldown = self.cooldown if self.cooldown is not None else (self.smoothed_latency or 0.0)
+        if now - self._last_decrease >= cooldown:
+            self.limit = max(self.minimum, self.limit * factor)
+            self._last_decrease = now
+
+    def release(self, outcome, latency):
+        with self._condition:
+            self.in_flight -= 1
+            if outcome == THROTTLE:
+                self._shrink(self.decrease)
+            elif outcome == SUCCESS:
+                if self.smoothed_latency is None:
+                    self.smoothed_latency = latency
+                else:
+                    self.smoothed_latency = 0.8 * self.smoothed_latency + 0.2 * latency
+                if self.latency_target is not None and latency > self.latency_target:
+                    self._shrink(self.latency_decrease)
+                else:
+                    self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            self._condition.notify_all()
+
+
+class RequestScheduler:
+    """
+    runs Earth Engine calls through a shared token bucket and AIMD concurrency
+    limit, retrying with backoff chosen by the error type. one scheduler is
+    meant to be shared by every worker thread.
+    """
+
+    def __init__(self, rate=20.0, burst=None, initial_concurrency=8, max_concurrency=40,
+                 latency_target=None, backoff=BACKOFF, clock=time.monotonic, sleep=time.sleep, seed=None):
+        self.bucket = TokenBucket(rate, burst, clock=clock, sleep=sleep)
+        self.limiter = AIMDLimiter(initial=initial_concurrency, maximum=max_concurrency,
+                                   latency_target=latency_target, clock=clock)
+        self.backoff = backoff
+        self._clock = clock
+        self._sleep = sleep
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {SUCCESS: 0, THROTTLE: 0, TRANSIENT: 0, PERMANENT: 0}
+        self.total_latency = 0.0
+
+    def _record(self, outcome, latency):
+        with self._lock:
+            self.counts[outcome] += 1
+            self.total_latency += latency
+
+    def backoff_time(self, kind, attempt):
+        """full-jitter exponential backoff for the given error type and attempt (1-based)."""
+        base, cap, _ = self.backoff[kind]
+        with self._lock:
+            return self._random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+    def call(self, fn, *args, cost=1, **kwargs):
+        """calls fn(*args, **kwargs), retrying throttled and transient failures."""
+        attempts = {THROTTLE: 0, TRANSIENT: 0}
+        while True:
+            self.bucket.acquire(cost)
+            self.limiter.acquire()
+            start = self._clock()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as error:
+                latency = self._clock() - start
+                kind = classify_error(error)
+                self.limiter.release(kind, latency)
+                self._record(kind, latency)
+                if kind == PERMANENT:
+                    raise
+                attempts[kind] += 1
+                if attempts[kind] > self.backoff[kind][2]:
+                    raise
+                self._sleep(self.backoff_time(kind, attempts[kind]))
+                continue
+
+            latency = self._clock() - start
+            self.limiter.release(SUCCESS, latency)
+            self._record(SUCCESS, latency)
+            return result
+
+    def summary(self):
+        with self._lock:
+            calls = sum(self.counts.values())
+            mean_latency = self.total_latency / calls if calls else 0.0
+            counts = dict(self.counts)
+        return (f"Scheduler: concurrency limit {self.limiter.limit:.1f}, {counts[SUCCESS]} ok, "
+                f"{counts[THROTTLE]} throttled, {counts[TRANSIENT]} transient, {counts[PERMANENT]} permanent, "
+                f"mean latency {mean_latency:.2f}s")
@@ -0,0 +1,185 @@
+import json
+import os
+from multiprocessing.pool import ThreadPool
+
+import ee
+import numpy as np
+import pandas as pd
+
+ERA5_DIR = "./data_filtered/era5"
+ERA5_COLLECTION = 'ECMWF/ERA5/DAILY'
+ERA5_STEP_DEG = 0.25
+
+ERA5_BANDS = ['total_precipitation', 'dewpoint_2m_temperature', 'mean_2m_air_temperature',
+              'u_component_of_wind_10m', 'v_component_of_wind_10m']
+WEATHER_COLUMNS = (
+    [f'precipitation_day_{i}' for i in range(1, 8)]
+    + [f'humidity_day_{i}' for i in range(1, 8)]
+    + ['mean_2m_air_temperature', 'u_component_of_wind_10m', 'v_component_of_wind_10m']
+)
+NODATA = -9999.0
+
+
+def weather_days(date_str):
+    """
+    the ERA5 days behind an observation date, oldest first. the 7-day window
+    of retrieve_external_features is the seven days before the date and the
+    single-day bands come from the day before.
+    """
+    date = pd.Timestamp(date_str).normalize()
+    return [date - pd.Timedelta(days=offset) for offset in range(7, 0, -1)]
+
+
+class ERA5Cube:
+    """
+    daily ERA5 rasters for one region, stored as one (bands, rows, cols)
+    float32 .npy per day and memory-mapped on read. every day is downloaded
+    once and then serves all observations of every date that needs it.
+    """
+
+    def __init__(self, bounds, root=ERA5_DIR, step=ERA5_STEP_DEG):
+        min_lon, min_lat, max_lon, max_lat = bounds
+        self.step = step
+        # ERA5 pixel centres sit on multiples of the step. lon_min / lat_max are
+        # the centres of the first column / row, snapped outwards with a cell
+        # of margin for interpolation
+        self.lon_min = (np.floor(min_lon / step) - 1) * step
+        self.lat_max = (np.ceil(max_lat / step) + 1) * step
+        self.width = int(round(((np.ceil(max_lon / step) + 1) * step - self.lon_min) / step)) + 1
+        self.height = int(round((self.lat_max - (np.floor(min_lat / step) - 1) * step) / step)) + 1
+
+        name = f"{self.lon_min:.2f}_{self.lat_max:.2f}_{self.width}x{self.height}"
+        self.root = os.path.join(root, name)
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, "grid.json"), "w") as file:
+            json.dump({"lon_min": self.lon_min, "lat_max": self.lat_max, "step": step,
+                       "width": self.width, "height": self.height, "bands": ERA5_BANDS}, file)
+        self._days = {}
+
+    @classmethod
+    def for_observations(cls, observations, root=ERA5_DIR):
+        bounds = (observations['LONGITUDE'].min(), observations['LATITUDE'].min(),
+                  observations['LONGITUDE'].max(), observations['LATITUDE'].max())
+        return cls(bounds, root)
+
+    def _day_path(self, day):
+        return os.path.join(self.root, f"{pd.Timestamp(day):%Y%m%d}.npy")
+
+    def _missing_path(self, day):
+        return os.path.join(self.root, f"{pd.Timestamp(day):%Y%m%d}.missing")
+
+    def fetch_day(self, day):
+        """downloads one day of ERA5 bands for the region with a single computePixels call."""
+        start = ee.Date(pd.Timestamp(day).strftime('%Y-%m-%d'))
+        collection = ee.ImageCollection(ERA5_COLLECTION).filterDate(start, start.advance(1, 'day'))
+        if collection.size().getInfo() == 0:
+            raise ValueError(f"No ERA5 data available for {pd.Timestamp(day):%Y-%m-%d}.")
+        image = collection.first().select(ERA5_BANDS).toFloat().unmask(NODATA)
+        request = {
+            'expression': image,
+            'fileFormat': 'NUMPY_NDARRAY',
+            'grid': {
+                'dimensions': {'width': self.width, 'height': self.height},
+                # the transform gives the outer corner of the first pixel, half a step from its centre
+                'affineTransform': {'scaleX': self.step, 'shearX': 0, 'translateX': self.lon_min - self.step / 2,
+                                    'shearY': 0, 'scaleY': -self.step, 'translateY': self.lat_max + self.step / 2},
+                'crsCode': 'EPSG:4326',
+            },
+        }
+        pixels = ee.data.computePixels(request)
+        cube = np.stack([pixels[band].astype(np.float32) for band in ERA5_BANDS])
+        cube[cube == NODATA] = np.nan
+        return cube
+
+    def ensure_days(self, days, scheduler=None, threads=8):
+        """downloads every day not yet on disk. days without ERA5 data are remembered as missing."""
+        todo = sorted({pd.Timestamp(day).normalize() for day in days})
+        todo = [day for day in todo if not os.path.exists(self._day_path(day)) and not os.path.exists(self._missing_path(day))]
+
+        def fetch(day):
+            try:
+                # a size check and the computePixels call
+                cube = scheduler.call(self.fetch_day, day, cost=2) if scheduler is not None else self.fetch_day(day)
+            except ValueError as e:
+                # permanent, don't ask again on the next run
+                print(f"ERA5 cube: {e}")
+                open(self._missing_path(day), 'w').close()
+                return False
+            except Exception as e:
+                print(f"ERA5 cube: failed to fetch {day:%Y-%m-%d}: {e}")
+                return False
+            temporary_path = self._day_path(day) + ".tmp.npy"
+            np.save(temporary_path, cube)
+            os.replace(temporary_path, self._day_path(day))
+            return True
+
+        with ThreadPool(threads) as pool:
+            fetched = sum(pool.map(fetch, todo))
+        print(f"ERA5 cube: fetched {fetched} of {len(todo)} missing days into {self.root}")
+
+    def day(self, day):
+        """memory-mapped (bands, rows, cols) array for a day, or None if unavailable."""
+        day = pd.Timestamp(day).normalize()
+        if day not in self._days:
+            path = self._day_path(day)
+            self._days[day] = np.load(path, mmap_mode='r') if os.path.exists(path) else None
+        return self._days[day]
+
+    def has_date(self, date_str):
+        return all(self.day(day) is not None for day in weather_days(date_str))
+
+    def _pixel_coords(self, lats, lons):
+        # fractional position relative to the pixel centres, the first of which are lon_min / lat_max
+        x = (np.asarray(lons, dtype=np.float64) - self.lon_min) / self.step
+        y = (self.lat_max - np.asarray(lats, dtype=np.float64)) / self.step
+        return y, x
+
+    def sample(self, day, lats, lons, bands=None):
+        """
+        bilinear interpolation of a day's bands at the given points, as an
+        (n, bands) array. points next to masked pixels fall back to the
+        nearest pixel.
+        """
+        cube = self.day(day)
+        band_indices = [ERA5_BANDS.index(band) for band in (bands or ERA5_BANDS)]
+        if cube is None:
+            return np.full((len(lats), len(band_indices)), np.nan, dtype=np.float32)
+
+        y, x = self._pixel_coords(lats, lons)
+        i0 = np.clip(np.floor(y).astype(np.int64), 0, self.height - 2)
+        j0 = np.clip(np.floor(x).astype(np.int64), 0, self.width - 2)
+        wy = np.clip(y - i0, 0.0, 1.0)[:, None]
+        wx = np.clip(x - j0, 0.0, 1.0)[:, None]
+
+        data = cube[band_indices]
+        top_left = data[:, i0, j0].T
+        top_right = data[:, i0, j0 + 1].T
+        bottom_left = data[:, i0 + 1, j0].T
+        bottom_right = data[:, i0 + 1, j0 + 1].T
+        values = ((1 - wy) * ((1 - wx) * top_left + wx * top_right)
+                  + wy * ((1 - wx) * bottom_left + wx * bottom_right))
+
+        nan_rows = np.isnan(values).any(axis=1)
+        if nan_rows.any():
+            i = np.clip(np.rint(y[nan_rows]).astype(np.int64), 0, self.height - 1)
+            j = np.clip(np.rint(x[nan_rows]).astype(np.int64), 0, self.width - 1)
+            values[nan_rows] = data[:, i, j].T
+        return values.astype(np.float32)
+
+    def features_for_date(self, date_str, lats, lons, index=None):
+        """
+        the weather columns of retrieve_external_features for every observation
+        of one date, looked up in a single vectorized pass per ERA5 day.
+        """
+        days = weather_days(date_str)
+        columns = {}
+        for i, day in enumerate(days, start=1):
+            precipitation, dewpoint = self.sample(day, lats, lons, ['total_precipitation', 'dewpoint_2m_temperature']).T
+            columns[f'precipitation_day_{i}'] = precipitation
+            columns[f'humidity_day_{i}'] = dewpoint
+
+        single_day = self.sample(days[-1], lats, lons, ['mean_2m_air_temperature', 'u_component_of_wind_10m', 'v_component_of_wind_10m'])
+        columns['mean_2m_air_temperature'] = single_day[:, 0]
+        columns['u_component_of_wind_10m'] = single_day[:, 1]
+        columns['v_component_of_wind_10m'] = single_day[:, 2]
+        return pd.DataFrame(columns, index=index)[WEATHER_COLUMNS]
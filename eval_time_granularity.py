@@ -1,22 +1,14 @@
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-import pickle
 
-file = 'data_filtered/filtered_data_2015.pkl'
+from revisit_stats import load_overpasses, overpass_gaps
 
-with open (file, 'rb') as file:
-    filtered_data = pickle.load(file)
-grouped = filtered_data.groupby('uniquefire')['date_time'].unique()
+filtered_data = load_overpasses(years=2015)
 
-def calculate_time_diffs(dates):
-    sorted_dates = np.sort(dates)
-    diffs = np.diff(sorted_dates)
-    return diffs
-
-time_diffs = grouped.apply(calculate_time_diffs)
-
-all_diffs = np.concatenate(time_diffs.to_list())
+# sorted gaps between the overpasses of every fire, in one vectorized pass
+# (see revisit_stats.py for the per-fire and per-year summary tables)
+all_diffs = overpass_gaps(filtered_data)['gap'].to_numpy()
 
 hours_diffs = all_diffs.astype('timedelta64[h]').astype(int)
 
@@ -28,4 +20,4 @@ plt.hist(hd[hd['diffs'] < 100], bins=50, edgecolor='k', alpha=0.7)
 plt.xlabel('Hours between observations')
 plt.ylabel('Count')
 plt.title('Distribution of hours between observations')
-plt.show()
\ No newline at end of file
+plt.show()
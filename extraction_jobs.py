@@ -0,0 +1,214 @@
+import glob
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+JOBS_DIR = "./data_filtered/jobs"
+
+# observations that failed this many runs are not retried again
+MAX_ATTEMPTS = 3
+# rows buffered before a shard is written
+SHARD_SIZE = 1000
+# tasks submitted to the worker pool but not yet consumed
+MAX_IN_FLIGHT = 200
+
+
+class ShardStore:
+    """
+    append-only store of completed feature rows for one extraction job.
+
+    every append becomes its own parquet shard. ResultSink buffers completed
+    rows and appends them SHARD_SIZE rows at a time, so a crash loses the
+    batches still in flight and up to SHARD_SIZE finished rows not yet
+    written; reruns fetch those again. failures go to failures.jsonl
+    together with the error, and observations that keep failing are not
+    retried.
+    """
+
+    def __init__(self, root, max_attempts=MAX_ATTEMPTS):
+        self.root = root
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._next_shard = len(self._shard_files())
+
+    def _shard_files(self):
+        return sorted(glob.glob(os.path.join(self.root, "shard-*.parquet")))
+
+    @property
+    def failures_file(self):
+        return os.path.join(self.root, "failures.jsonl")
+
+    def append(self, features_df):
+        """writes one batch of completed rows as a new shard."""
+        if features_df is None or len(features_df) == 0:
+            return None
+        with self._lock:
+            path = os.path.join(self.root, f"shard-{self._next_shard:06d}.parquet")
+            self._next_shard += 1
+        # write then rename, so a partially written shard is never picked up
+        temporary_path = path + ".tmp"
+        features_df.to_parquet(temporary_path, index=False)
+        os.replace(temporary_path, path)
+        return path
+
+    def record_failures(self, observation_ids, error):
+        """appends one failure record per observation."""
+        if len(observation_ids) == 0:
+            return
+        timestamp = time.time()
+        lines = [json.dumps({"observation_id": int(observation_id), "error": str(error), "time": timestamp}) for observation_id in observation_ids]
+        with self._lock, open(self.failures_file, "a") as file:
+            file.write("\n".join(lines) + "\n")
+
+    def completed_ids(self):
+        """observation ids that already have a row in some shard."""
+        ids = set()
+        for path in self._shard_files():
+            ids.update(pd.read_parquet(path, columns=["observation_id"])["observation_id"].tolist())
+        return ids
+
+    def failure_counts(self):
+        """number of recorded failed attempts per observation id."""
+        counts = {}
+        if not os.path.exists(self.failures_file):
+            return counts
+        with open(self.failures_file) as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                observation_id = json.loads(line)["observation_id"]
+                counts[observation_id] = counts.get(observation_id, 0) + 1
+        return counts
+
+    def permanently_failed_ids(self):
+        return {observation_id for observation_id, count in self.failure_counts().items() if count >= self.max_attempts}
+
+    def pending(self, observations):
+        """drops observations that are already done or have failed too often."""
+        skip = self.completed_ids() | self.permanently_failed_ids()
+        pending = observations[~observations["observation_id"].isin(skip)]
+        print(f"Job {self.root}: {len(observations) - len(pending)} of {len(observations)} observations already done or permanently failed")
+        return pending
+
+    def assemble(self):
+        """concatenates every shard into the final feature table."""
+        shards = [pd.read_parquet(path) for path in self._shard_files()]
+        if not shards:
+            return pd.DataFrame()
+        result_df = pd.concat(shards, ignore_index=True)
+        # keep the latest row should an observation ever be written twice
+        return result_df.drop_duplicates(subset="observation_id", keep="last").reset_index(drop=True)
+
+    def write_parquet(self, path):
+        """
+        streams every shard into one parquet file with a single shard in
+        memory at a time, keeping the latest row of an observation written
+        twice like assemble.
+        """
+        files = self._shard_files()
+        if not files:
+            pq.write_table(pa.table({}), path)
+            return path
+
+        # the latest row per observation is decided from the id column alone
+        ids = [pq.read_table(file, columns=["observation_id"])["observation_id"].to_numpy() for file in files]
+        all_ids = np.concatenate(ids)
+        _, first_from_end = np.unique(all_ids[::-1], return_index=True)
+        latest = np.zeros(len(all_ids), dtype=bool)
+        latest[len(all_ids) - 1 - first_from_end] = True
+        masks = np.split(latest, np.cumsum([len(shard_ids) for shard_ids in ids])[:-1])
+
+        # all-null columns of a shard are typed null, promote them to the other shards' types
+        schema = pa.unify_schemas([pq.read_schema(file) for file in files], promote_options="permissive")
+        temporary_path = path + ".tmp"
+        with pq.ParquetWriter(temporary_path, schema) as writer:
+            for file, mask in zip(files, masks):
+                table = pq.read_table(file).filter(pa.array(mask))
+                writer.write_table(table.select(schema.names).cast(schema))
+        os.replace(temporary_path, path)
+        return path
+
+
+class ResultSink:
+    """
+    collects feature batches as they complete. rows are buffered and written
+    to the ShardStore every `shard_size` rows, and expected observations that
+    are missing from a batch are recorded as failures. without a store the
+    batches are kept in memory.
+    """
+
+    def __init__(self, job_store=None, shard_size=SHARD_SIZE):
+        self.job_store = job_store
+        self.shard_size = shard_size
+        self._buffer = []
+        self._buffered_rows = 0
+        self._kept = []
+
+    def add(self, features_df, expected_ids=(), error="retries exhausted"):
+        completed_ids = set()
+        if features_df is not None and len(features_df) > 0:
+            completed_ids = set(features_df["observation_id"].tolist())
+            self._buffer.append(features_df)
+            self._buffered_rows += len(features_df)
+
+        missing_ids = [observation_id for observation_id in expected_ids if observation_id not in completed_ids]
+        if self.job_store is not None:
+            self.job_store.record_failures(missing_ids, error)
+        if self._buffered_rows >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        features_df = pd.concat(self._buffer, ignore_index=True)
+        self._buffer, self._buffered_rows = [], 0
+        if self.job_store is None:
+            self._kept.append(features_df)
+        else:
+            self.job_store.append(features_df)
+
+    def close(self):
+        """
+        flushes what is left. returns the job store, whose shards
+        filtered_store.write_features streams to disk, or without one the
+        full feature table.
+        """
+        self.flush()
+        if self.job_store is not None:
+            return self.job_store
+        return pd.concat(self._kept, ignore_index=True) if self._kept else pd.DataFrame()
+
+
+def stream_tasks(pool, fn, argument_tuples, window=MAX_IN_FLIGHT):
+    """
+    applies fn to each tuple of arguments on the pool, keeping at most `window`
+    tasks in flight. the input is consumed lazily and (arguments, result) pairs
+    are yielded as tasks finish, so memory does not grow with the input size.
+    a task that raises yields its exception as the result.
+    """
+    completed = queue.Queue()
+    in_flight = 0
+
+    for arguments in argument_tuples:
+        if in_flight >= window:
+            yield completed.get()
+            in_flight -= 1
+        pool.apply_async(
+            fn, arguments,
+            callback=lambda result, arguments=arguments: completed.put((arguments, result)),
+            error_callback=lambda error, arguments=arguments: completed.put((arguments, error)),
+        )
+        in_flight += 1
+
+    while in_flight:
+        yield completed.get()
+        in_flight -= 1
@@ -0,0 +1,108 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from grid import DEFAULT_GRID
+
+# cells are rows/cols of the shared projected grid; the name changes with the grid
+# and with the definition of a cached feature, so a cache keyed on another cell
+# layout or holding values of another definition is never read back
+CACHE_FILE = "./data_filtered/feature_cache_grid5070_v2.sqlite"
+
+# layers that do not change with time are keyed by cell only
+STATIC_DATASETS = ('elevation', 'landcover', 'road_density')
+STATIC_DATE = ''
+
+
+def snap_to_cell(lat, lon):
+    """integer (row, col) of the 375 m grid cell containing a point."""
+    return DEFAULT_GRID.snap_point(lat, lon)
+
+
+class FeatureCache:
+    """
+    persistent cache of external feature values keyed by (cell, date, dataset),
+    backed by SQLite with an in-process LRU in front of it. safe to share
+    between threads.
+    """
+
+    def __init__(self, path=CACHE_FILE, lru_size=100_000):
+        self.path = path
+        self.lru_size = lru_size
+        self.hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS features ("
+            "cell_row INTEGER, cell_col INTEGER, date TEXT, dataset TEXT, value REAL, "
+            "PRIMARY KEY (cell_row, cell_col, date, dataset)) WITHOUT ROWID"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def _date_key(dataset, date):
+        return STATIC_DATE if dataset in STATIC_DATASETS else date
+
+    def _lru_get(self, key):
+        values = self._lru.get(key)
+        if values is not None:
+            self._lru.move_to_end(key)
+        return values
+
+    def _lru_put(self, key, values):
+        self._lru[key] = values
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def lookup(self, cell, date, datasets):
+        """
+        returns {dataset: value} for the requested datasets that are cached for
+        this cell and date. missing values are never cached, so a dataset that
+        came back empty is a miss and is fetched again.
+        """
+        key = (cell, date)
+        with self._lock:
+            values = self._lru_get(key)
+            if values is None:
+                rows = self._connection.execute(
+                    "SELECT dataset, value FROM features WHERE cell_row = ? AND cell_col = ? AND date IN (?, ?) AND value IS NOT NULL",
+                    (cell[0], cell[1], date, STATIC_DATE),
+                ).fetchall()
+                values = {dataset: value for dataset, value in rows}
+                self._lru_put(key, values)
+        return {dataset: values[dataset] for dataset in datasets if dataset in values}
+
+    def store(self, cell, date, values):
+        """
+        stores {dataset: value} for a cell and date. static datasets ignore the
+        date. None and NaN values are skipped: they also stand for failed
+        requests, which must not turn into permanent hits.
+        """
+        values = {dataset: float(value) for dataset, value in values.items() if value is not None and value == value}
+        rows = [(cell[0], cell[1], self._date_key(dataset, date), dataset, value) for dataset, value in values.items()]
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?)", rows)
+            self._connection.commit()
+            cached = self._lru_get((cell, date))
+            if cached is not None:
+                cached.update(values)
+
+    def record(self, hit, n=1):
+        with self._lock:
+            if hit:
+                self.hits += n
+            else:
+                self.misses += n
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0.0
+        return f"Cache: {self.hits} hits / {self.misses} misses ({rate:.1f}% hit rate)"
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
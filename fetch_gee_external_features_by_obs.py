@@ -1,4 +1,4 @@
-import pickle
+import os
 import sqlite3
 import pandas as pd
 import numpy as np
@@ -16,19 +16,59 @@ import threading
 import time
 from IPython.display import clear_output
 
-service_account = 'ping-gee@ee-supercharge-naturesnotebook.iam.gserviceaccount.com'
-credentials = ee.ServiceAccountCredentials(service_account, 'ee-supercharge-naturesnotebook-5b165b3dae23.json')
-ee.Initialize(credentials)
-
-with open ('data_filtered/filtered_data_2015_protocol4.pkl', 'rb') as file:
-    filtered_data = pickle.load(file)
+from multiprocessing.pool import ThreadPool
+
+from ee_scheduler import RequestScheduler
+from era5_cube import WEATHER_COLUMNS, ERA5Cube, weather_days
+from extraction_jobs import JOBS_DIR, ResultSink, ShardStore, stream_tasks
+from feature_cache import STATIC_DATASETS, FeatureCache, snap_to_cell
+from filtered_store import read_observations, write_features
+from grid import DEFAULT_GRID
+from merge_and_filter import load_largest_perimeters
+from static_layers import STATIC_LAYER_COLUMNS, StaticLayerTiles, grid_sampling, precompute_static_layers, road_density_image
+
+YEAR = 2015
+# sample all observations of a date with one reduceRegions call per chunk
+# instead of one round trip per dataset per observation
+BATCHED = True
+BATCH_SIZE = 500
+# reuse features already fetched for the same 375 m cell (and date)
+USE_CACHE = True
+# look static layers up in per-fire tiles fetched once per fire footprint
+USE_STATIC_TILES = True
+# interpolate ERA5 weather locally from per-day cubes downloaded once per region
+USE_WEATHER_CUBE = True
+# Earth Engine request budget shared by all worker threads. a default to set
+# to the project's request quota, which this repo does not know. the bucket
+# holds one second of requests, and the concurrency limit adapts between 1 and
+# MAX_CONCURRENCY from throttling errors and latency
+REQUESTS_PER_SECOND = 100.0
+REQUEST_BURST = REQUESTS_PER_SECOND
+MAX_CONCURRENCY = 40
+LATENCY_TARGET = 30.0
+# getInfo round trips made by one retrieve_external_features call: 19 region
+# reductions, 3 point samples, 2 each for MTBS and FireCCI, road density, the
+# ERA5 length check and the previous-year offset
+REQUESTS_PER_OBSERVATION = 29
+
+# road_density is static_layers.road_density_image on the observation's 375 m
+# grid cell (m of TIGER roads per km2 of the cell) in every path. it used to be
+# the full length of the roads touching a 750 m box around the point divided by
+# the box area, which the per-fire tiles cannot reproduce
+FEATURE_COLUMNS = (
+    ['elevation', 'mean_2m_air_temperature', 'u_component_of_wind_10m', 'v_component_of_wind_10m', 'landcover']
+    + [f'precipitation_day_{i}' for i in range(1, 8)]
+    + [f'humidity_day_{i}' for i in range(1, 8)]
+    + ['NDVI', 'population_density', 'BurnDate_PreviousYear', 'ndwi_band_value', 'burn_severity_value', 'road_density']
+)
 
 def extract_dict(dict):
     return list(dict.keys())[0], list(dict.values())[0]
 
 def get_region_and_point(lat, lon):
-    half_pixel = 375 / 2  
-    region = ee.Geometry.Rectangle([lon - half_pixel, lat - half_pixel, lon + half_pixel, lat + half_pixel])
+    # the grid cell containing the point, in the grid's projected CRS
+    minx, miny, maxx, maxy = DEFAULT_GRID.cell_bounds_xy(*DEFAULT_GRID.snap_point(lat, lon))
+    region = ee.Geometry.Rectangle([minx, miny, maxx, maxy], DEFAULT_GRID.crs, False)
     point = ee.Geometry.Point([lon, lat])
     return region, point
 
@@ -129,12 +169,11 @@ def retrieve_external_features(date_str, lat, lon):
     
     glc30 = ee.Image("USGS/NLCD_RELEASES/2020_REL/NALCMS").select('landcover')
 
-    # road networks
+    # road networks, on the observation's grid cell like the static tiles
+    road_density = road_density_image().reduceRegion(reducer=ee.Reducer.first(), geometry=point, **grid_sampling()).get('road_density').getInfo()
+
+    # the 375 m box the region bands are reduced over
     region = point.buffer(375).bounds()
-    road_networks = ee.FeatureCollection('TIGER/2016/Roads').filterBounds(region)
-    total_length = road_networks.geometry().length().getInfo()
-    area_km2 = region.area(30).multiply(1e-6).getInfo()
-    road_density = total_length / area_km2
 
     datasets_region = [elevation, temperature, u_wind, v_wind, glc30] + precipitation_daily + humidity_daily
 
@@ -172,75 +211,432 @@ def retrieve_external_features(date_str, lat, lon):
     return pd.DataFrame(ret_values)
 
 
-sem = threading.Semaphore(40)
+scheduler = RequestScheduler(rate=REQUESTS_PER_SECOND, burst=REQUEST_BURST, max_concurrency=MAX_CONCURRENCY, latency_target=LATENCY_TARGET)
 
 completed_count = 0
+total_count = 0
 start_time = time.time()
 counter_lock = threading.Lock()
+feature_cache = None
+# static layer values per observation_id, from the precomputed fire tiles
+static_values = None
+# per-day ERA5 rasters for the region being fetched
+weather_cube = None
 
-def update_progress():
+def update_progress(n=1):
     global completed_count
     global start_time
 
+    if n == 0:
+        return
     with counter_lock:
-        completed_count += 1
+        previous_count = completed_count
+        completed_count += n
 
         elapsed_time = time.time() - start_time
-        average_time_per_request = elapsed_time / completed_count
-        remaining_requests = len(filtered_data) - completed_count
+        average_time_per_request = elapsed_time / max(completed_count, 1)
+        remaining_requests = total_count - completed_count
         estimated_remaining_time = average_time_per_request * remaining_requests
 
         minutes, seconds = divmod(estimated_remaining_time, 60)
 
-        if completed_count % 100 == 0 or completed_count == len(filtered_data): 
+        if completed_count // 100 > previous_count // 100 or completed_count == total_count:
             clear_output(wait=True)
             print(f"Estimated Time to Completion: {int(minutes)}m {int(seconds)}s")
-            print(f"Completed: {completed_count}/{len(filtered_data)}")
-
-def retrieve(observation, max_retries=3):
-    with sem:
-        observation_id, lat, lon, acq_date = observation
-        acq_date = ee.Date(acq_date)
-        
-        retries = 0
-        backoff_time = 1  # start with 1 second, but this can be adjusted
-        while retries <= max_retries:
-            try:
-                features_df = retrieve_external_features(acq_date, lat, lon)
-                features_df['observation_id'] = observation_id
-                
-                update_progress()
-                
-                return features_df
-            except Exception as e:
-                retries += 1
-                if retries > max_retries:
-                    print(f"Failed for observation {observation_id} after {max_retries} retries with error: {e}")
-                    update_progress()
-                    return None
-                
-                print(f"Attempt {retries} failed for observation {observation_id} with error: {e}. Retrying in {backoff_time} seconds...")
-                time.sleep(backoff_time)  # sleep for backoff_time seconds
-                backoff_time *= 2  # double the backoff_time for next potential retry
-
-def main(filtered_data):
-    tasks = []
+            print(f"Completed: {completed_count}/{total_count}")
+            if feature_cache is not None:
+                print(feature_cache.summary())
+            print(scheduler.summary())
+
+def retrieve_cached(observation, date_str):
+    """returns cached features for an observation, or None if any are missing."""
+    observation_id, lat, lon, _ = observation
+    values = feature_cache.lookup(snap_to_cell(lat, lon), date_str, FEATURE_COLUMNS)
+    if len(values) < len(FEATURE_COLUMNS):
+        feature_cache.record(hit=False)
+        return None
+    feature_cache.record(hit=True)
+    features_df = pd.DataFrame({column: [values[column]] for column in FEATURE_COLUMNS})
+    features_df['observation_id'] = observation_id
+    return features_df
+
+def fetch_observation(observation_id, lat, lon, acq_date):
+    """retrieve_external_features for one observation, or None if it failed."""
+    # the scheduler retries throttled and transient errors with backoff
+    try:
+        features_df = scheduler.call(retrieve_external_features, ee.Date(acq_date), lat, lon, cost=REQUESTS_PER_OBSERVATION)
+    except Exception as e:
+        print(f"Failed for observation {observation_id} with error: {e}")
+        return None
+    features_df['observation_id'] = observation_id
+    return features_df
+
+def retrieve(observation):
+    observation_id, lat, lon, acq_date = observation
+    date_str = pd.Timestamp(acq_date).strftime('%Y-%m-%d')
+    if feature_cache is not None:
+        features_df = retrieve_cached(observation, date_str)
+        if features_df is not None:
+            update_progress()
+            return features_df
+
+    features_df = fetch_observation(observation_id, lat, lon, acq_date)
+    if features_df is not None and feature_cache is not None:
+        feature_cache.store(snap_to_cell(lat, lon), date_str, features_df.iloc[0].reindex(FEATURE_COLUMNS).to_dict())
+
+    update_progress()
+
+    return features_df
+
+def main(filtered_data, job_store=None):
+    """
+    retrieves features one observation at a time with a bounded window of
+    tasks in flight. completed rows are written to job_store as they arrive
+    and the store is returned for write_features to stream, or without a
+    store the assembled feature table.
+    """
+    global total_count
+    total_count = len(filtered_data)
     
-    from multiprocessing.pool import ThreadPool
     pool = ThreadPool(40)
-    
-    for _, row in filtered_data.iterrows():
-        observation = (row['observation_id'], row['LATITUDE'], row['LONGITUDE'], row['ACQ_DATE'])
-        task = pool.apply_async(retrieve, (observation,))
-        tasks.append(task)
+    sink = ResultSink(job_store)
+
+    columns = ['observation_id', 'LATITUDE', 'LONGITUDE', 'ACQ_DATE']
+    observations = ((observation,) for observation in filtered_data[columns].itertuples(index=False, name=None))
+
+    for (observation,), features_df in stream_tasks(pool, retrieve, observations):
+        if isinstance(features_df, Exception):
+            print(f"Failed for observation {observation[0]} with error: {features_df}")
+            sink.add(None, expected_ids=[observation[0]], error=str(features_df))
+            continue
+        sink.add(features_df, expected_ids=[observation[0]])
+
+    pool.close()
+    return sink.close()
+
+def date_availability(date_str):
+    """
+    returns the number of images each time-varying dataset has for a date,
+    fetched in a single round trip.
+    """
+    date = ee.Date(date_str)
+    previous_year = ee.Date.fromYMD(date.advance(-1, 'year').get('year'), 1, 1)
+    sizes = ee.Dictionary({
+        'era5_one_day': ee.ImageCollection('ECMWF/ERA5/DAILY').filterDate(date.advance(-1, 'day'), date.advance(1, 'day')).size(),
+        'era5_daily': ee.ImageCollection('ECMWF/ERA5/DAILY').filterDate(date.advance(-7, 'day'), date.advance(1, 'day')).size(),
+        'modis_ndvi': ee.ImageCollection("MODIS/006/MOD13A2").filterDate(date.advance(-1, 'month'), date).size(),
+        'pop_density': ee.ImageCollection("CIESIN/GPWv411/GPW_Population_Density").filterDate(date.advance(-5, 'year'), date).size(),
+        'ndwi': ee.ImageCollection('LANDSAT/LC08/C01/T1_32DAY_NDWI').filterDate(date.advance(-2, 'month'), date).size(),
+        'burn_severity': ee.ImageCollection("USFS/GTAC/MTBS/annual_burn_severity_mosaics/v1").filterDate(date.advance(-3, 'year'), date).size(),
+        'fire_history': ee.ImageCollection("ESA/CCI/FireCCI/5_1").filterDate(previous_year, previous_year.advance(1, 'year').advance(-1, 'day')).size(),
+    })
+    return sizes.getInfo()
+
+def build_feature_images(date_str, availability, include_static=True):
+    """
+    the raster features used by retrieve_external_features for a date, as two
+    multi-band images whose band names are the output columns: the bands it
+    reduces over the 375 m box around an observation (reprojected to
+    EPSG:4326 like there), and the bands it samples at the point. static
+    layers can be left out when they are already cached, and the ERA5 bands
+    when they come from the local weather cube; the box image is None when
+    nothing is left in it.
+    """
+    date = ee.Date(date_str)
+
+    elevation = ee.Image('CGIAR/SRTM90_V4').select('elevation')
+    era5_one_day = ee.ImageCollection('ECMWF/ERA5/DAILY').filterDate(date.advance(-1, 'day'), date.advance(1, 'day')).first()
+    weather = era5_one_day.select(['mean_2m_air_temperature', 'u_component_of_wind_10m', 'v_component_of_wind_10m'])
+    glc30 = ee.Image("USGS/NLCD_RELEASES/2020_REL/NALCMS").select('landcover')
+
+    era5_daily = ee.ImageCollection('ECMWF/ERA5/DAILY').filterDate(date.advance(-7, 'day'), date.advance(1, 'day')).toList(7)
+    precipitation_daily = [ee.Image(era5_daily.get(i)).select(['total_precipitation'], [f'precipitation_day_{i + 1}']) for i in range(7)]
+    humidity_daily = [ee.Image(era5_daily.get(i)).select(['dewpoint_2m_temperature'], [f'humidity_day_{i + 1}']) for i in range(7)]
 
-    dfs = [task.get() for task in tasks]
+    modis_ndvi = ee.ImageCollection("MODIS/006/MOD13A2").filterDate(date.advance(-1, 'month'), date).first().select('NDVI')
+    pop_density = ee.ImageCollection("CIESIN/GPWv411/GPW_Population_Density").filterDate(date.advance(-5, 'year'), date).first().select('population_density')
+    ndwi_band = ee.ImageCollection('LANDSAT/LC08/C01/T1_32DAY_NDWI').filterDate(date.advance(-2, 'month'), date).first().select(['NDWI'], ['ndwi_band_value'])
 
+    if availability['burn_severity'] > 0:
+        burn_severity = ee.ImageCollection("USFS/GTAC/MTBS/annual_burn_severity_mosaics/v1").filterDate(date.advance(-3, 'year'), date).mosaic().select(['Severity'], ['burn_severity_value'])
+    else:
+        # fully masked band, sampled as None like the per-observation path
+        burn_severity = ee.Image.constant(0).updateMask(0).rename('burn_severity_value')
+
+    previous_year = ee.Date.fromYMD(date.advance(-1, 'year').get('year'), 1, 1)
+    fire_history = ee.ImageCollection("ESA/CCI/FireCCI/5_1").filterDate(previous_year, previous_year.advance(1, 'year').advance(-1, 'day')).mosaic().select(['BurnDate'], ['BurnDate_PreviousYear'])
+
+    if weather_cube is not None:
+        weather, precipitation_daily, humidity_daily = None, [], []
+    region_bands = ([elevation, weather, glc30] if include_static else [weather]) + precipitation_daily + humidity_daily
+    region_bands = [band for band in region_bands if band is not None]
+    point_bands = [modis_ndvi, pop_density, ndwi_band, burn_severity, fire_history]
+
+    # cast to a common type so the bands can be stacked
+    region_image = ee.Image.cat([band.reproject('EPSG:4326').toDouble() for band in region_bands]) if region_bands else None
+    point_image = ee.Image.cat([band.toDouble() for band in point_bands])
+    return region_image, point_image
+
+def observation_points(observations):
+    """FeatureCollection of the observation points."""
+    features = [
+        ee.Feature(ee.Geometry.Point([float(lon), float(lat)]), {'observation_id': int(observation_id)})
+        for observation_id, lat, lon in observations
+    ]
+    return ee.FeatureCollection(features)
+
+def observation_regions(observations):
+    """FeatureCollection of the 375 m buffered boxes around each observation."""
+    features = [
+        ee.Feature(ee.Geometry.Point([float(lon), float(lat)]).buffer(375).bounds(), {'observation_id': int(observation_id)})
+        for observation_id, lat, lon in observations
+    ]
+    return ee.FeatureCollection(features)
+
+def retrieve_external_features_batch(date_str, observations, availability, include_static=True):
+    """
+    retrieves features for many (observation_id, lat, lon) observations of the
+    same date with a single getInfo: the point bands and road density are
+    reduced over the observation points and the box bands over the 375 m
+    boxes, as retrieve_external_features does. returns a DataFrame with the
+    same columns as retrieve_external_features plus observation_id; static
+    columns are left empty when include_static is False.
+    """
+    region_image, point_image = build_feature_images(date_str, availability, include_static)
+
+    # properties only, the geometries are not needed back
+    points = observation_points(observations)
+    collections = [
+        point_image.reduceRegions(collection=points, reducer=ee.Reducer.first(), scale=375)
+        .select(point_image.bandNames().add('observation_id'), None, False)
+    ]
+    if include_static:
+        # read on the grid cell of each observation, like the static tiles
+        road_reducer = ee.Reducer.first().setOutputs(['road_density'])
+        collections.append(road_density_image().reduceRegions(collection=points, reducer=road_reducer, **grid_sampling())
+                           .select(['road_density', 'observation_id'], None, False))
+    if region_image is not None:
+        regions = region_image.reduceRegions(collection=observation_regions(observations), reducer=ee.Reducer.first(), scale=375)
+        collections.append(regions.select(region_image.bandNames().add('observation_id'), None, False))
+
+    features_df = None
+    for collection in ee.List(collections).getInfo():
+        frame = pd.DataFrame([feature['properties'] for feature in collection['features']])
+        features_df = frame if features_df is None else features_df.merge(frame, on='observation_id', how='left')
+    return features_df.reindex(columns=FEATURE_COLUMNS + ['observation_id'])
+
+def retrieve_batch(date_str, observations, availability, include_static=True):
+    try:
+        return scheduler.call(retrieve_external_features_batch, date_str, observations, availability, include_static)
+    except Exception as e:
+        error = e
+
+    # fall back to per-observation requests so one bad point cannot sink the
+    # batch. the cache was already consulted for these by split_cached
+    print(f"Batch of {len(observations)} on {date_str} failed with error: {error}, retrying per observation")
+    dfs = [fetch_observation(observation_id, lat, lon, date_str) for observation_id, lat, lon in observations]
     valid_dfs = [df for df in dfs if df is not None]
-    result_df = pd.concat(valid_dfs, ignore_index=True)
-    
-    return result_df
+    return pd.concat(valid_dfs, ignore_index=True) if valid_dfs else None
+
+def split_cached(date_str, observations):
+    """
+    groups a date's observations by 375 m cell and resolves what the cache
+    already holds. returns the fully cached rows, the cell representatives that
+    need every feature, those that only need time-varying features, and a map
+    from representative observation_id to (cell, observation_ids, static values).
+    """
+    cells = {}
+    rows, cols = DEFAULT_GRID.snap([lat for _, lat, _ in observations], [lon for _, _, lon in observations])
+    for (observation_id, lat, lon), cell in zip(observations, zip(rows.tolist(), cols.tolist())):
+        if cell in cells:
+            cells[cell][1].append(observation_id)
+        else:
+            cells[cell] = ((observation_id, lat, lon), [observation_id])
+
+    cached_rows, needs_all, needs_dynamic, members = [], [], [], {}
+    for cell, (representative, observation_ids) in cells.items():
+        values = feature_cache.lookup(cell, date_str, FEATURE_COLUMNS)
+        if static_values is not None:
+            # a missing or failed tile is NaN, those layers are still to fetch
+            values.update(static_values.loc[representative[0]].dropna().to_dict())
+        if len(values) == len(FEATURE_COLUMNS):
+            feature_cache.record(hit=True, n=len(observation_ids))
+            cached_rows.extend({**values, 'observation_id': observation_id} for observation_id in observation_ids)
+            continue
+
+        feature_cache.record(hit=False)
+        feature_cache.record(hit=True, n=len(observation_ids) - 1)
+        static_datasets = STATIC_LAYER_COLUMNS if static_values is not None else STATIC_DATASETS
+        cell_static_values = {dataset: values[dataset] for dataset in static_datasets if dataset in values}
+        if len(cell_static_values) == len(static_datasets):
+            needs_dynamic.append(representative)
+        else:
+            needs_all.append(representative)
+            cell_static_values = None
+        members[representative[0]] = (cell, observation_ids, cell_static_values)
+
+    cached_df = pd.DataFrame(cached_rows, columns=FEATURE_COLUMNS + ['observation_id'])
+    return cached_df, needs_all, needs_dynamic, members
+
+def expand_cached(date_str, features_df, members):
+    """stores fetched cell representatives in the cache and copies them to every observation in the cell."""
+    rows = []
+    for values in features_df.to_dict('records'):
+        cell, observation_ids, static_values = members[values.pop('observation_id')]
+        if static_values is not None:
+            values.update(static_values)
+        feature_cache.store(cell, date_str, values)
+        rows.extend({**values, 'observation_id': observation_id} for observation_id in observation_ids)
+    return pd.DataFrame(rows, columns=FEATURE_COLUMNS + ['observation_id'])
+
+def batch_arguments(filtered_data, sink, batch_size=BATCH_SIZE):
+    """
+    walks the observations date by date and yields the arguments of one
+    retrieve_batch task per chunk. rows served from the cache and dates without
+    data go straight to the sink instead.
+    """
+    observation_ids = filtered_data['observation_id'].to_numpy()
+    latitudes = filtered_data['LATITUDE'].to_numpy()
+    longitudes = filtered_data['LONGITUDE'].to_numpy()
+    dates = pd.to_datetime(filtered_data['ACQ_DATE']).dt.strftime('%Y-%m-%d').to_numpy()
+
+    order = np.argsort(dates, kind='stable')
+    unique_dates, starts = np.unique(dates[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+
+    for date_str, start, end in zip(unique_dates, starts, ends):
+        rows = order[start:end]
+        availability = scheduler.call(date_availability, date_str)
+        missing = [name for name, size in availability.items() if size == 0 and name != 'burn_severity']
+        if availability['era5_daily'] < 7:
+            missing.append('era5_daily')
+        if missing:
+            # the per-observation path fails every observation of such a date
+            print(f"Skipping {len(rows)} observations on {date_str}, no data for: {', '.join(missing)}")
+            sink.add(None, observation_ids[rows].tolist(), f"no data for: {', '.join(missing)}")
+            update_progress(len(rows))
+            continue
+
+        weather_df = None
+        if weather_cube is not None:
+            if not weather_cube.has_date(date_str):
+                print(f"Skipping {len(rows)} observations on {date_str}, no ERA5 cube for the 7 days before")
+                sink.add(None, observation_ids[rows].tolist(), "no data for: era5_daily")
+                update_progress(len(rows))
+                continue
+            # one vectorized lookup for every observation of the date
+            weather_df = weather_cube.features_for_date(date_str, latitudes[rows], longitudes[rows], index=observation_ids[rows])
+
+        observations = list(zip(observation_ids[rows].tolist(), latitudes[rows].tolist(), longitudes[rows].tolist()))
+        if feature_cache is None and static_values is None:
+            requests, members = [(observations, True)], None
+        elif feature_cache is None:
+            # observations without a complete tile fetch their static layers from Earth Engine
+            tiled = static_values.reindex(observation_ids[rows]).notna().all(axis=1).to_numpy()
+            untiled_observations = [observation for observation, has_tile in zip(observations, tiled) if not has_tile]
+            tiled_observations = [observation for observation, has_tile in zip(observations, tiled) if has_tile]
+            requests, members = [(untiled_observations, True), (tiled_observations, False)], None
+        else:
+            cached_df, needs_all, needs_dynamic, members = split_cached(date_str, observations)
+            sink.add(cached_df)
+            update_progress(len(cached_df))
+            requests = [(needs_all, True), (needs_dynamic, False)]
+
+        for request_observations, include_static in requests:
+            for start in range(0, len(request_observations), batch_size):
+                chunk = request_observations[start:start + batch_size]
+                yield date_str, chunk, availability, include_static, members, weather_df
+
+def fill_static_layers(features_df):
+    """overwrites the static columns with the values looked up in the fire tiles, where the tiles have them."""
+    tile_values = static_values.reindex(features_df['observation_id'].to_numpy())
+    for column in STATIC_LAYER_COLUMNS:
+        values = tile_values[column].to_numpy()
+        features_df[column] = np.where(np.isnan(values), features_df[column].to_numpy(dtype=np.float64), values)
+    return features_df
+
+def retrieve_batch_task(date_str, chunk, availability, include_static, members, weather_df):
+    # progress counts observations, every member of a representative's cell included
+    if members is None:
+        observation_count = len(chunk)
+    else:
+        observation_count = sum(len(members[observation[0]][1]) for observation in chunk)
+    try:
+        features_df = retrieve_batch(date_str, chunk, availability, include_static)
+        if features_df is None:
+            return None
+        if weather_df is not None:
+            weather_values = weather_df.reindex(features_df['observation_id'].to_numpy())
+            for column in WEATHER_COLUMNS:
+                features_df[column] = weather_values[column].to_numpy()
+        if members is not None:
+            features_df = expand_cached(date_str, features_df, members)
+        elif static_values is not None:
+            features_df = fill_static_layers(features_df)
+        return features_df
+    finally:
+        update_progress(observation_count)
+
+def main_batched(filtered_data, batch_size=BATCH_SIZE, job_store=None):
+    """
+    retrieves features in (date, chunk) batches with a bounded window of
+    batches in flight. finished batches are written to job_store as they
+    arrive, observations missing from a batch are recorded as failures, and
+    the store is returned for write_features to stream, or without a store
+    the assembled feature table.
+    """
+    global total_count
+    total_count = len(filtered_data)
 
-external_obs_df = main(filtered_data)
-external_obs_df.to_pickle("external_obs.pkl")
+    pool = ThreadPool(40)
+    sink = ResultSink(job_store)
 
+    tasks = batch_arguments(filtered_data, sink, batch_size)
+    for (date_str, chunk, _, _, members, _), features_df in stream_tasks(pool, retrieve_batch_task, tasks, window=2 * MAX_CONCURRENCY):
+        if members is None:
+            expected_ids = [observation[0] for observation in chunk]
+        else:
+            expected_ids = [observation_id for observation in chunk for observation_id in members[observation[0]][1]]
+        if isinstance(features_df, Exception):
+            print(f"Batch of {len(chunk)} on {date_str} failed with error: {features_df}")
+            sink.add(None, expected_ids, error=str(features_df))
+            continue
+        sink.add(features_df, expected_ids)
+
+    pool.close()
+    return sink.close()
+
+if __name__ == "__main__":
+    service_account = 'ping-gee@ee-supercharge-naturesnotebook.iam.gserviceaccount.com'
+    credentials = ee.ServiceAccountCredentials(service_account, 'ee-supercharge-naturesnotebook-5b165b3dae23.json')
+    ee.Initialize(credentials)
+
+    if USE_CACHE:
+        feature_cache = FeatureCache()
+
+    # only the columns needed to build the requests
+    filtered_data = read_observations(columns=['observation_id', 'uniquefire', 'LATITUDE', 'LONGITUDE', 'ACQ_DATE'], years=YEAR)
+    # coordinates are stored as float32, Earth Engine payloads need float64
+    filtered_data = filtered_data.astype({'LATITUDE': 'float64', 'LONGITUDE': 'float64'})
+
+    # completed batches are checkpointed to the job's shard store, so a rerun
+    # resumes where the previous one stopped
+    job_store = ShardStore(os.path.join(JOBS_DIR, str(YEAR)))
+    pending_data = job_store.pending(filtered_data)
+
+    if BATCHED and USE_STATIC_TILES:
+        # one download per fire footprint, then local array lookups
+        precompute_static_layers(load_largest_perimeters(YEAR), YEAR, scheduler=scheduler)
+        static_values = StaticLayerTiles().lookup_frame(pending_data)
+
+    if BATCHED and USE_WEATHER_CUBE:
+        # every ERA5 day is downloaded once for the whole region
+        weather_cube = ERA5Cube.for_observations(pending_data)
+        dates = pd.to_datetime(pending_data['ACQ_DATE']).dt.normalize().unique()
+        weather_cube.ensure_days({day for date in dates for day in weather_days(date)}, scheduler=scheduler)
+
+    if BATCHED:
+        external_obs_df = main_batched(pending_data, job_store=job_store)
+    else:
+        external_obs_df = main(pending_data, job_store=job_store)
+    write_features(external_obs_df, YEAR)
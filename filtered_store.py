@@ -0,0 +1,137 @@
+import json
+import os
+import shutil
+from urllib.parse import quote
+
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+OBSERVATIONS_DIR = "./data_filtered/observations"
+FEATURES_DIR = "./data_filtered/external_obs"
+
+PARTITION_SCHEMA = pa.schema([("year", pa.int32()), ("uniquefire", pa.string())])
+INDEX_COLUMN = "__index_level_0__"
+
+# Layout (hive partitioned, one GeoParquet file per fire):
+#   observations/year=2015/uniquefire=2015-AKTAD-000333/part-0.parquet
+#   external_obs/year=2015/part-0.parquet
+
+
+def _partition_dir(root, year, uniquefire=None):
+    path = os.path.join(root, f"year={int(year)}")
+    if uniquefire is not None:
+        path = os.path.join(path, f"uniquefire={quote(str(uniquefire), safe='')}")
+    return path
+
+
+def write_observations(filtered_data, year, root=OBSERVATIONS_DIR):
+    """
+    writes a year of filtered VIIRS observations as GeoParquet, one file per
+    uniquefire. any previous partition for the year is replaced.
+    """
+    year_dir = _partition_dir(root, year)
+    if os.path.exists(year_dir):
+        shutil.rmtree(year_dir)
+
+    for uniquefire, group in filtered_data.groupby("uniquefire", sort=False, observed=True):
+        fire_dir = _partition_dir(root, year, uniquefire)
+        os.makedirs(fire_dir, exist_ok=True)
+        group.drop(columns=["uniquefire"]).to_parquet(os.path.join(fire_dir, "part-0.parquet"))
+
+    return year_dir
+
+
+def write_features(features, year, root=FEATURES_DIR):
+    """
+    writes a year of external features (keyed by observation_id) as Parquet.
+    features is a DataFrame, or an extraction_jobs.ShardStore whose shards are
+    streamed into the file without concatenating them in memory.
+    """
+    year_dir = _partition_dir(root, year)
+    if os.path.exists(year_dir):
+        shutil.rmtree(year_dir)
+    os.makedirs(year_dir)
+    path = os.path.join(year_dir, "part-0.parquet")
+    if hasattr(features, "write_parquet"):
+        features.write_parquet(path)
+    else:
+        features.to_parquet(path, index=False)
+    return year_dir
+
+
+def _as_list(value):
+    if value is None:
+        return None
+    if isinstance(value, (str, int)):
+        return [value]
+    return list(value)
+
+
+def _partition_filter(years=None, uniquefire=None, filters=None):
+    expression = None
+    for field, values in (("year", _as_list(years)), ("uniquefire", _as_list(uniquefire))):
+        if values is None:
+            continue
+        values = [int(v) for v in values] if field == "year" else [str(v) for v in values]
+        condition = ds.field(field).isin(values)
+        expression = condition if expression is None else expression & condition
+    if filters is not None:
+        expression = filters if expression is None else expression & filters
+    return expression
+
+
+def _table_to_frame(table, schema):
+    """converts an arrow table to pandas, decoding GeoParquet geometry if present."""
+    df = table.to_pandas()
+    geo_metadata = (schema.metadata or {}).get(b"geo")
+    if geo_metadata is None:
+        return df
+
+    geo_metadata = json.loads(geo_metadata)
+    geometry_columns = [column for column in geo_metadata["columns"] if column in df.columns]
+    if not geometry_columns:
+        return df
+
+    for column in geometry_columns:
+        crs = geo_metadata["columns"][column].get("crs", "OGC:CRS84")
+        df[column] = gpd.GeoSeries.from_wkb(df[column], index=df.index, crs=crs)
+    primary = geo_metadata.get("primary_column", geometry_columns[0])
+    return gpd.GeoDataFrame(df, geometry=primary if primary in geometry_columns else geometry_columns[0])
+
+
+def read_observations(root=OBSERVATIONS_DIR, columns=None, years=None, uniquefire=None, filters=None):
+    """
+    reads filtered VIIRS observations from the partitioned store.
+
+    columns: subset of columns to read (None reads everything).
+    years / uniquefire: a single value or list; only matching partitions are opened.
+    filters: an optional pyarrow.dataset expression pushed down to the row groups,
+             e.g. ds.field("CONFIDENCE") == "h".
+
+    rows come back grouped by fire. a GeoDataFrame is returned when the geometry
+    column is read, a DataFrame otherwise.
+    """
+    dataset = ds.dataset(root, format="parquet", partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive"))
+
+    if columns is not None:
+        columns = list(columns)
+        if INDEX_COLUMN in dataset.schema.names and INDEX_COLUMN not in columns:
+            columns.append(INDEX_COLUMN)
+
+    table = dataset.to_table(columns=columns, filter=_partition_filter(years, uniquefire, filters))
+    df = _table_to_frame(table, dataset.schema)
+    if "year" in df.columns:
+        df["year"] = df["year"].astype("int64")
+    return df
+
+
+def read_features(root=FEATURES_DIR, columns=None, years=None, filters=None):
+    """reads external features from the partitioned store, see read_observations."""
+    partitioning = ds.partitioning(pa.schema([PARTITION_SCHEMA.field("year")]), flavor="hive")
+    dataset = ds.dataset(root, format="parquet", partitioning=partitioning)
+    table = dataset.to_table(columns=columns, filter=_partition_filter(years, None, filters))
+    df = table.to_pandas()
+    if "year" in df.columns:
+        df["year"] = df["year"].astype("int64")
+    return df
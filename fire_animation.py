@@ -0,0 +1,124 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+
+import matplotlib.animation as animation
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from grid import DEFAULT_GRID
+
+ANIMATIONS_DIR = "./animations"
+WRITERS = {'.gif': 'pillow', '.mp4': 'ffmpeg'}
+
+
+def group_by_day(observations, grid=DEFAULT_GRID):
+    """
+    projects and snaps the observations once and splits them by day. returns
+    a list of (day, x, y, rows, cols) in day order.
+    """
+    x, y = grid.project(observations['LATITUDE'].to_numpy(), observations['LONGITUDE'].to_numpy())
+    rows, cols = grid.snap_xy(x, y)
+    days = observations['date_time'].to_numpy().astype('datetime64[D]')
+    order = np.argsort(days, kind='stable')
+    unique_days, starts = np.unique(days[order], return_index=True)
+    return [(pd.Timestamp(day).date(), x[part], y[part], rows[part], cols[part])
+            for day, part in zip(unique_days, np.split(order, starts[1:]))]
+
+
+class FireSpreadRenderer:
+    """
+    draws a fire's perimeter once and animates its detections day by day.
+    each frame only moves the scatter of the day's detections and, with
+    history, marks the newly burning cells in a raster coloured by the day
+    they were first seen. everything is drawn in the grid CRS so the raster
+    lines up with the 375 m cells.
+    """
+
+    def __init__(self, perimeter, observations, history=True, grid=DEFAULT_GRID, figsize=(6, 6)):
+        self.days = group_by_day(observations, grid)
+        self.history = history
+
+        self.fig, self.ax = plt.subplots(figsize=figsize)
+        perimeter.to_crs(grid.crs).plot(ax=self.ax, color='lightgray', edgecolor='black')
+        self.ax.set_axis_off()
+
+        self.raster = None
+        if history and self.days:
+            row_min = min(day[3].min() for day in self.days)
+            row_max = max(day[3].max() for day in self.days)
+            col_min = min(day[4].min() for day in self.days)
+            col_max = max(day[4].max() for day in self.days)
+            self._origin = (row_min, col_min)
+            self._burned = np.full((row_max - row_min + 1, col_max - col_min + 1), np.nan)
+            extent = (col_min * grid.cell_width, (col_max + 1) * grid.cell_width,
+                      row_min * grid.cell_height, (row_max + 1) * grid.cell_height)
+            self.raster = self.ax.imshow(np.ma.masked_invalid(self._burned), origin='lower', extent=extent,
+                                         cmap='YlOrRd_r', vmin=0, vmax=max(len(self.days) - 1, 1),
+                                         alpha=0.6, interpolation='nearest', zorder=2)
+
+        self.scatter = self.ax.scatter([], [], s=5, color='red', zorder=3)
+        self.ax.autoscale_view()
+
+    def draw_frame(self, index):
+        day, x, y, rows, cols = self.days[index]
+        self.scatter.set_offsets(np.column_stack([x, y]))
+        if self.raster is not None:
+            cells = self._burned[rows - self._origin[0], cols - self._origin[1]]
+            self._burned[rows - self._origin[0], cols - self._origin[1]] = np.where(np.isnan(cells), index, cells)
+            self.raster.set_data(np.ma.masked_invalid(self._burned))
+        self.ax.set_title(f"Observations on {day}")
+        return [self.scatter] + ([self.raster] if self.raster is not None else [])
+
+    def animation(self, interval=1000):
+        return animation.FuncAnimation(self.fig, self.draw_frame, frames=len(self.days), repeat=False, interval=interval)
+
+    def save(self, path, fps=1):
+        """writes a gif or mp4, chosen by the file extension."""
+        writer = WRITERS[os.path.splitext(path)[1].lower()]
+        self.animation().save(path, writer=writer, fps=fps)
+        plt.close(self.fig)
+        return path
+
+
+def animation_path(uniquefire, out_dir=ANIMATIONS_DIR, fmt='gif'):
+    return os.path.join(out_dir, f"fire_spread_{quote(str(uniquefire), safe='-_.')}.{fmt}")
+
+
+def _render_fire(arguments):
+    source, uniquefire, path, history, fps = arguments
+    plt.switch_backend('Agg')
+    if isinstance(source, str):
+        # a packed store: workers open their own fire instead of receiving it pickled
+        from fire_store import FireStore
+        fire = FireStore(source)[uniquefire]
+        perimeter, observations = fire.perimeter, fire.viirs_observations
+    else:
+        perimeter, observations = source
+    if len(observations) == 0:
+        return uniquefire, None
+    return uniquefire, FireSpreadRenderer(perimeter, observations, history=history).save(path, fps=fps)
+
+
+def render_many(fires, out_dir=ANIMATIONS_DIR, fmt='gif', history=True, fps=1, processes=None, uniquefires=None):
+    """
+    renders one animation per fire in worker processes. fires is a FireStore
+    (workers memory-map it themselves) or any mapping of uniquefire ->
+    WildfirePerimeter. returns {uniquefire: path}, None for fires without
+    observations.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    uniquefires = list(uniquefires if uniquefires is not None else fires)
+    root = getattr(fires, 'root', None)
+
+    def source(uniquefire):
+        if root is not None:
+            return root
+        fire = fires[uniquefire]
+        return fire.perimeter, fire.viirs_observations[['LATITUDE', 'LONGITUDE', 'date_time']]
+
+    arguments = ((source(uniquefire), uniquefire, animation_path(uniquefire, out_dir, fmt), history, fps)
+                 for uniquefire in uniquefires)
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return dict(pool.map(_render_fire, arguments))
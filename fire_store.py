@@ -0,0 +1,317 @@
+import json
+import os
+import shutil
+from collections.abc import Mapping
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import CRS
+from scipy import sparse
+
+from fire_graph import FireGraph, build_fire_graph
+from grid import cell_row_col
+from perimeter_data_class import WildfirePerimeter
+
+FIRES_DIR = "./data_filtered/fires"
+
+# Layout of a packed collection of fires (every array is a .npy, memory-mapped on read):
+#   fires/year=2015/index.parquet             offsets of every fire into the arrays below
+#   fires/year=2015/perimeters.parquet        perimeter attributes, one row per fire with a perimeter
+#   fires/year=2015/perimeters.wkb            perimeter geometries, concatenated WKB
+#   fires/year=2015/schema.json               observation columns, dtypes and categories
+#   fires/year=2015/observations/<n>.npy      one typed array per observation column
+#   fires/year=2015/graph/<name>.npy          node arrays and per-fire CSR arrays
+
+
+def fire_store_dir(year, root=FIRES_DIR):
+    return os.path.join(root, f"year={int(year)}")
+
+INDEX_FIELDS = ['perimeter_row', 'obs_start', 'obs_count', 'node_start', 'node_count', 'indptr_start',
+                'spatial_start', 'spatial_count', 'temporal_start', 'temporal_count',
+                'wkb_start', 'wkb_length']
+GRAPH_ARRAYS = ['cell_id', 'first_observation', 'ignition_time', 'n_observations',
+                'spatial_indptr', 'spatial_indices', 'temporal_indptr', 'temporal_indices', 'temporal_delay']
+OBSERVATION_INDEX = '__index__'
+
+
+def _column_kind(values):
+    if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object or pd.api.types.is_string_dtype(values.dtype):
+        return 'category'
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return 'datetime'
+    return 'numeric'
+
+
+def _json_value(value):
+    # category values are kept as JSON scalars so they read back with their type
+    if isinstance(value, np.generic):
+        value = value.item()
+    return value if isinstance(value, (str, int, float, bool)) else str(value)
+
+
+def _save(path, array):
+    np.save(path, np.ascontiguousarray(array))
+
+
+def _open_array(path):
+    # a plain ndarray view of the memory map, so slices behave like any other array
+    return np.asarray(np.load(path, mmap_mode='r'))
+
+
+def write_fire_store(fires, root, graphs=True):
+    """
+    packs a mapping of uniquefire -> WildfirePerimeter (e.g. the result of
+    create_wildfire_perimeters) into one directory of flat arrays. object and
+    string columns become categorical codes, read back with their written
+    dtype, and observation geometry is not stored (points are kept as
+    LATITUDE/LONGITUDE). fires of a lazy mapping with a build method, such as
+    WildfirePerimeterMap, are built one at a time and not kept by it. the
+    store is written next to root and moved into place when complete.
+    """
+    index_rows, perimeter_rows, wkbs, crs = [], [], [], None
+    observation_frames, columns = [], None
+    graph_parts = {name: [] for name in GRAPH_ARRAYS}
+    offsets = dict.fromkeys(INDEX_FIELDS, 0)
+
+    build = getattr(fires, 'build', fires.__getitem__)
+    for uniquefire in fires:
+        fire = build(uniquefire)
+        observations = pd.DataFrame(fire.viirs_observations)
+        observations = observations.drop(columns=[column for column in observations.columns
+                                                  if isinstance(observations[column].dtype, gpd.array.GeometryDtype)])
+        if columns is None:
+            columns = list(observations.columns)
+        observations = observations.reindex(columns=columns)
+        observation_frames.append(observations)
+
+        perimeter = fire.perimeter.head(1)
+        crs = crs or perimeter.crs
+        wkb = shapely.to_wkb(perimeter.geometry.iloc[0]) if len(perimeter) else b''
+        wkbs.append(wkb)
+        if len(perimeter):
+            attributes = pd.DataFrame(perimeter.drop(columns=perimeter.geometry.name))
+            attributes.insert(0, '__perimeter_index', attributes.index)
+            perimeter_rows.append(attributes.reset_index(drop=True))
+
+        graph = None
+        if graphs:
+            graph = getattr(fire, 'fire_graph', None)
+            if graph is None:
+                graph = build_fire_graph(observations)
+        n_nodes = len(graph) if graph is not None else 0
+        n_spatial = graph.spatial.nnz if graph is not None else 0
+        n_temporal = graph.temporal.nnz if graph is not None else 0
+        if graph is not None:
+            graph_parts['cell_id'].append(graph.nodes['cell_id'].to_numpy(np.int64))
+            graph_parts['first_observation'].append(np.asarray(graph.first_observation, dtype=np.int32))
+            graph_parts['ignition_time'].append(graph.nodes['ignition_time'].to_numpy('datetime64[ns]').view(np.int64))
+            graph_parts['n_observations'].append(graph.nodes['n_observations'].to_numpy(np.int32))
+            for name, adjacency in (('spatial', graph.spatial), ('temporal', graph.temporal)):
+                adjacency = adjacency.tocsr().sorted_indices()
+                graph_parts[f'{name}_indptr'].append(adjacency.indptr.astype(np.int32))
+                graph_parts[f'{name}_indices'].append(adjacency.indices.astype(np.int32))
+                if name == 'temporal':
+                    graph_parts['temporal_delay'].append(adjacency.data.astype(np.float32))
+        else:
+            for name in ('spatial_indptr', 'temporal_indptr'):
+                graph_parts[name].append(np.zeros(1, dtype=np.int32))
+
+        row = {'uniquefire': uniquefire, 'perimeter_row': len(perimeter_rows) - 1 if len(perimeter) else -1}
+        row.update({
+            'obs_start': offsets['obs_start'], 'obs_count': len(observations),
+            'node_start': offsets['node_start'], 'node_count': n_nodes,
+            'indptr_start': offsets['indptr_start'],
+            'spatial_start': offsets['spatial_start'], 'spatial_count': n_spatial,
+            'temporal_start': offsets['temporal_start'], 'temporal_count': n_temporal,
+            'wkb_start': offsets['wkb_start'], 'wkb_length': len(wkb),
+        })
+        index_rows.append(row)
+        offsets['obs_start'] += len(observations)
+        offsets['node_start'] += n_nodes
+        offsets['indptr_start'] += n_nodes + 1
+        offsets['spatial_start'] += n_spatial
+        offsets['temporal_start'] += n_temporal
+        offsets['wkb_start'] += len(wkb)
+
+    temporary_root = root.rstrip(os.sep) + ".tmp"
+    if os.path.exists(temporary_root):
+        shutil.rmtree(temporary_root)
+    os.makedirs(os.path.join(temporary_root, "observations"))
+    os.makedirs(os.path.join(temporary_root, "graph"))
+
+    observations = pd.concat(observation_frames) if observation_frames else pd.DataFrame(columns=columns or [])
+    schema = {'columns': [], 'crs': crs.to_json() if crs is not None else None, 'index': None, 'graphs': graphs}
+    for position, column in enumerate(observations.columns):
+        values = observations[column]
+        kind = _column_kind(values)
+        entry = {'name': column, 'kind': kind}
+        if kind == 'category':
+            codes, categories = pd.factorize(np.asarray(values, dtype=object))
+            array = codes.astype(np.int32)
+            entry['categories'] = [_json_value(category) for category in categories]
+            entry['source_dtype'] = str(values.dtype)
+        elif kind == 'datetime':
+            array = values.to_numpy('datetime64[ns]').view(np.int64)
+        else:
+            array = values.to_numpy()
+        entry['dtype'] = str(array.dtype)
+        _save(os.path.join(temporary_root, "observations", f"{position}.npy"), array)
+        schema['columns'].append(entry)
+    if pd.api.types.is_integer_dtype(observations.index.dtype):
+        _save(os.path.join(temporary_root, "observations", f"{OBSERVATION_INDEX}.npy"), observations.index.to_numpy(np.int64))
+        schema['index'] = OBSERVATION_INDEX
+
+    for name, parts in graph_parts.items():
+        # per-fire CSR arrays are int32 like scipy's own, so matrices wrap them without a copy
+        dtype = {'cell_id': np.int64, 'ignition_time': np.int64, 'temporal_delay': np.float32}.get(name, np.int32)
+        array = np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype=dtype)
+        _save(os.path.join(temporary_root, "graph", f"{name}.npy"), array)
+
+    with open(os.path.join(temporary_root, "perimeters.wkb"), "wb") as file:
+        file.write(b''.join(wkbs))
+    pd.DataFrame(index_rows, columns=['uniquefire'] + INDEX_FIELDS).to_parquet(os.path.join(temporary_root, "index.parquet"), index=False)
+    perimeters = pd.concat(perimeter_rows, ignore_index=True) if perimeter_rows else pd.DataFrame(columns=['__perimeter_index'])
+    perimeters.to_parquet(os.path.join(temporary_root, "perimeters.parquet"), index=False)
+    with open(os.path.join(temporary_root, "schema.json"), "w") as file:
+        json.dump(schema, file)
+
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.replace(temporary_root, root)
+    return root
+
+
+class FireStore(Mapping):
+    """
+    read-only mapping of uniquefire -> WildfirePerimeter over a packed store.
+    every array is memory-mapped once when the store is opened; a fire is
+    then opened with a dictionary lookup and slices of those arrays, so its
+    numeric observation columns and graph arrays are views rather than copies.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, "schema.json")) as file:
+            self.schema = json.load(file)
+        self.index = pd.read_parquet(os.path.join(root, "index.parquet"))
+        self._positions = {uniquefire: position for position, uniquefire in enumerate(self.index['uniquefire'])}
+        self._offsets = {field: self.index[field].to_numpy() for field in INDEX_FIELDS}
+        self._perimeters = pd.read_parquet(os.path.join(root, "perimeters.parquet"))
+        self._crs = CRS.from_json(self.schema['crs']) if self.schema['crs'] else None
+        self._wkb = np.memmap(os.path.join(root, "perimeters.wkb"), dtype=np.uint8, mode='r') \
+            if os.path.getsize(os.path.join(root, "perimeters.wkb")) else np.zeros(0, dtype=np.uint8)
+
+        self._columns = []
+        for position, entry in enumerate(self.schema['columns']):
+            array = _open_array(os.path.join(root, "observations", f"{position}.npy"))
+            categories = pd.Index(entry['categories']) if entry['kind'] == 'category' else None
+            self._columns.append((entry['name'], entry['kind'], array, categories, entry.get('source_dtype', 'category')))
+        self._observation_index = None
+        if self.schema['index'] is not None:
+            self._observation_index = _open_array(os.path.join(root, "observations", f"{OBSERVATION_INDEX}.npy"))
+        self._graph = {name: _open_array(os.path.join(root, "graph", f"{name}.npy")) for name in GRAPH_ARRAYS}
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, uniquefire):
+        return uniquefire in self._positions
+
+    def _offset(self, position, field):
+        return int(self._offsets[field][position])
+
+    def observations(self, uniquefire):
+        """observation columns of one fire as a DataFrame over the memory-mapped arrays."""
+        position = self._positions[uniquefire]
+        start = self._offset(position, 'obs_start')
+        stop = start + self._offset(position, 'obs_count')
+
+        index = pd.Index(self._observation_index[start:stop]) if self._observation_index is not None else None
+        data = {}
+        for name, kind, array, categories, source_dtype in self._columns:
+            values = array[start:stop]
+            if kind == 'category':
+                values = pd.Categorical.from_codes(values, categories=categories)
+            elif kind == 'datetime':
+                values = values.view('datetime64[ns]')
+            data[name] = pd.Series(values, index=index, name=name, copy=False)
+            if kind == 'category' and source_dtype != 'category':
+                data[name] = data[name].astype(source_dtype)
+        return pd.DataFrame(data, index=index, copy=False)
+
+    def perimeter(self, uniquefire):
+        """the fire's perimeter as a one-row GeoDataFrame indexed like the source perimeters."""
+        position = self._positions[uniquefire]
+        start = self._offset(position, 'wkb_start')
+        length = self._offset(position, 'wkb_length')
+        perimeter_row = self._offset(position, 'perimeter_row')
+        attributes = self._perimeters.iloc[[perimeter_row] if perimeter_row >= 0 else []]
+        attributes = attributes.set_index('__perimeter_index')
+        attributes.index.name = None
+        geometry = shapely.from_wkb([bytes(self._wkb[start:start + length])] if length else [])
+        return gpd.GeoDataFrame(attributes, geometry=gpd.GeoSeries(geometry, index=attributes.index, crs=self._crs))
+
+    def graph(self, uniquefire, observations=None):
+        """the fire's FireGraph with CSR matrices over the memory-mapped arrays."""
+        position = self._positions[uniquefire]
+        node_start = self._offset(position, 'node_start')
+        n_nodes = self._offset(position, 'node_count')
+        indptr_start = self._offset(position, 'indptr_start')
+        nodes = slice(node_start, node_start + n_nodes)
+        indptr = slice(indptr_start, indptr_start + n_nodes + 1)
+
+        def adjacency(name, data):
+            start = self._offset(position, f'{name}_start')
+            stop = start + self._offset(position, f'{name}_count')
+            values, indices = data(start, stop), self._graph[f'{name}_indices'][start:stop]
+            matrix = sparse.csr_matrix((values, indices, self._graph[f'{name}_indptr'][indptr]), shape=(n_nodes, n_nodes), copy=False)
+            # scipy copies small slices of large arrays while validating, put the views back
+            matrix.data, matrix.indices = values, indices
+            return matrix
+
+        spatial = adjacency('spatial', lambda start, stop: np.ones(stop - start, dtype=np.int8))
+        temporal = adjacency('temporal', lambda start, stop: self._graph['temporal_delay'][start:stop])
+
+        if observations is None:
+            observations = self.observations(uniquefire)
+        cell_ids = self._graph['cell_id'][nodes]
+        first_observation = self._graph['first_observation'][nodes]
+        rows, cols = cell_row_col(cell_ids)
+        cells = pd.DataFrame({
+            'cell_id': cell_ids, 'row': rows, 'col': cols,
+            'ignition_time': self._graph['ignition_time'][nodes].view('datetime64[ns]'),
+            'n_observations': self._graph['n_observations'][nodes],
+        })
+        table = pd.concat([cells, observations.iloc[first_observation].reset_index(drop=True)], axis=1)
+        return FireGraph(table, spatial, temporal, first_observation)
+
+    def __getitem__(self, uniquefire):
+        observations = self.observations(uniquefire)
+        fire = WildfirePerimeter(self.perimeter(uniquefire), observations, None, None)
+        if self.schema['graphs']:
+            fire.fire_graph = self.graph(uniquefire, observations)
+        return fire
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from filtered_store import read_observations
+    from merge_and_filter import load_largest_perimeters, parse_years
+    from perimeter_creation import create_wildfire_perimeters
+
+    parser = argparse.ArgumentParser(description="Pack a year of fires into a memory-mappable store.")
+    parser.add_argument("--years", nargs="+", default=["2015"])
+    parser.add_argument("--root", default=FIRES_DIR)
+    parser.add_argument("--no-graphs", action="store_true", help="skip the cell graphs")
+    args = parser.parse_args()
+
+    for year in parse_years(args.years):
+        observations = read_observations(years=year).drop(columns=['year'])
+        fires = create_wildfire_perimeters(observations, load_largest_perimeters(year))
+        print(f"{year}: packed {len(fires)} fires into {write_fire_store(fires, fire_store_dir(year, args.root), graphs=not args.no_graphs)}")
@@ -0,0 +1,256 @@
+import json
+import os
+import shutil
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+from grid import DEFAULT_GRID
+from grid_coverage import cell_extents
+
+TENSORS_DIR = "./data_filtered/tensors"
+
+# Layout of a tensor store (shards are .npy files, memory-mapped on read):
+#   tensors/year=2015/index.parquet      one row per fire: shard, offset and (T, H, W) of its tensor
+#   tensors/year=2015/schema.json        channels, dtype, time step and grid
+#   tensors/year=2015/shards/<n>.npy     flat arrays holding the (T, C, H, W) tensors of many fires
+
+DETECTION_CHANNELS = ['occupancy', 'frp']
+STEP_HOURS = 24
+PADDING = 1
+SHARD_BYTES = 1 << 30
+INDEX_FIELDS = ['shard', 'offset', 'steps', 'height', 'width', 'row_max', 'col_min', 'start', 'n_observations']
+
+
+def tensor_store_dir(year, root=TENSORS_DIR):
+    return os.path.join(root, f"year={int(year)}")
+
+
+def fire_layout(observations, perimeter=None, step_hours=STEP_HOURS, grid=DEFAULT_GRID, padding=PADDING):
+    """
+    places a fire's detections on its tensor: the (t, i, j) index of every
+    observation and the tensor's extent. t counts step_hours from the start
+    of the first detection's day, i counts rows down from row_max and j
+    columns from col_min. the extent covers the detections and the
+    perimeter's bounding box, padded by `padding` cells.
+    """
+    rows, cols = grid.snap(observations['LATITUDE'].to_numpy(np.float64), observations['LONGITUDE'].to_numpy(np.float64))
+    row_min, row_max = rows.min() - padding, rows.max() + padding
+    col_min, col_max = cols.min() - padding, cols.max() + padding
+    if perimeter is not None and len(perimeter):
+        bounds = cell_extents(perimeter.geometry, grid, padding)
+        row_min, row_max = min(row_min, bounds[0].min()), max(row_max, bounds[1].max())
+        col_min, col_max = min(col_min, bounds[2].min()), max(col_max, bounds[3].max())
+
+    times = observations['date_time'].to_numpy().astype('datetime64[ns]')
+    start = times.min().astype('datetime64[D]').astype('datetime64[ns]')
+    t = ((times - start) // np.timedelta64(step_hours, 'h')).astype(np.int64)
+    return {
+        't': t, 'i': row_max - rows, 'j': cols - col_min,
+        'steps': int(t.max()) + 1, 'height': int(row_max - row_min + 1), 'width': int(col_max - col_min + 1),
+        'row_max': int(row_max), 'col_min': int(col_min), 'start': start,
+    }
+
+
+def fill_fire_tensor(tensor, layout, frp, features=None):
+    """
+    writes a fire's channels into a (T, C, H, W) array: occupancy (1 where a
+    cell had a detection in the step), total FRP, then the mean of every
+    feature column over the detections of each cell and step. cells without
+    detections are 0 for occupancy and FRP and NaN for the features.
+    """
+    steps, channels, height, width = tensor.shape
+    cells, inverse = np.unique((layout['t'] * height + layout['i']) * width + layout['j'], return_inverse=True)
+    t, rest = np.divmod(cells, height * width)
+    i, j = np.divmod(rest, width)
+
+    tensor[:, :len(DETECTION_CHANNELS)] = 0
+    tensor[:, len(DETECTION_CHANNELS):] = np.nan
+    tensor[t, 0, i, j] = 1
+    tensor[t, 1, i, j] = np.bincount(inverse, weights=np.nan_to_num(frp), minlength=len(cells))
+
+    if features is not None:
+        for k, values in enumerate(features.T, start=len(DETECTION_CHANNELS)):
+            present = ~np.isnan(values)
+            sums = np.bincount(inverse[present], weights=values[present], minlength=len(cells))
+            counts = np.bincount(inverse[present], minlength=len(cells))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                tensor[t, k, i, j] = np.where(counts > 0, sums / counts, np.nan)
+    return tensor
+
+
+def _feature_matrix(observations, features, feature_columns):
+    if features is None or not feature_columns:
+        return None
+    values = features.reindex(observations['observation_id'].to_numpy())[feature_columns]
+    return values.to_numpy(np.float64)
+
+
+def _fire_parts(fires, uniquefire):
+    """observations and perimeter of a fire, without building a FireStore fire's graph."""
+    if hasattr(fires, 'observations') and hasattr(fires, 'perimeter'):
+        return fires.observations(uniquefire), fires.perimeter(uniquefire)
+    fire = fires[uniquefire]
+    return fire.viirs_observations, fire.perimeter
+
+
+def write_tensor_store(fires, root, features=None, feature_columns=None, step_hours=STEP_HOURS,
+                       dtype=np.float32, shard_bytes=SHARD_BYTES, grid=DEFAULT_GRID):
+    """
+    builds the (T, C, H, W) tensor of every fire of a mapping of uniquefire ->
+    WildfirePerimeter (or a FireStore) and packs them into memory-mapped
+    shards of about shard_bytes. features is a table keyed by observation_id
+    (e.g. read_features) whose numeric columns become extra channels. the
+    store is written next to root and moved into place when complete.
+    float32 by default: float16 overflows above 65504 and keeps about three
+    significant digits, too few for summed FRP and features like road density.
+    """
+    if features is not None:
+        features = features.drop_duplicates('observation_id').set_index('observation_id')
+        if feature_columns is None:
+            feature_columns = [column for column in features.columns
+                               if column != 'year' and pd.api.types.is_numeric_dtype(features[column])]
+    feature_columns = list(feature_columns or [])
+    channels = DETECTION_CHANNELS + feature_columns
+    itemsize = np.dtype(dtype).itemsize
+
+    # first pass: every fire's layout and values, so shard sizes are known before writing
+    fire_inputs, index_rows = [], []
+    shard, shard_size, shard_sizes = 0, 0, []
+    for uniquefire in fires:
+        observations, perimeter = _fire_parts(fires, uniquefire)
+        if len(observations) == 0:
+            continue
+        layout = fire_layout(observations, perimeter, step_hours, grid)
+        size = layout['steps'] * len(channels) * layout['height'] * layout['width']
+        if shard_size and (shard_size + size) * itemsize > shard_bytes:
+            shard_sizes.append(shard_size)
+            shard, shard_size = shard + 1, 0
+        fire_inputs.append((layout, observations['FRP'].to_numpy(np.float64),
+                            _feature_matrix(observations, features, feature_columns)))
+        index_rows.append({'uniquefire': uniquefire, 'shard': shard, 'offset': shard_size,
+                           **{field: layout[field] for field in ('steps', 'height', 'width', 'row_max', 'col_min', 'start')},
+                           'n_observations': len(observations)})
+        shard_size += size
+    shard_sizes.append(shard_size)
+
+    temporary_root = root.rstrip(os.sep) + ".tmp"
+    if os.path.exists(temporary_root):
+        shutil.rmtree(temporary_root)
+    os.makedirs(os.path.join(temporary_root, "shards"))
+
+    # second pass: each tensor is filled in place in its shard
+    shards = [np.lib.format.open_memmap(os.path.join(temporary_root, "shards", f"{n}.npy"), mode='w+', dtype=dtype, shape=(size,))
+              for n, size in enumerate(shard_sizes)]
+    for row, (layout, frp, feature_values) in zip(index_rows, fire_inputs):
+        shape = (row['steps'], len(channels), row['height'], row['width'])
+        tensor = shards[row['shard']][row['offset']:row['offset'] + int(np.prod(shape))].reshape(shape)
+        fill_fire_tensor(tensor, layout, frp, feature_values)
+    for array in shards:
+        array.flush()
+    del shards, fire_inputs
+
+    index = pd.DataFrame(index_rows, columns=['uniquefire'] + INDEX_FIELDS)
+    index['start'] = index['start'].astype('datetime64[ns]')
+    index.to_parquet(os.path.join(temporary_root, "index.parquet"), index=False)
+    schema = {'channels': channels, 'dtype': np.dtype(dtype).name, 'step_hours': step_hours,
+              'crs': grid.crs, 'cell_size': [grid.cell_width, grid.cell_height]}
+    with open(os.path.join(temporary_root, "schema.json"), "w") as file:
+        json.dump(schema, file)
+
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.replace(temporary_root, root)
+    return root
+
+
+class FireTensorStore(Mapping):
+    """
+    read-only mapping of uniquefire -> (T, C, H, W) tensor over a store
+    written by write_tensor_store. shards are memory-mapped on first use and
+    tensors and windows are views into them, so random (fire, t) windows only
+    read the pages they touch.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, "schema.json")) as file:
+            self.schema = json.load(file)
+        self.channels = self.schema['channels']
+        self.index = pd.read_parquet(os.path.join(root, "index.parquet"))
+        self._positions = {uniquefire: position for position, uniquefire in enumerate(self.index['uniquefire'])}
+        self._fields = {field: self.index[field].to_numpy() for field in INDEX_FIELDS}
+        self._shards = {}
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, uniquefire):
+        return uniquefire in self._positions
+
+    def _shard(self, n):
+        if n not in self._shards:
+            self._shards[n] = np.asarray(np.load(os.path.join(self.root, "shards", f"{n}.npy"), mmap_mode='r'))
+        return self._shards[n]
+
+    def _tensor(self, position):
+        steps, height, width = (int(self._fields[field][position]) for field in ('steps', 'height', 'width'))
+        offset = int(self._fields['offset'][position])
+        size = steps * len(self.channels) * height * width
+        return self._shard(int(self._fields['shard'][position]))[offset:offset + size].reshape(steps, len(self.channels), height, width)
+
+    def __getitem__(self, uniquefire):
+        return self._tensor(self._positions[uniquefire])
+
+    def window(self, uniquefire, t, length=1):
+        """steps t .. t + length of a fire's tensor, cut short at the fire's last step."""
+        return self[uniquefire][t:t + length]
+
+    def step_times(self, uniquefire):
+        """start time of every step of a fire's tensor."""
+        position = self._positions[uniquefire]
+        start = self._fields['start'][position]
+        return start + np.arange(int(self._fields['steps'][position])) * np.timedelta64(self.schema['step_hours'], 'h')
+
+    def window_index(self, length=1, stride=1):
+        """(uniquefire, t) of every full window of `length` steps, as a DataFrame."""
+        steps = self._fields['steps']
+        counts = np.maximum((steps - length) // stride + 1, 0)
+        fire = np.repeat(np.arange(len(steps)), counts)
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        t = (np.arange(len(fire)) - first) * stride
+        return pd.DataFrame({'uniquefire': self.index['uniquefire'].to_numpy()[fire], 't': t})
+
+    def sample_windows(self, n, length=1, rng=None):
+        """n random full windows, as a list of (uniquefire, t, tensor view)."""
+        rng = np.random.default_rng(rng)
+        windows = self.window_index(length)
+        picks = windows.iloc[rng.integers(0, len(windows), n)] if len(windows) else windows
+        return [(uniquefire, t, self.window(uniquefire, t, length)) for uniquefire, t in picks.itertuples(index=False)]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from filtered_store import FEATURES_DIR, read_features
+    from fire_store import FIRES_DIR, FireStore, fire_store_dir
+    from merge_and_filter import parse_years
+
+    parser = argparse.ArgumentParser(description="Build per-fire occupancy/FRP/feature tensors from packed fire stores.")
+    parser.add_argument("--years", nargs="+", default=["2015"])
+    parser.add_argument("--fires-root", default=FIRES_DIR, help="root of the packed fire stores (see fire_store.py)")
+    parser.add_argument("--features-root", default=FEATURES_DIR)
+    parser.add_argument("--no-features", action="store_true", help="only the occupancy and FRP channels")
+    parser.add_argument("--root", default=TENSORS_DIR)
+    parser.add_argument("--step-hours", type=int, default=STEP_HOURS)
+    args = parser.parse_args()
+
+    for year in parse_years(args.years):
+        features = None if args.no_features else read_features(args.features_root, years=year)
+        path = write_tensor_store(FireStore(fire_store_dir(year, args.fires_root)), tensor_store_dir(year, args.root),
+                                  features, step_hours=args.step_hours)
+        print(f"{year}: wrote {len(FireTensorStore(path))} fire tensors to {path}")
@@ -1,101 +1,85 @@
+import json
+
 import ee
 import geemap.core as geemap
 import geopandas as gpd
 import pandas as pd
-import numpy as np
+import shapely
+
+from shapely.geometry import Polygon
 
-from shapely.geometry import Polygon, box
+from grid import Grid
+from grid_coverage import cell_extents, cells_within, count_cells_within_all
+from perimeter_rasters import WIND_BANDS, sample_extent, wind_image
 
 CELL_WIDTH = 375
 CELL_HEIGHT = 375
 PERFORM_COUNT = False
-
-ee.Authenticate()
-ee.Initialize()
+# shapely geometry type ids
+POLYGON = 3
+MULTIPOLYGON = 6
 
 perimeter_data_file = 'data/perimeters/US_HIST_FIRE_PERIM_2015_DD83.shp'
-perimeters = gpd.read_file(perimeter_data_file,  engine='pyogrio')
 
 def count_rectangles_within(geometry, cell_width_meters, cell_height_meters, plot_rects=False):
-    km_per_degree = 111.1 # oversimplified conversion from degrees to km
-    avg_latitude = geometry.centroid.y
-    cell_width_deg = cell_width_meters / (km_per_degree * 1000 * abs(np.cos(np.radians(avg_latitude))))
-    cell_height_deg = cell_height_meters / (km_per_degree * 1000)
-    
-    minx, miny, maxx, maxy = geometry.bounds
-    
-    # generate grid of rectangles within the bounding box, cound how many
-    # are contained within the geometry
-    # NOTE: plot_rects is for visualizing along with count, not for efficiency
-    #      (it's much slower)
+    # cells are laid out on the shared equal-area grid (see grid.py), so their
+    # size in meters holds at every latitude
+    grid = Grid(cell_width=cell_width_meters, cell_height=cell_height_meters)
+    count, rows, cols = cells_within(geometry, grid)
+
+    # NOTE: plot_rects is for visualizing along with count
     if plot_rects:
-        rects = []
-        x = minx
-        while x < maxx:
-            y = miny
-            while y < maxy:
-                rects.append(box(x, y, x + cell_width_deg, y + cell_height_deg))
-                y += cell_height_deg
-            x += cell_width_deg
-        
-        count = sum(1 for rect in rects if geometry.intersects(rect))
-        gpd.GeoSeries([rect for rect in rects if geometry.intersects(rect)]).plot()
-    else:
-        count = 0
-        x = minx
-        while x < maxx:
-            y = miny
-            while y < maxy:
-                rect = box(x, y, x + cell_width_deg, y + cell_height_deg)
-                if geometry.intersects(rect):  # using intersects for efficiency
-                    count += 1
-                y += cell_height_deg
-            x += cell_width_deg
-    
+        gpd.GeoSeries(grid.cell_boxes(rows, cols), crs=grid.crs).plot()
+
     return count
 
 def gpd_to_ee(perimeters, polygon=False):
-    data = []
+    """
+    per-row ee geometries of the perimeters: bounding rectangles, or with
+    polygon the exterior rings of every part. centroids and bounds are
+    computed for all rows at once; see gpd_to_feature_collection for a
+    single payload covering every perimeter.
+    """
+    geometries = perimeters.geometry.values
+    centroids = shapely.centroid(geometries)
+    bounds = shapely.bounds(geometries)
+    type_ids = shapely.get_type_id(geometries)
 
-    for idx, geometry in perimeters.iterrows():
-        centroid = geometry.geometry.centroid
-        ee_centroid = ee.Geometry.Point([centroid.x, centroid.y])
-        
-        if polygon:
-            if geometry.geom_type == 'MultiPolygon':
-                polygons = [ee.Geometry.Polygon(list(p.exterior.coords)) for p in geometry.geometry.geoms]
-                data.append((idx, polygons, True, ee_centroid))
-            elif geometry.geom_type == 'Polygon':
-                ee_polygon = ee.Geometry.Polygon(list(geometry.geometry.exterior.coords))
-                data.append((idx, [ee_polygon], False, ee_centroid))
-            else:
-                bounds = geometry.geometry.bounds
-                ee_rect = ee.Geometry.Rectangle([bounds[0], bounds[1], bounds[2], bounds[3]])
-                data.append((idx, [ee_rect], False, ee_centroid))
+    data = []
+    for idx, geometry, type_id, x, y, (minx, miny, maxx, maxy) in zip(
+            perimeters.index, geometries, type_ids, shapely.get_x(centroids), shapely.get_y(centroids), bounds):
+        ee_centroid = ee.Geometry.Point([x, y])
+        if polygon and type_id == POLYGON:
+            data.append((idx, [ee.Geometry.Polygon(shapely.get_coordinates(geometry.exterior).tolist())], False, ee_centroid))
+        elif polygon and type_id == MULTIPOLYGON:
+            polygons = [ee.Geometry.Polygon(shapely.get_coordinates(part.exterior).tolist()) for part in geometry.geoms]
+            data.append((idx, polygons, True, ee_centroid))
         else:
-            bounds = geometry.geometry.bounds
-            ee_rect = ee.Geometry.Rectangle([bounds[0], bounds[1], bounds[2], bounds[3]])
-            data.append((idx, [ee_rect], False, ee_centroid))
+            data.append((idx, [ee.Geometry.Rectangle([minx, miny, maxx, maxy])], False, ee_centroid))
 
     ee_geometries_df = pd.DataFrame(data, columns=['index', 'geometry', 'multi', 'center'])
     ee_geometries_df.set_index('index', inplace=True)
 
     return ee_geometries_df
 
-if PERFORM_COUNT:
-    rect_counts = perimeters.geometry.apply(lambda p: count_rectangles_within(p, CELL_WIDTH, CELL_HEIGHT))
-    print(rect_counts.describe())
-    # For Data from 2015:
-    # count     7609.000000
-    # mean       701.751216
-    # std       1351.951292
-    # min          1.000000
-    # 25%         25.000000
-    # 50%        172.000000
-    # 75%        703.000000
-    # max      16542.000000
-else:
-    count_rectangles_within(perimeters.geometry.iloc[7607], CELL_WIDTH, CELL_HEIGHT)
+def perimeters_geojson(perimeters, polygon=False, properties=('uniquefire',)):
+    """
+    GeoJSON FeatureCollection dict of the perimeters (or their bounding
+    boxes, kept planar like ee.Geometry.Rectangle), serialized in one pass.
+    every feature's id is its row label.
+    """
+    columns = [column for column in properties if column in perimeters.columns]
+    geometries = perimeters.geometry if polygon else perimeters.geometry.envelope
+    frame = gpd.GeoDataFrame(perimeters[columns], geometry=geometries.values, crs=perimeters.crs)
+    collection = json.loads(frame.to_json(na='null'))
+    if not polygon:
+        for feature in collection['features']:
+            feature['geometry']['geodesic'] = False
+    return collection
+
+def gpd_to_feature_collection(perimeters, polygon=False, properties=('uniquefire',)):
+    """all perimeters as one ee.FeatureCollection, sent to Earth Engine as a single payload."""
+    return ee.FeatureCollection(perimeters_geojson(perimeters, polygon, properties))
 
 def grab_wind_image_from_geometry(date_str, region):
     date = ee.Date(date_str)
@@ -119,14 +103,36 @@ def grab_wind_image_from_geometry(date_str, region):
     return wind_u_array.getInfo()
 
 
-ee_geometries = gpd_to_ee(perimeters)
+if __name__ == "__main__":
+    ee.Authenticate()
+    ee.Initialize()
+
+    perimeters = gpd.read_file(perimeter_data_file,  engine='pyogrio')
+
+    if PERFORM_COUNT:
+        rect_counts = count_cells_within_all(perimeters.geometry, Grid(cell_width=CELL_WIDTH, cell_height=CELL_HEIGHT))
+        print(rect_counts.describe())
+        # For Data from 2015 (counted on the earlier degree-based lattice):
+        # count     7609.000000
+        # mean       701.751216
+        # std       1351.951292
+        # min          1.000000
+        # 25%         25.000000
+        # 50%        172.000000
+        # 75%        703.000000
+        # max      16542.000000
+    else:
+        count_rectangles_within(perimeters.geometry.iloc[7607], CELL_WIDTH, CELL_HEIGHT)
 
-idx_max = perimeters.gisacres.idxmax()
-idx_min = perimeters.gisacres.idxmin()
-region = ee_geometries.iloc[idx_max].geometry[0]
-center = ee_geometries.iloc[idx_max].center.coordinates().getInfo()
+    # every perimeter in one FeatureCollection payload instead of an ee.Geometry per row
+    ee_perimeters = gpd_to_feature_collection(perimeters)
+    print(ee_perimeters.size().getInfo())
 
-date_str = '2015-11-07'
+    idx_max = perimeters.gisacres.idxmax()
+    date_str = '2015-11-07'
 
-wind_sample = grab_wind_image_from_geometry(date_str, region)
-print(wind_sample)
\ No newline at end of file
+    # sampleRectangle over the largest fire exceeds the pixel limit, so it is
+    # fetched in grid tiles and stitched (see perimeter_rasters.py)
+    row_min, row_max, col_min, col_max = cell_extents(perimeters.geometry.loc[[idx_max]])
+    wind_sample = sample_extent(wind_image(date_str), WIND_BANDS, row_min[0], row_max[0], col_min[0], col_max[0], threads=8)
+    print(wind_sample.shape)
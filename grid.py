@@ -0,0 +1,119 @@
+import threading
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+
+# NAD83 / Conus Albers: equal-area over CONUS, its area of use. Alaska fires are
+# snapped to it too but the cells are not square there: around Fairbanks a "375 m"
+# cell is about 313 m east-west by 449 m north-south and skewed by about 20
+# degrees, so distances and 8-neighbour graphs of AK fires are distorted
+GRID_CRS = 'EPSG:5070'
+CELL_SIZE_M = 375.0
+
+# offset that makes cols non-negative before packing them into the low 32 bits of a cell id
+_COL_OFFSET = 1 << 31
+
+
+class Grid:
+    """
+    the 375 m VIIRS cell lattice in a projected, equal-area CRS.
+
+    points snap to integer (row, col) indices with cell (row, col) covering
+    [col * width, (col + 1) * width) x [row * height, (row + 1) * height) in
+    projected meters. every stage should use these integer keys (or the packed
+    cell_id) for joins, caching and graph construction.
+    """
+
+    def __init__(self, crs=GRID_CRS, cell_width=CELL_SIZE_M, cell_height=None):
+        self.crs = crs
+        self.cell_width = float(cell_width)
+        self.cell_height = float(cell_height if cell_height is not None else cell_width)
+        self._local = threading.local()
+
+    def _transformers(self):
+        # pyproj transformers should not be shared between threads
+        transformers = getattr(self._local, 'transformers', None)
+        if transformers is None:
+            transformers = (
+                Transformer.from_crs('EPSG:4326', self.crs, always_xy=True),
+                Transformer.from_crs(self.crs, 'EPSG:4326', always_xy=True),
+            )
+            self._local.transformers = transformers
+        return transformers
+
+    def project(self, lats, lons):
+        """(x, y) projected meters for arrays of WGS84 latitudes and longitudes."""
+        forward, _ = self._transformers()
+        return forward.transform(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+
+    def unproject(self, x, y):
+        """(lats, lons) for arrays of projected coordinates."""
+        _, inverse = self._transformers()
+        lons, lats = inverse.transform(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+        return lats, lons
+
+    def snap_xy(self, x, y):
+        """(rows, cols) int64 arrays of the cells containing projected points."""
+        rows = np.floor(np.asarray(y) / self.cell_height).astype(np.int64)
+        cols = np.floor(np.asarray(x) / self.cell_width).astype(np.int64)
+        return rows, cols
+
+    def snap(self, lats, lons):
+        """(rows, cols) int64 arrays of the cells containing WGS84 points."""
+        return self.snap_xy(*self.project(lats, lons))
+
+    def snap_point(self, lat, lon):
+        """(row, col) of a single point, as python ints."""
+        rows, cols = self.snap([lat], [lon])
+        return int(rows[0]), int(cols[0])
+
+    def cell_center_xy(self, rows, cols):
+        return (np.asarray(cols) + 0.5) * self.cell_width, (np.asarray(rows) + 0.5) * self.cell_height
+
+    def cell_centers(self, rows, cols):
+        """(lats, lons) of cell centers."""
+        return self.unproject(*self.cell_center_xy(rows, cols))
+
+    def cell_bounds_xy(self, rows, cols):
+        """(minx, miny, maxx, maxy) arrays of cells in projected meters."""
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        return (cols * self.cell_width, rows * self.cell_height,
+                (cols + 1) * self.cell_width, (rows + 1) * self.cell_height)
+
+    def cell_boxes(self, rows, cols):
+        """shapely polygons of cells in the grid CRS."""
+        return shapely.box(*self.cell_bounds_xy(rows, cols))
+
+    def project_geometry(self, geometry):
+        """a WGS84 shapely geometry (or array of them) transformed to the grid CRS."""
+        forward, _ = self._transformers()
+
+        def transform(coords):
+            x, y = forward.transform(coords[:, 0], coords[:, 1])
+            return np.column_stack([x, y])
+
+        return shapely.transform(geometry, transform)
+
+    def __getstate__(self):
+        # transformers are rebuilt lazily in each process
+        return {'crs': self.crs, 'cell_width': self.cell_width, 'cell_height': self.cell_height}
+
+    def __setstate__(self, state):
+        self.__init__(state['crs'], state['cell_width'], state['cell_height'])
+
+
+def cell_id(rows, cols):
+    """packs (row, col) into a single int64 key, ordered by row then col."""
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64) + _COL_OFFSET
+    return (rows << 32) | cols
+
+
+def cell_row_col(cell_ids):
+    """unpacks int64 cell ids into (rows, cols)."""
+    cell_ids = np.asarray(cell_ids, dtype=np.int64)
+    return cell_ids >> 32, (cell_ids & 0xFFFFFFFF) - _COL_OFFSET
+
+
+DEFAULT_GRID = Grid()
@@ -0,0 +1,61 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from grid import DEFAULT_GRID
+
+
+def cells_within(geometry, grid=DEFAULT_GRID):
+    """
+    cells of the grid lattice covering the geometry's bounding box, tested
+    against the (projected) geometry in one vectorized call. returns
+    (count, rows, cols), with rows and cols the grid indices of the cells that
+    intersect the geometry.
+    """
+    projected = grid.project_geometry(geometry)
+    minx, miny, maxx, maxy = projected.bounds
+    row_min, col_min = grid.snap_xy(minx, miny)
+    row_max, col_max = grid.snap_xy(maxx, maxy)
+
+    rows, cols = np.meshgrid(np.arange(row_min, row_max + 1), np.arange(col_min, col_max + 1), indexing='ij')
+    rows, cols = rows.ravel(), cols.ravel()
+
+    shapely.prepare(projected)
+    hits = shapely.intersects(projected, grid.cell_boxes(rows, cols))
+    return int(hits.sum()), rows[hits], cols[hits]
+
+
+def cell_extents(geometries, grid=DEFAULT_GRID, padding=0):
+    """
+    (row_min, row_max, col_min, col_max) arrays of the cells covering the
+    projected bounding box of every geometry of a GeoSeries, padded by
+    `padding` cells on each side.
+    """
+    bounds = geometries.to_crs(grid.crs).bounds
+    row_min, col_min = grid.snap_xy(bounds['minx'].to_numpy(), bounds['miny'].to_numpy())
+    row_max, col_max = grid.snap_xy(bounds['maxx'].to_numpy(), bounds['maxy'].to_numpy())
+    return row_min - padding, row_max + padding, col_min - padding, col_max + padding
+
+
+def _count_wkb(arguments):
+    wkb, grid = arguments
+    count, _, _ = cells_within(shapely.from_wkb(wkb), grid)
+    return count
+
+
+def count_cells_within_all(geometries, grid=DEFAULT_GRID, processes=None, chunksize=64):
+    """
+    cell counts for every geometry of a WGS84 GeoSeries, spread over worker
+    processes. returns a Series aligned with the input index.
+    """
+    processes = processes or os.cpu_count()
+    arguments = [(wkb, grid) for wkb in shapely.to_wkb(np.asarray(geometries))]
+    if processes == 1:
+        counts = list(map(_count_wkb, arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            counts = list(pool.map(_count_wkb, arguments, chunksize=chunksize))
+    return pd.Series(counts, index=geometries.index, name='cell_count')
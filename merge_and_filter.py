@@ -1,101 +1,184 @@
+import argparse
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import geopandas as gpd
 import pandas as pd
 from tqdm import tqdm
 
+from filtered_store import OBSERVATIONS_DIR, write_observations
+from perimeter_assignment import closest_perimeter_mask, mean_observation_day_by_perimeter
+from spatial_join import sjoin_within
+from timing import StageTimer
+
 DATA_DIR = "./data"
 SAVE_DIR = "./data_filtered"
+VIIRS_FILE = "fire_archive_SV-C2_390000.shp"
 
 YEARS = [2015] # ...
 
-print(f"Loading VIIRS data...")
-viirs_data = gpd.read_file(os.path.join(DATA_DIR, "fire_archive_SV-C2_390000.shp"), engine="pyogrio")
-
-for year in tqdm(YEARS, desc="Merging and filtering data by year"):
-    with tqdm(total=8, leave=False) as pbar:
 
-        # Filter to year and add observation ID column
-        pbar.set_description("Adding observation ID column")
-        year_data = viirs_data[viirs_data["ACQ_DATE"].apply(lambda timestamp: timestamp.year) == year]
+def parse_years(values):
+    """parses year arguments such as `2015` or `2012-2024` into a sorted list."""
+    years = set()
+    for value in values:
+        if "-" in value:
+            start, end = value.split("-")
+            years.update(range(int(start), int(end) + 1))
+        else:
+            years.add(int(value))
+    return sorted(years)
+
+
+def load_viirs_year(year, data_dir=DATA_DIR, viirs_file=VIIRS_FILE):
+    """
+    reads only the rows of the VIIRS archive acquired in `year`.
+    the index is the feature id, which matches the row labels of a full read.
+    """
+    where = f"ACQ_DATE >= '{year}/01/01' AND ACQ_DATE < '{year + 1}/01/01'"
+    viirs_data = gpd.read_file(os.path.join(data_dir, viirs_file), engine="pyogrio", where=where, fid_as_index=True)
+    viirs_data.index.name = None
+    return viirs_data
+
+
+# compact dtypes applied at ingestion; geometry stays float64
+FLOAT32_COLUMNS = ['LATITUDE', 'LONGITUDE', 'BRIGHTNESS', 'SCAN', 'TRACK', 'BRIGHT_T31', 'FRP']
+CATEGORY_COLUMNS = ['SATELLITE', 'INSTRUMENT', 'CONFIDENCE', 'VERSION', 'DAYNIGHT']
+
+
+def acquisition_datetimes(acq_date, acq_time):
+    """
+    date_time of each detection from ACQ_DATE plus ACQ_TIME (HHMM), computed
+    arithmetically instead of formatting and re-parsing strings.
+    """
+    dates = acq_date if pd.api.types.is_datetime64_any_dtype(acq_date) else pd.to_datetime(acq_date)
+    hhmm = pd.to_numeric(acq_time).astype('int64')
+    minutes = (hhmm // 100) * 60 + hhmm % 100
+    return (dates + pd.to_timedelta(minutes, unit='min')).astype('datetime64[ns]')
+
+
+def compact_viirs(viirs_data):
+    """
+    typed ingestion of the VIIRS attributes: ACQ_DATE as datetime64, ACQ_TIME
+    as an integer HHMM, float32 measurements and categorical flags.
+    """
+    columns = {}
+    if not pd.api.types.is_datetime64_any_dtype(viirs_data['ACQ_DATE']):
+        columns['ACQ_DATE'] = pd.to_datetime(viirs_data['ACQ_DATE'])
+    columns['ACQ_TIME'] = pd.to_numeric(viirs_data['ACQ_TIME']).astype('int16')
+    for column in FLOAT32_COLUMNS:
+        if column in viirs_data.columns:
+            columns[column] = viirs_data[column].astype('float32')
+    for column in CATEGORY_COLUMNS:
+        if column in viirs_data.columns:
+            columns[column] = viirs_data[column].astype('category')
+    if 'TYPE' in viirs_data.columns:
+        columns['TYPE'] = viirs_data['TYPE'].astype('int8')
+    return viirs_data.assign(**columns)
+
+
+def load_largest_perimeters(year, data_dir=DATA_DIR):
+    """loads a year's perimeters, keeping only the largest one for each uniquefire."""
+    perimeter_data = gpd.read_file(os.path.join(data_dir, "perimeters", f"US_HIST_FIRE_PERIM_{year}_DD83.shp"), engine="pyogrio")
+    perimeter_data['area'] = perimeter_data.geometry.area
+    indices_of_largest = perimeter_data.groupby('uniquefire')['area'].idxmax()
+    perimeter_data = perimeter_data.loc[indices_of_largest]
+    return perimeter_data.drop(columns=['area'])
+
+
+def merge_and_filter_year(viirs_data, perimeter_data, year, timer=None, pbar=None, join_processes=1):
+    """
+    joins a year of VIIRS detections to the fire perimeters they fall within
+    and keeps, for each observation, only the temporally closest perimeter.
+    the join is spread over join_processes worker processes.
+    """
+    timer = timer or StageTimer()
+
+    def advance(description):
+        if pbar is not None:
+            pbar.set_description(description)
+            pbar.update(1)
+
+    # Filter to year and add observation ID column
+    with timer.stage("filter year"):
+        acq_date = viirs_data["ACQ_DATE"]
+        if not pd.api.types.is_datetime64_any_dtype(acq_date):
+            acq_date = pd.to_datetime(acq_date)
+        year_data = compact_viirs(viirs_data[(acq_date.dt.year == year).to_numpy()])
         year_data.insert(0, "observation_id", range(len(year_data)))
+    advance("Joining VIIRS and perimeter data")
+
+    with timer.stage("spatial join", items=len(year_data)):
+        joined_data = sjoin_within(year_data, perimeter_data, processes=join_processes)
+
+    # Add combined date_time column
+    with timer.stage("build date_time"):
+        joined_data['date_time'] = acquisition_datetimes(joined_data['ACQ_DATE'], joined_data['ACQ_TIME'])
+    advance("Computing mean observation time per perimeter")
+
+    with timer.stage("mean observation day"):
+        average_observation_day_by_perimeter = mean_observation_day_by_perimeter(joined_data)
+    advance("Filtering observations to nearest perimeter")
+
+    with timer.stage("closest perimeter"):
+        filtered_data = joined_data[closest_perimeter_mask(joined_data, average_observation_day_by_perimeter)]
+        filtered_data = filtered_data.assign(uniquefire=filtered_data['uniquefire'].astype('category'))
+    advance("Saving dataframe")
+
+    return filtered_data
+
+
+def process_year(year, data_dir=DATA_DIR, save_dir=SAVE_DIR, store_dir=OBSERVATIONS_DIR, save_pickle=False, show_progress=True, join_processes=1):
+    """
+    runs the full join/filter for a single year and writes the result to the
+    partitioned observation store (and optionally the legacy pickle).
+    """
+    timer = StageTimer()
+    with tqdm(total=7, leave=False, disable=not show_progress) as pbar:
+        pbar.set_description(f"Loading VIIRS data for {year}")
+        with timer.stage("load viirs"):
+            viirs_data = load_viirs_year(year, data_dir)
         pbar.update(1)
 
         pbar.set_description(f"Loading perimeter data for {year}")
-        perimeter_data = gpd.read_file(os.path.join(DATA_DIR, "perimeters", f"US_HIST_FIRE_PERIM_{year}_DD83.shp"), engine="pyogrio")
-
-        pbar.set_description(f"Maintain only largest perimeter for each uniquefire.")
-        perimeter_data['area'] = perimeter_data.geometry.area
-        indices_of_largest = perimeter_data.groupby('uniquefire')['area'].idxmax()
-        perimeter_data = perimeter_data.loc[indices_of_largest]
-        perimeter_data = perimeter_data.drop(columns=['area'])
-
-        # Rename perimeter geometry so it gets kept in the join
-        # perimeter_data = perimeter_data.rename(columns={"geometry": "perimiter_geometry"})
-        # perimeter_data["perimeter_geometry"] = perimeter_data["geometry"]
+        with timer.stage("load perimeters"):
+            perimeter_data = load_largest_perimeters(year, data_dir)
         pbar.update(1)
 
-        pbar.set_description("Joining VIIRS and perimeter data")
-        joined_data = gpd.sjoin(year_data, perimeter_data, how="inner", predicate="within")
-
-        # Add combined date_time column
-        times = [f"{str(time)[:2]}:{str(time)[2:]}" for time in joined_data['ACQ_TIME'].astype(str).str.zfill(4)]
-        dates = joined_data['ACQ_DATE'].astype(str)
-        date_times = [f"{date} {time}" for date, time in zip(dates, times)]
-        joined_data['date_time'] = pd.to_datetime(date_times)
-
-        pbar.update(1)
-
-        pbar.set_description("Computing mean observation time per perimeter")
-        average_observation_day_by_perimeter = {}
-        for perimeter in joined_data["uniquefire"].unique():
-
-            date_times = joined_data[joined_data['uniquefire'] == perimeter]['date_time']
-            value_counts = date_times.value_counts()
-            average_obs_day = (value_counts.index.day_of_year * value_counts).sum() / value_counts.sum()
+        filtered_data = merge_and_filter_year(viirs_data, perimeter_data, year, timer=timer, pbar=pbar, join_processes=join_processes)
 
-            average_observation_day_by_perimeter[perimeter] = average_obs_day
-
-        pbar.update(1)
-        
-        pbar.set_description("Mapping observations to date_times")
-        observation_id_to_date_time = dict(joined_data.apply(lambda row: (row["observation_id"], row["date_time"]), axis=1).values)
+        with timer.stage("save"):
+            output_file = write_observations(filtered_data, year, store_dir)
+            if save_pickle:
+                filtered_data.to_pickle(os.path.join(save_dir, f"filtered_data_{year}.pkl"))
         pbar.update(1)
 
-        pbar.set_description("Mapping observations to perimeters")
-        observation_id_to_perimeters = joined_data.groupby("observation_id")["uniquefire"].apply(list).to_dict()
-        pbar.update(1)
-
-        def find_temporally_closest_perimeter(observation_id):
-            observation_date_time = observation_id_to_date_time[observation_id]
-
-            possible_perimeters = observation_id_to_perimeters[observation_id]
+    return year, output_file, len(filtered_data), timer
 
-            best_avg_time_delta = 1000 # in days
-            best_perimeter_id = None
 
-            for perimeter_id in possible_perimeters:
+def main():
+    parser = argparse.ArgumentParser(description="Join VIIRS detections to fire perimeters, one process per year.")
+    parser.add_argument("--years", nargs="+", default=[str(year) for year in YEARS], help="years or ranges, e.g. 2012-2024")
+    parser.add_argument("--workers", type=int, default=1, help="number of years processed concurrently")
+    parser.add_argument("--join-workers", type=int, default=1, help="processes for each year's spatial join")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--save-dir", default=SAVE_DIR)
+    parser.add_argument("--store-dir", default=OBSERVATIONS_DIR, help="root of the partitioned GeoParquet store")
+    parser.add_argument("--pickle", action="store_true", help="also write the legacy filtered_data_{year}.pkl")
+    args = parser.parse_args()
 
-                average_obs_day = average_observation_day_by_perimeter[perimeter_id]
+    years = parse_years(args.years)
+    os.makedirs(args.save_dir, exist_ok=True)
 
-                avg_time_delta = abs(observation_date_time.day_of_year - average_obs_day)
+    # one fresh process per year, so peak memory is bounded by the largest
+    # year (times the number of workers) rather than the whole archive
+    with ProcessPoolExecutor(max_workers=args.workers, max_tasks_per_child=1) as pool:
+        futures = [pool.submit(process_year, year, args.data_dir, args.save_dir, args.store_dir, args.pickle, args.workers == 1, args.join_workers)
+                   for year in years]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Merging and filtering data by year"):
+            year, output_file, n_rows, timer = future.result()
+            timer.report(f"Stage timings for {year} ({n_rows} observations -> {output_file}):")
 
-                if avg_time_delta < best_avg_time_delta:
-                    best_avg_time_delta = avg_time_delta
-                    best_perimeter_id = perimeter_id
-
-            return best_perimeter_id
-        
-        pbar.set_description("Filtering observations to nearest perimeter")
-        filtered_data = joined_data[joined_data["observation_id"].apply(find_temporally_closest_perimeter) == joined_data["uniquefire"]]
-        pbar.update(1)
-
-        # Save the dataframe
-        pbar.set_description("Saving dataframe")
-        filtered_data.to_pickle(os.path.join(SAVE_DIR, f"filtered_data_{year}.pkl"))
-        pbar.update(1)
 
-        # Cleanup
-        del year_data
-        del joined_data
-        del filtered_data
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+
+def mean_observation_day_by_perimeter(joined_data):
+    """
+    returns the mean day-of-year of the observations joined to each perimeter,
+    indexed by uniquefire.
+    """
+    day_of_year = joined_data["date_time"].dt.day_of_year
+    grouped = day_of_year.groupby(joined_data["uniquefire"].values, sort=False, observed=True)
+    # integer sums keep this identical to the value_counts-weighted mean
+    return grouped.sum() / grouped.count()
+
+
+def closest_perimeter_mask(joined_data, average_observation_day_by_perimeter=None):
+    """
+    boolean mask over joined_data keeping, for every observation_id, only the
+    perimeter whose mean observation day is closest to the observation's day.
+    ties go to the perimeter joined first, as in the original per-row loop.
+    """
+    if average_observation_day_by_perimeter is None:
+        average_observation_day_by_perimeter = mean_observation_day_by_perimeter(joined_data)
+
+    uniquefire = joined_data["uniquefire"].to_numpy()
+    observation_ids = joined_data["observation_id"].to_numpy()
+    day_of_year = joined_data["date_time"].dt.day_of_year.to_numpy(dtype=np.float64)
+
+    perimeter_day = average_observation_day_by_perimeter.reindex(uniquefire).to_numpy(dtype=np.float64)
+    time_delta = np.abs(day_of_year - perimeter_day)
+
+    # sort rows by observation, then delta, then original position so the
+    # first row of every observation group is its closest perimeter
+    positions = np.arange(len(joined_data))
+    order = np.lexsort((positions, time_delta, observation_ids))
+    sorted_ids = observation_ids[order]
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = sorted_ids[1:] != sorted_ids[:-1]
+    best_rows = order[is_first]
+
+    best_perimeter = pd.Series(uniquefire[best_rows], index=observation_ids[best_rows])
+    return uniquefire == best_perimeter.reindex(observation_ids).to_numpy()
+
+
+def filter_to_closest_perimeter(joined_data):
+    """filters joined VIIRS/perimeter rows down to one perimeter per observation."""
+    return joined_data[closest_perimeter_mask(joined_data)]
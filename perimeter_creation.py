@@ -1,4 +1,3 @@
-import pickle
 import networkx as nx
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -8,7 +7,8 @@ from sklearn import tree, preprocessing
 import sklearn.ensemble as ske
 from sklearn.model_selection import train_test_split
 
-from perimeter_data_class import WildfirePerimeter
+from filtered_store import read_observations
+from perimeter_data_class import WildfirePerimeterMap
 
 import geopandas as gpd
 
@@ -16,44 +16,30 @@ from shapely.geometry import Point
 
 
 ## Constants and file paths
-filtered_data_file = 'data_filtered/filtered_data_2015.pkl'
-perimeter_data_file = 'data/perimeters/US_HIST_FIRE_PERIM_2015_DD83.shp'
+year = 2015
+perimeter_data_file = f'data/perimeters/US_HIST_FIRE_PERIM_{year}_DD83.shp'
 fid = '2015-AKTAD-000333'
 
-## Load data
-with open (filtered_data_file, 'rb') as file:
-    filtered_data = pickle.load(file)
-
-perimeters = gpd.read_file(perimeter_data_file,  engine='pyogrio')
-
 ## Functions
 def create_wildfire_perimeters(joined_gdf,perimeters):
     """
-    creates a dictionary of WildfirePerimeter objects for each unique FID.
+    creates a mapping of uniquefire -> WildfirePerimeter for each fire in
+    joined_gdf. the largest perimeter of every fire is picked once up front
+    and the objects themselves are built lazily on first access.
     """
-    wildfire_perimeters = {}
-
-    # group the joined dataframe by FID
-    grouped = joined_gdf.groupby('uniquefire')
-
-    for uniquefire, group in grouped:
-        # extracting relevant rows for FID
-        perimeter_row = perimeters[perimeters['uniquefire'] == uniquefire]
-        perimeter_row['area'] = perimeter_row.geometry.area
-        indices_of_largest = perimeter_row.groupby('uniquefire')['area'].idxmax()
-        perimeter_row = perimeter_row.loc[indices_of_largest]
-        perimeter_row = perimeter_row.drop(columns=['area'])
-        
-        # viirs_observations for this group is just the group without the perimeter details.
-        # drop unnecessary columns (columns that are also present in perimeter_row).
-        columns_to_drop = set(perimeter_row.columns) - set(['uniquefire']) 
-        viirs_observations = group.drop(columns=columns_to_drop)
-        print(uniquefire)
-        # create object
-        wildfire_perimeters[uniquefire] = WildfirePerimeter(perimeter_row, viirs_observations, None, None)
-        # wildfire_perimeters[uniquefire].save(f"perimeter_{uniquefire.replace('-','_')}.pkl")
-
-    return wildfire_perimeters
+    # largest perimeter per uniquefire, keeping the original row index
+    largest = perimeters.loc[perimeters.geometry.area.groupby(perimeters['uniquefire']).idxmax()]
+    largest = largest.rename_axis('__perimeter_index').reset_index().set_index('uniquefire', drop=False)
+    largest.index.name = None
+
+    # viirs_observations drop the columns that are also present in the perimeters
+    columns_to_drop = [column for column in perimeters.columns if column != 'uniquefire']
+
+    # row positions of every fire, in sorted uniquefire order
+    groups = joined_gdf.groupby('uniquefire', observed=True).indices
+    groups = {uniquefire: groups[uniquefire] for uniquefire in sorted(groups)}
+
+    return WildfirePerimeterMap(largest, groups, joined_gdf, columns_to_drop)
 
 def plot_single_perimeter_with_obvs(fid, perimeters_dict, nx=False):
     """
@@ -80,13 +66,19 @@ def plot_single_perimeter_with_obvs(fid, perimeters_dict, nx=False):
     plt.show()
 
     if nx:
-        pos = {(x, y): (y, x) for x, y in graph.nodes()} 
+        pos = {(row, col): (col, row) for row, col in graph.nodes()}
         nx.draw(graph, pos, with_labels=False, node_size=30)
-        plt.xlabel("Longitude")
-        plt.ylabel("Latitude")
+        plt.xlabel("Grid column")
+        plt.ylabel("Grid row")
         plt.title("Graph from VIIRS Observations")
         plt.show()
 
-perimeters_dict = create_wildfire_perimeters(filtered_data, perimeters)
+if __name__ == "__main__":
+    ## Load data
+    filtered_data = read_observations(years=year).drop(columns=['year'])
+
+    perimeters = gpd.read_file(perimeter_data_file,  engine='pyogrio')
+
+    perimeters_dict = create_wildfire_perimeters(filtered_data, perimeters)
 
-plot_single_perimeter_with_obvs(fid, perimeters_dict)
\ No newline at end of file
+    plot_single_perimeter_with_obvs(fid, perimeters_dict)
\ No newline at end of file
@@ -1,10 +1,12 @@
-import geopandas as gpd
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
 import pickle
+from collections.abc import Mapping
 from datetime import datetime
 import networkx as nx
-from shapely.geometry import Point
+
+from fire_animation import FireSpreadRenderer, animation_path
+from fire_graph import build_fire_graph
+from grid import DEFAULT_GRID
 
 class WildfirePerimeter:
     def __init__(self, perimeter, viirs_observations, climate_data, geographic_info):
@@ -27,60 +29,46 @@ class WildfirePerimeter:
 
         plt.show()
 
-    def animate_fire_spread(self, save=True):
-        """Create a gif that animates the fire spread based on datetime of each observation."""
-        days = self.viirs_observations['date_time'].dt.date.unique()
-
-        fig, ax = plt.subplots()
-        geometry = [Point(xy) for xy in zip(self.viirs_observations['LONGITUDE'], self.viirs_observations['LATITUDE'])]
-        gdf_obs = gpd.GeoDataFrame(self.viirs_observations, geometry=geometry)
-
-        self.perimeter.plot(ax=ax, color='lightgray', edgecolor='black')
-
-        def animate(day):
-            ax.clear()
-            self.perimeter.plot(ax=ax, color='lightgray', edgecolor='black')
-            day_points = gdf_obs[gdf_obs['date_time'].dt.date == day]
-            day_points.plot(ax=ax, markersize=5, color='red')
-            
-            ax.set_title(f"Observations on {day}")
-
-        ani = animation.FuncAnimation(fig, animate, frames=days, repeat=False, interval=1000)
-
+    def animate_fire_spread(self, save=True, path=None, history=True):
+        """
+        Create a gif (or mp4) that animates the fire spread based on datetime of each observation.
+        Returns None for a fire without observations, which has no days to animate.
+        """
+        if len(self.viirs_observations) == 0:
+            print(f"No observations to animate for {self.perimeter['uniquefire'].iloc[0]}")
+            return None
+        renderer = FireSpreadRenderer(self.perimeter, self.viirs_observations, history=history)
         if save:
-            ani.save(f'fire_spread_{self.perimeter.uniquefire}.gif', writer='pillow', fps=1)
+            renderer.save(path or animation_path(self.perimeter['uniquefire'].iloc[0], out_dir='.'))
+        return renderer
 
-        
     def _get_cell_coords(self, lat, lon):
-        # assume that 0.00335 degree of latitude is approximately 375 meters
-        # and for simplicity, take longitude conversion as the same
-        # we could convert these such that it aligns with earths curvature better
-        cell_lat = round(lat / 0.00335) * 0.00335
-        cell_lon = round(lon / 0.00335) * 0.00335
-        return cell_lat, cell_lon
+        # (row, col) of the 375 m cell on the shared equal-area grid
+        return DEFAULT_GRID.snap_point(lat, lon)
     
     def _features_lookup(self, observation_id):
         return {"feature": 0}
     
+    def build_graph(self):
+        """Build the cell graph of the observations in bulk (see fire_graph.FireGraph)."""
+        self.fire_graph = build_fire_graph(self.viirs_observations)
+        return self.fire_graph
+
     def initialize_graph(self):
-        G = nx.Graph()
-        
-        for _, row in self.viirs_observations.iterrows():
-            cell_lat, cell_lon = self._get_cell_coords(row['LATITUDE'], row['LONGITUDE'])
-            
-            if (cell_lat, cell_lon) not in G:
-                additional_data = self._features_lookup(row['observation_id'])
-                G.add_node((cell_lat, cell_lon), **row.to_dict(), **additional_data)
+        """networkx view of the spatial cell graph, nodes keyed by (row, col)."""
+        G = self.build_graph().to_networkx()
+        for cell, data in G.nodes(data=True):
+            data.update(self._features_lookup(data['observation_id']))
                 
         self.graph = G
         return self.graph
     
     def plot_graph(self):
-        pos = {(x, y): (y, x) for x, y in self.graph.nodes()}  # flip x and y for lat/lon to get lon/lat
+        pos = {(row, col): (col, row) for row, col in self.graph.nodes()}  # nodes are (row, col) grid cells
         nx.draw(self.graph, pos, with_labels=True, node_size=30)
         
-        plt.xlabel("Longitude")
-        plt.ylabel("Latitude")
+        plt.xlabel("Grid column")
+        plt.ylabel("Grid row")
         plt.title("Graph from VIIRS Observations")
         plt.show()
     
@@ -91,9 +79,45 @@ class WildfirePerimeter:
 
     @classmethod
     def load(cls, filename):
-        """Load the object from a pickle file."""
+        """Load the object from a pickle file. Collections of fires are better packed with fire_store."""
         with open(filename, 'rb') as file:
             return pickle.load(file)
 
 
+class WildfirePerimeterMap(Mapping):
+    """
+    read-only mapping of uniquefire -> WildfirePerimeter that builds each
+    object the first time it is accessed. observation rows are located per
+    fire up front, so nothing is copied for fires that are never used.
+    """
+
+    def __init__(self, largest_perimeters, observation_groups, viirs_observations, columns_to_drop):
+        # largest_perimeters: one perimeter row per uniquefire, indexed by uniquefire
+        self._perimeters = largest_perimeters
+        # observation_groups: {uniquefire: row positions in viirs_observations}
+        self._groups = observation_groups
+        self._observations = viirs_observations
+        self._columns_to_drop = columns_to_drop
+        self._built = {}
+
+    def build(self, uniquefire):
+        """a new WildfirePerimeter for a fire, not kept by the mapping. for one pass over many fires."""
+        positions = self._groups[uniquefire]
+        if uniquefire in self._perimeters.index:
+            perimeter = self._perimeters.loc[[uniquefire]].set_index('__perimeter_index')
+        else:
+            perimeter = self._perimeters.iloc[0:0].set_index('__perimeter_index')
+        perimeter.index.name = None
+        observations = self._observations.take(positions).drop(columns=self._columns_to_drop)
+        return WildfirePerimeter(perimeter, observations, None, None)
+
+    def __getitem__(self, uniquefire):
+        if uniquefire not in self._built:
+            self._built[uniquefire] = self.build(uniquefire)
+        return self._built[uniquefire]
+
+    def __iter__(self):
+        return iter(self._groups)
 
+    def __len__(self):
+        return len(self._groups)
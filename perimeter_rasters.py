@@ -0,0 +1,210 @@
+import argparse
+import os
+from multiprocessing.pool import ThreadPool
+from urllib.parse import quote
+
+import ee
+import numpy as np
+import pandas as pd
+
+from grid import DEFAULT_GRID
+from grid_coverage import cell_extents, cells_within
+
+PERIMETER_RASTERS_DIR = "./data_filtered/perimeter_rasters"
+
+# cells a side of one computePixels request. 512 x 512 stays below the
+# 262144 pixel limit that makes sampleRectangle fail on large fires
+MAX_TILE_CELLS = 512
+NODATA = -9999.0
+PADDING = 1
+WIND_BANDS = ['u_component_of_wind_10m', 'v_component_of_wind_10m']
+
+
+def wind_image(date_str, grid=DEFAULT_GRID):
+    """ERA5-Land 10 m wind on date_str, averaged onto the grid's cells."""
+    date = ee.Date(date_str)
+    era5_one_day = ee.ImageCollection('ECMWF/ERA5_LAND/HOURLY').filterDate(date.advance(-1, 'day'), date.advance(1, 'day')).first()
+    wind = era5_one_day.select(WIND_BANDS)
+    reduced = wind.reduceResolution(reducer=ee.Reducer.mean(), maxPixels=1024, bestEffort=True)
+    return reduced.reproject(crs=grid.crs, scale=grid.cell_width).toFloat().unmask(NODATA)
+
+
+def split_extent(row_min, row_max, col_min, col_max, max_cells=MAX_TILE_CELLS):
+    """sub-extents of at most max_cells x max_cells cells covering a block of cells, from the top left."""
+    return [(max(row_min, top - max_cells + 1), top, left, min(col_max, left + max_cells - 1))
+            for top in range(row_max, row_min - 1, -max_cells)
+            for left in range(col_min, col_max + 1, max_cells)]
+
+
+def fetch_pixels(image, bands, row_min, row_max, col_min, col_max, grid=DEFAULT_GRID, nodata=NODATA):
+    """
+    downloads `bands` of the image for a block of grid cells with one
+    computePixels call. returns a (bands, rows, cols) float32 array with row 0
+    at row_max and nodata as NaN.
+    """
+    request = {
+        'expression': image,
+        'fileFormat': 'NUMPY_NDARRAY',
+        'bandIds': list(bands),
+        'grid': {
+            'dimensions': {'width': int(col_max - col_min + 1), 'height': int(row_max - row_min + 1)},
+            'affineTransform': {
+                'scaleX': grid.cell_width, 'shearX': 0, 'translateX': float(col_min * grid.cell_width),
+                'shearY': 0, 'scaleY': -grid.cell_height, 'translateY': float((row_max + 1) * grid.cell_height),
+            },
+            'crsCode': grid.crs,
+        },
+    }
+    pixels = ee.data.computePixels(request)
+    values = np.stack([pixels[band].astype(np.float32) for band in bands])
+    values[values == nodata] = np.nan
+    return values
+
+
+def _fetch_tile(scheduler, image, bands, tile, grid, nodata):
+    arguments = (image, bands, *tile, grid, nodata)
+    return scheduler.call(fetch_pixels, *arguments) if scheduler is not None else fetch_pixels(*arguments)
+
+
+def _place(values, tile, tile_values, row_max, col_min):
+    tile_row_min, tile_row_max, tile_col_min, tile_col_max = tile
+    values[:, row_max - tile_row_max:row_max - tile_row_min + 1, tile_col_min - col_min:tile_col_max - col_min + 1] = tile_values
+
+
+def sample_extent(image, bands, row_min, row_max, col_min, col_max, grid=DEFAULT_GRID, nodata=NODATA,
+                  scheduler=None, threads=1, max_cells=MAX_TILE_CELLS):
+    """
+    fetch_pixels for a block of any size: blocks larger than max_cells a side
+    are fetched as sub-tiles, over `threads` threads, and stitched together.
+    """
+    values = np.full((len(bands), row_max - row_min + 1, col_max - col_min + 1), np.nan, dtype=np.float32)
+    tiles = split_extent(row_min, row_max, col_min, col_max, max_cells)
+
+    def fetch(tile):
+        return tile, _fetch_tile(scheduler, image, bands, tile, grid, nodata)
+
+    if threads > 1 and len(tiles) > 1:
+        with ThreadPool(min(threads, len(tiles))) as pool:
+            results = pool.map(fetch, tiles)
+    else:
+        results = map(fetch, tiles)
+    for tile, tile_values in results:
+        _place(values, tile, tile_values, row_max, col_min)
+    return values
+
+
+def raster_path(root, uniquefire):
+    return os.path.join(root, f"{quote(str(uniquefire), safe='-_.')}.npz")
+
+
+def write_perimeter_raster(path, values, row_max, col_min, bands, date=None, grid=DEFAULT_GRID):
+    """
+    one compressed .npz per fire: the (bands, rows, cols) values with NaN
+    outside the perimeter, the (row_max, col_min) grid cell of pixel [0, 0]
+    and enough metadata to read it without the image definition.
+    """
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(tmp_path, values=values, origin=np.array([row_max, col_min]), bands=np.array(bands),
+                        date=np.array(date or ''), crs=np.array(grid.crs),
+                        cell_size=np.array([grid.cell_width, grid.cell_height]))
+    os.replace(tmp_path, path)
+
+
+def load_perimeter_raster(path):
+    """(values, row_max, col_min, bands) of a raster written by write_perimeter_raster."""
+    with np.load(path) as data:
+        return data['values'], int(data['origin'][0]), int(data['origin'][1]), data['bands'].tolist()
+
+
+def perimeter_mask(geometry, row_max, col_min, shape, grid=DEFAULT_GRID):
+    """(rows, cols) boolean mask of the cells of a raster block that intersect the geometry."""
+    _, rows, cols = cells_within(geometry, grid)
+    mask = np.zeros(shape, dtype=bool)
+    i, j = row_max - rows, cols - col_min
+    inside = (i >= 0) & (i < shape[0]) & (j >= 0) & (j < shape[1])
+    mask[i[inside], j[inside]] = True
+    return mask
+
+
+def sample_perimeters(perimeters, image_for_date, bands, root=PERIMETER_RASTERS_DIR, date_column='perimeterd',
+                      scheduler=None, threads=8, grid=DEFAULT_GRID, nodata=NODATA, max_cells=MAX_TILE_CELLS):
+    """
+    samples image_for_date(fire's date) over every fire's perimeter and writes
+    one raster per fire to root. large fires are split into sub-tiles; the
+    tiles of all fires share one thread pool and a fire is stitched, masked
+    to its perimeter and written as soon as its last tile arrives. fires
+    already written are skipped, so reruns resume.
+    """
+    os.makedirs(root, exist_ok=True)
+    perimeters = perimeters.drop_duplicates('uniquefire')
+    dates = pd.to_datetime(perimeters[date_column], errors='coerce')
+    present = np.array([os.path.exists(raster_path(root, uniquefire)) for uniquefire in perimeters['uniquefire']], dtype=bool)
+    undated = dates.isna().to_numpy() & ~present
+    todo = perimeters[~present & ~undated]
+    dates = dates[~present & ~undated].dt.strftime('%Y-%m-%d').to_numpy()
+    print(f"Perimeter rasters: {present.sum()} of {len(perimeters)} fires already present, {undated.sum()} without a {date_column}")
+
+    row_min, row_max, col_min, col_max = cell_extents(todo.geometry, grid, PADDING)
+    remaining, tasks = {}, []
+    for k in range(len(todo)):
+        image = image_for_date(dates[k])
+        tiles = split_extent(row_min[k], row_max[k], col_min[k], col_max[k], max_cells)
+        remaining[k] = len(tiles)
+        tasks.extend((k, image, tile) for tile in tiles)
+
+    written, failed, reported, values = 0, set(), set(), {}
+
+    def fetch(task):
+        k, image, tile = task
+        if k in failed:
+            # another tile of the fire already failed, the fire won't be written
+            return k, tile, None
+        try:
+            return k, tile, _fetch_tile(scheduler, image, bands, tile, grid, nodata)
+        except Exception as e:
+            # marked here rather than by the consumer, so queued tiles of the fire are skipped right away
+            failed.add(k)
+            return k, tile, e
+
+    with ThreadPool(threads) as pool:
+        for k, tile, tile_values in pool.imap_unordered(fetch, tasks):
+            remaining[k] -= 1
+            uniquefire = todo['uniquefire'].iloc[k]
+            if isinstance(tile_values, Exception):
+                if k not in reported:
+                    print(f"Failed to sample {uniquefire}: {tile_values}")
+                reported.add(k)
+                values.pop(k, None)
+            elif k not in failed:
+                if k not in values:
+                    shape = (len(bands), row_max[k] - row_min[k] + 1, col_max[k] - col_min[k] + 1)
+                    values[k] = np.full(shape, np.nan, dtype=np.float32)
+                _place(values[k], tile, tile_values, row_max[k], col_min[k])
+
+            if remaining[k] == 0 and k in values:
+                fire_values = values.pop(k)
+                mask = perimeter_mask(todo.geometry.iloc[k], row_max[k], col_min[k], fire_values.shape[1:], grid)
+                fire_values[:, ~mask] = np.nan
+                write_perimeter_raster(raster_path(root, uniquefire), fire_values, row_max[k], col_min[k], bands, dates[k], grid)
+                written += 1
+
+    print(f"Perimeter rasters: wrote {written} of {len(todo)} fires ({len(tasks)} tiles)")
+    return written
+
+
+if __name__ == "__main__":
+    from ee_scheduler import RequestScheduler
+    from merge_and_filter import load_largest_perimeters, parse_years
+
+    parser = argparse.ArgumentParser(description="Sample ERA5-Land wind over every fire perimeter into per-fire rasters.")
+    parser.add_argument("--years", nargs="+", default=["2015"])
+    parser.add_argument("--root", default=os.path.join(PERIMETER_RASTERS_DIR, "wind"))
+    parser.add_argument("--date-column", default="perimeterd", help="perimeter column holding the date to sample")
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    ee.Initialize()
+    scheduler = RequestScheduler()
+    for year in parse_years(args.years):
+        sample_perimeters(load_largest_perimeters(year), wind_image, WIND_BANDS, os.path.join(args.root, str(year)),
+                          args.date_column, scheduler=scheduler, threads=args.threads)
@@ -0,0 +1,103 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from filtered_store import OBSERVATIONS_DIR, read_observations
+
+REVISIT_DIR = "./data_filtered/revisit"
+PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def load_overpasses(years=None, root=OBSERVATIONS_DIR):
+    """the (year, uniquefire, date_time) columns of the filtered observations, nothing else."""
+    observations = read_observations(root, columns=['year', 'uniquefire', 'date_time'], years=years)
+    return observations.reset_index(drop=True)
+
+
+def overpass_gaps(observations):
+    """
+    time between consecutive overpasses of every fire, for all fires at once.
+    observations sharing a fire and date_time are one overpass. returns one
+    row per gap with the year, uniquefire, the overpass that closes it and the
+    gap as a timedelta and in hours.
+    """
+    years = observations['year'].to_numpy() if 'year' in observations.columns else np.zeros(len(observations), dtype=np.int64)
+    fire_codes, fires = pd.factorize(observations['uniquefire'])
+    times = observations['date_time'].to_numpy().astype('datetime64[ns]').view(np.int64)
+
+    order = np.lexsort((times, fire_codes, years))
+    fire_codes, years, times = fire_codes[order], years[order], times[order]
+
+    # one overpass per (fire, date_time)
+    same_fire = (fire_codes[1:] == fire_codes[:-1]) & (years[1:] == years[:-1])
+    new_overpass = np.concatenate([[True], ~same_fire | (times[1:] != times[:-1])])
+    fire_codes, years, times = fire_codes[new_overpass], years[new_overpass], times[new_overpass]
+
+    closes_gap = np.flatnonzero((fire_codes[1:] == fire_codes[:-1]) & (years[1:] == years[:-1])) + 1
+    gaps = (times[closes_gap] - times[closes_gap - 1]).astype('timedelta64[ns]')
+    return pd.DataFrame({
+        'year': years[closes_gap],
+        'uniquefire': np.asarray(fires)[fire_codes[closes_gap]],
+        'date_time': times[closes_gap].astype('datetime64[ns]'),
+        'gap': gaps,
+        'gap_hours': gaps.astype(np.int64) / 3.6e12,
+    })
+
+
+def _summarize(gaps, keys):
+    grouped = gaps.groupby(keys, sort=True, observed=True)['gap_hours']
+    summary = grouped.quantile([p / 100 for p in PERCENTILES]).unstack()
+    summary.columns = [f'p{p}_hours' for p in PERCENTILES]
+    summary.insert(0, 'mean_hours', grouped.mean())
+    summary.insert(0, 'gap_count', grouped.size())
+    summary['max_hours'] = grouped.max()
+    return summary
+
+
+def fire_revisit_summary(observations, gaps=None):
+    """per-fire table: overpass count, first/last overpass and gap percentiles and max in hours."""
+    gaps = overpass_gaps(observations) if gaps is None else gaps
+    keys = ['year', 'uniquefire'] if 'year' in observations.columns else ['uniquefire']
+    overpasses = observations.drop_duplicates(keys + ['date_time']).groupby(keys, sort=True, observed=True)['date_time']
+    summary = pd.DataFrame({
+        'overpass_count': overpasses.size(),
+        'first_overpass': overpasses.min(),
+        'last_overpass': overpasses.max(),
+    })
+    return summary.join(_summarize(gaps, keys), how='left').reset_index()
+
+
+def year_revisit_summary(observations, gaps=None):
+    """per-year table: fires, overpasses and the distribution of gaps across all fires."""
+    gaps = overpass_gaps(observations) if gaps is None else gaps
+    if 'year' not in observations.columns:
+        observations = observations.assign(year=0)
+        gaps = gaps.assign(year=0)
+    overpasses = observations.drop_duplicates(['year', 'uniquefire', 'date_time']).groupby('year', sort=True)
+    summary = pd.DataFrame({
+        'fire_count': overpasses['uniquefire'].nunique(),
+        'overpass_count': overpasses.size(),
+    })
+    return summary.join(_summarize(gaps, ['year']), how='left').reset_index()
+
+
+if __name__ == "__main__":
+    from merge_and_filter import parse_years
+
+    parser = argparse.ArgumentParser(description="Revisit interval statistics of the filtered VIIRS observations.")
+    parser.add_argument("--years", nargs="+", default=None, help="years or ranges, all years in the store by default")
+    parser.add_argument("--root", default=OBSERVATIONS_DIR)
+    parser.add_argument("--out-dir", default=REVISIT_DIR)
+    args = parser.parse_args()
+
+    observations = load_overpasses(parse_years(args.years) if args.years else None, args.root)
+    gaps = overpass_gaps(observations)
+    fires = fire_revisit_summary(observations, gaps)
+    years = year_revisit_summary(observations, gaps)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    fires.to_parquet(os.path.join(args.out_dir, "fires.parquet"), index=False)
+    years.to_parquet(os.path.join(args.out_dir, "years.parquet"), index=False)
+    print(years.to_string(index=False))
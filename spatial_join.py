@@ -0,0 +1,38 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import pandas as pd
+
+# left rows sent to a worker at a time
+CHUNK_SIZE = 250_000
+
+# state of the worker processes, set once by _init_worker
+_right = None
+
+
+def _init_worker(right):
+    global _right
+    _right = right
+
+
+def _join_chunk(left):
+    # the spatial index of _right is built by the first chunk and reused by the rest
+    return gpd.sjoin(left, _right, how="inner", predicate="within")
+
+
+def sjoin_within(left, right, processes=1, chunk_size=CHUNK_SIZE):
+    """
+    gpd.sjoin(left, right, how="inner", predicate="within"), with the left
+    rows cut into chunks that are joined on a pool of processes. right is sent
+    to every worker once. chunks keep the left order, so the result is the
+    frame a single gpd.sjoin returns.
+    """
+    processes = processes or os.cpu_count()
+    if processes == 1 or len(left) <= chunk_size:
+        return gpd.sjoin(left, right, how="inner", predicate="within")
+
+    chunks = (left.iloc[start:start + chunk_size] for start in range(0, len(left), chunk_size))
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(right,)) as pool:
+        joined = list(pool.map(_join_chunk, chunks))
+    return pd.concat(joined)
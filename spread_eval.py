@@ -0,0 +1,218 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+from fire_tensors import fire_layout
+from grid import DEFAULT_GRID
+
+OBSERVED_DIR = "./data_filtered/observed_arrival"
+NEVER = -1
+
+RESULT_COLUMNS = ['uniquefire', 'run', 'day', 'observed_cells', 'simulated_cells', 'intersection', 'union',
+                  'iou', 'sorensen', 'arrival_mae', 'arrival_bias', 'arrival_cells']
+
+
+def observed_arrival(observations, perimeter=None, step_hours=24, grid=DEFAULT_GRID):
+    """
+    the step (day by default) each cell of a fire's tensor extent was first
+    detected, NEVER where it was not. returns (arrival, row_max, col_min,
+    start) in the frame fire_tensors uses: row 0 at row_max.
+    """
+    layout = fire_layout(observations, perimeter, step_hours, grid)
+    arrival = np.full((layout['height'], layout['width']), np.iinfo(np.int32).max, dtype=np.int32)
+    np.minimum.at(arrival, (layout['i'], layout['j']), layout['t'].astype(np.int32))
+    arrival[arrival == np.iinfo(np.int32).max] = NEVER
+    return arrival, layout['row_max'], layout['col_min'], layout['start']
+
+
+def observed_path(root, uniquefire):
+    return os.path.join(root, f"{quote(str(uniquefire), safe='-_.')}.npz")
+
+
+def write_observed(path, arrival, row_max, col_min, start, step_hours=24):
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(tmp_path, arrival=arrival, origin=np.array([row_max, col_min]),
+                        start=np.array(str(np.datetime64(start, 's'))), step_hours=np.array(step_hours))
+    os.replace(tmp_path, path)
+
+
+def load_observed(path):
+    """(arrival, row_max, col_min, start) of a raster written by write_observed."""
+    with np.load(path) as data:
+        return data['arrival'], int(data['origin'][0]), int(data['origin'][1]), np.datetime64(str(data['start']))
+
+
+def cache_observed(fires, root=OBSERVED_DIR, step_hours=24, grid=DEFAULT_GRID, overwrite=False):
+    """
+    rasterizes the detections of every fire of a mapping of uniquefire ->
+    WildfirePerimeter (or a FireStore) once into an arrival raster under
+    root. fires already cached are skipped unless overwrite is set.
+    returns {uniquefire: path}.
+    """
+    os.makedirs(root, exist_ok=True)
+    paths = {}
+    for uniquefire in fires:
+        path = observed_path(root, uniquefire)
+        paths[uniquefire] = path
+        if os.path.exists(path) and not overwrite:
+            continue
+        if hasattr(fires, 'observations'):
+            observations, perimeter = fires.observations(uniquefire), fires.perimeter(uniquefire)
+        else:
+            observations, perimeter = fires[uniquefire].viirs_observations, fires[uniquefire].perimeter
+        if len(observations) == 0:
+            del paths[uniquefire]
+            continue
+        write_observed(path, *observed_arrival(observations, perimeter, step_hours, grid), step_hours)
+    return paths
+
+
+def observed_from_tensors(store, uniquefire):
+    """observed arrival raster of a fire from the occupancy channel of a FireTensorStore."""
+    occupancy = store[uniquefire][:, store.channels.index('occupancy')] > 0
+    arrival = np.where(occupancy.any(axis=0), occupancy.argmax(axis=0), NEVER).astype(np.int32)
+    row = store.index[store.index['uniquefire'] == uniquefire].iloc[0]
+    return arrival, int(row['row_max']), int(row['col_min']), row['start'].to_datetime64()
+
+
+def score_runs(observed, simulated, days=None):
+    """
+    metrics of R simulated runs against an observed arrival raster, for every
+    day 0 .. days - 1. simulated is (R, H, W) arrival in days on the observed
+    raster's cells (NaN or negative where a cell never burned); a cell counts
+    as burned on day d once floor(arrival) <= d, the day its observed arrival
+    would be binned to. all runs and days are scored in one pass: per-cell
+    max/min arrival days are histogrammed and summed, so no (R, days, H, W)
+    masks are built. returns a dict of (R, days) arrays.
+    """
+    observed = np.asarray(observed).ravel()
+    simulated = np.asarray(simulated, dtype=np.float64).reshape(len(simulated), -1)
+    if days is None:
+        days = int(observed.max()) + 1 if (observed != NEVER).any() else 1
+    runs = len(simulated)
+
+    # arrival days as histogram bins; `days` collects cells that burn later or never
+    observed_bin = np.where(observed == NEVER, days, np.minimum(observed, days)).astype(np.int64)
+    never = np.isnan(simulated) | (simulated < 0)
+    simulated_bin = np.where(never, days, np.minimum(np.floor(np.nan_to_num(simulated, nan=0.0)), days)).astype(np.int64)
+    offsets = (np.arange(runs) * (days + 1))[:, None]
+
+    def cumulative(bins, weights=None):
+        counts = np.bincount((bins + offsets).ravel(), weights=None if weights is None else weights.ravel(),
+                             minlength=runs * (days + 1))
+        return np.cumsum(counts.reshape(runs, days + 1), axis=1)[:, :days]
+
+    observed_cells = np.broadcast_to(np.cumsum(np.bincount(observed_bin, minlength=days + 1))[:days], (runs, days))
+    simulated_cells = cumulative(simulated_bin)
+    intersection = cumulative(np.maximum(observed_bin, simulated_bin))
+    union = cumulative(np.minimum(observed_bin, simulated_bin))
+
+    # arrival error over the cells both burned by day d, the later of the two arrivals decides the day
+    both = (observed != NEVER) & ~never
+    error = np.where(both, np.nan_to_num(simulated) - observed, 0.0)
+    both_bin = np.where(both, np.maximum(observed_bin, simulated_bin), days)
+    arrival_cells = cumulative(both_bin)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'observed_cells': observed_cells, 'simulated_cells': simulated_cells,
+            'intersection': intersection, 'union': union,
+            'iou': intersection / union,
+            'sorensen': 2 * intersection / (observed_cells + simulated_cells),
+            'arrival_mae': cumulative(both_bin, np.abs(error)) / arrival_cells,
+            'arrival_bias': cumulative(both_bin, error) / arrival_cells,
+            'arrival_cells': arrival_cells,
+        }
+
+
+def steps_to_days(arrival, minutes_per_step):
+    """spread_sim arrival steps as float days, NaN for cells that never burned."""
+    arrival = np.asarray(arrival)
+    return np.where(arrival < 0, np.nan, arrival * minutes_per_step / 1440.0)
+
+
+def results_table(uniquefire, scores, run_ids=None):
+    """tidy (uniquefire, run, day) rows of score_runs output."""
+    runs, days = scores['iou'].shape
+    run_ids = np.arange(runs) if run_ids is None else np.asarray(run_ids)
+    table = pd.DataFrame({'uniquefire': uniquefire, 'run': np.repeat(run_ids, days), 'day': np.tile(np.arange(days), runs)})
+    for column in RESULT_COLUMNS[3:]:
+        table[column] = scores[column].ravel()
+    return table
+
+
+def evaluate_fire(uniquefire, observed, simulated, days=None, run_ids=None):
+    """
+    scores the runs of one fire. observed is a path written by write_observed
+    or an arrival raster; simulated an (R, H, W) array or a .npy path to one.
+    """
+    if isinstance(observed, str):
+        observed = load_observed(observed)[0]
+    if isinstance(simulated, str):
+        simulated = np.load(simulated, mmap_mode='r')
+    return results_table(uniquefire, score_runs(observed, simulated, days), run_ids)
+
+
+def _evaluate_job(arguments):
+    return evaluate_fire(*arguments)
+
+
+def evaluate_fires(observed, simulations, days=None, processes=None, run_ids=None):
+    """
+    evaluate_fire for every fire of simulations (uniquefire -> runs or .npy
+    path) against observed (uniquefire -> path or raster, e.g. the output of
+    cache_observed), spread over worker processes. passing paths keeps the
+    rasters out of the pickled jobs. returns one tidy table for all fires.
+    """
+    jobs = [(uniquefire, observed[uniquefire], runs, days, run_ids) for uniquefire, runs in simulations.items()]
+    processes = processes or os.cpu_count()
+    if processes == 1 or len(jobs) <= 1:
+        tables = list(map(_evaluate_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            tables = list(pool.map(_evaluate_job, jobs))
+    if not tables:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    return pd.concat(tables, ignore_index=True)
+
+
+def summarize(results):
+    """one row per (uniquefire, run): mean IoU and Sørensen over the days, and the last day's scores."""
+    grouped = results.sort_values('day').groupby(['uniquefire', 'run'])
+    summary = grouped.agg(mean_iou=('iou', 'mean'), mean_sorensen=('sorensen', 'mean'),
+                          final_iou=('iou', 'last'), final_sorensen=('sorensen', 'last'),
+                          arrival_mae=('arrival_mae', 'last'), arrival_bias=('arrival_bias', 'last'))
+    return summary.reset_index()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from fire_store import FIRES_DIR, FireStore, fire_store_dir
+    from merge_and_filter import parse_years
+
+    parser = argparse.ArgumentParser(description="Cache observed arrival rasters and score simulated runs against them.")
+    parser.add_argument("--years", nargs="+", default=["2015"])
+    parser.add_argument("--fires-root", default=FIRES_DIR)
+    parser.add_argument("--root", default=OBSERVED_DIR)
+    parser.add_argument("--simulations", default=None,
+                        help="directory of <uniquefire>.npy (runs, H, W) arrival days to score, named like the cache")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="evaluation.parquet")
+    args = parser.parse_args()
+
+    tables = []
+    for year in parse_years(args.years):
+        paths = cache_observed(FireStore(fire_store_dir(year, args.fires_root)), os.path.join(args.root, f"year={year}"))
+        print(f"{year}: {len(paths)} observed arrival rasters in {args.root}")
+        if args.simulations:
+            simulations = {uniquefire: os.path.join(args.simulations, os.path.basename(path)[:-len(".npz")] + ".npy")
+                           for uniquefire, path in paths.items()}
+            simulations = {uniquefire: path for uniquefire, path in simulations.items() if os.path.exists(path)}
+            tables.append(evaluate_fires(paths, simulations, processes=args.workers))
+    if tables:
+        results = pd.concat(tables, ignore_index=True)
+        results.to_parquet(args.out, index=False)
+        print(f"wrote {len(results)} rows for {results['uniquefire'].nunique()} fires to {args.out}")
@@ -0,0 +1,297 @@
+import ast
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import yaml
+
+CONFIG_PATH = "configs/operational_config.yml"
+
+# spread model of Alexandridis et al. (2008): a burning cell ignites each of its
+# 8 neighbours with P_H scaled by fuel, burn probability, moisture, wind and slope
+P_H = 0.58
+WIND_C1 = 0.045
+WIND_C2 = 0.131
+SLOPE_A = 0.078
+# moisture content at which fuel no longer burns
+MOISTURE_OF_EXTINCTION = 0.3
+MPH_TO_MS = 0.44704
+# noise features span this many cells when a perlin section has no scale
+NOISE_SCALE = 100
+
+# (d_row, d_col) from a burning cell to the neighbour it can ignite
+NEIGHBOURS = np.array([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
+UNBURNED = -1
+
+
+def load_config(path=CONFIG_PATH):
+    with open(path) as file:
+        return yaml.safe_load(file)
+
+
+def parse_minutes(value):
+    """minutes of a simfire duration such as '15h', '90m', '2d' or a bare number of minutes."""
+    match = re.fullmatch(r"\s*([\d.]+)\s*([mhd]?)\s*", str(value))
+    if match is None:
+        raise ValueError(f"Unrecognized duration: {value!r}")
+    return float(match.group(1)) * {'': 1, 'm': 1, 'h': 60, 'd': 1440}[match.group(2)]
+
+
+def perlin_noise(shape, octaves=1, persistence=0.5, lacunarity=2.0, seed=0, scale=NOISE_SCALE):
+    """fractal 2D gradient noise of the given shape, roughly in [-1, 1]."""
+    rng = np.random.default_rng(seed)
+    rows, cols = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), indexing='ij')
+    noise = np.zeros(shape, dtype=np.float64)
+    frequency, amplitude, total = 1.0 / scale, 1.0, 0.0
+    for _ in range(int(octaves)):
+        y, x = rows * frequency, cols * frequency
+        y0, x0 = np.floor(y).astype(np.int64), np.floor(x).astype(np.int64)
+        fy, fx = y - y0, x - x0
+        angles = rng.uniform(0, 2 * np.pi, (y0.max() + 2, x0.max() + 2))
+        gradients = np.stack([np.cos(angles), np.sin(angles)], axis=-1)
+
+        def corner(dy, dx):
+            g = gradients[y0 + dy, x0 + dx]
+            return g[..., 0] * (fy - dy) + g[..., 1] * (fx - dx)
+
+        uy, ux = fy ** 3 * (fy * (6 * fy - 15) + 10), fx ** 3 * (fx * (6 * fx - 15) + 10)
+        top = corner(0, 0) + ux * (corner(0, 1) - corner(0, 0))
+        bottom = corner(1, 0) + ux * (corner(1, 1) - corner(1, 0))
+        noise += amplitude * (top + uy * (bottom - top))
+        total += amplitude
+        amplitude *= persistence
+        frequency *= lacunarity
+    return noise / total * np.sqrt(2)
+
+
+def functional_layer(section, shape):
+    """a terrain layer from a `functional` config section: perlin noise or a gaussian bump."""
+    function = section['function']
+    params = section.get(function) or {}
+    if function == 'perlin':
+        noise = perlin_noise(shape, params.get('octaves', 1), params.get('persistence', 0.5), params.get('lacunarity', 2.0),
+                             params.get('seed', 0), params.get('scale', NOISE_SCALE))
+        lo, hi = noise.min(), noise.max()
+        unit = (noise - lo) / (hi - lo) if hi > lo else np.zeros(shape)
+        return params.get('range_min', 0.0) + unit * (params.get('range_max', 1.0) - params.get('range_min', 0.0))
+    if function == 'gaussian':
+        rows, cols = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), indexing='ij')
+        return params['amplitude'] * np.exp(-((cols - params['mu_x']) ** 2 / (2 * params['sigma_x'] ** 2)
+                                             + (rows - params['mu_y']) ** 2 / (2 * params['sigma_y'] ** 2)))
+    if function == 'flat':
+        return np.zeros(shape)
+    raise ValueError(f"Unsupported terrain function: {function}")
+
+
+def fuel_layer(section, shape):
+    """
+    relative fuel load in [0, 1]. 'chaparral' draws a seeded load per cell like
+    simfire's chaparral fuel; 'uniform' is a constant load.
+    """
+    function = section['function']
+    params = section.get(function) or {}
+    if function == 'chaparral':
+        return np.random.default_rng(params.get('seed')).uniform(0.5, 1.0, shape)
+    if function == 'uniform':
+        return np.full(shape, float(params.get('load', 1.0)))
+    raise ValueError(f"Unsupported fuel function: {function}")
+
+
+def wind_layers(section, shape):
+    """(speed in mph, direction in degrees clockwise from north the wind blows towards) arrays."""
+    function = section['function']
+    params = section[function]
+    if function == 'simple':
+        return np.full(shape, float(params['speed'])), np.full(shape, float(params['direction']))
+    if function == 'perlin':
+        return functional_layer({'function': 'perlin', 'perlin': params['speed']}, shape), \
+            functional_layer({'function': 'perlin', 'perlin': params['direction']}, shape)
+    raise ValueError(f"Unsupported wind function: {function} (only simple and perlin run in spread_sim)")
+
+
+def ignition_positions(section, shape, members, seed=None):
+    """(members, 2) array of (row, col) ignition cells from fire_initial_position."""
+    if section['type'] == 'static':
+        position = section['static']['position']
+        x, y = ast.literal_eval(position) if isinstance(position, str) else position
+        return np.tile([int(y), int(x)], (members, 1))
+    if section['type'] == 'random':
+        rng = np.random.default_rng(section['random'].get('seed') if seed is None else seed)
+        return np.column_stack([rng.integers(0, shape[0], members), rng.integers(0, shape[1], members)])
+    raise ValueError(f"Unsupported fire_initial_position type: {section['type']}")
+
+
+def build_layers(config):
+    """
+    the arrays a run needs, from the terrain, fuel, wind, environment and fire
+    sections of a simfire config. 'operational' terrain and fuel (LANDFIRE
+    downloads) fall back to their functional settings.
+    """
+    shape = tuple(config['area']['screen_size'])
+    terrain = config['terrain']
+    burn_probability = functional_layer(terrain['fuel']['burn_probability']['functional'], shape)
+    wind_speed, wind_direction = wind_layers(config['wind'], shape)
+    return {
+        'elevation': functional_layer(terrain['topography']['functional'], shape),
+        'fuel': fuel_layer(terrain['fuel']['functional'], shape),
+        # rescaled so the highest configured value burns with certainty
+        'burn_probability': burn_probability / max(burn_probability.max(), 1e-12),
+        'wind_speed': wind_speed,
+        'wind_direction': wind_direction,
+        'moisture': float(config['environment']['moisture']),
+        'pixel_scale': float(config['area']['pixel_scale']),
+        'duration': int(config['fire']['max_fire_duration']),
+        'steps': int(parse_minutes(config['simulation']['runtime']) / float(config['simulation']['update_rate'])),
+    }
+
+
+def spread_probabilities(layers, wind_speed_scale=None, wind_direction_offset=None):
+    """
+    (members, 8, H, W) float32 probability that a burning neighbour in each of
+    the NEIGHBOURS directions ignites a cell. members differ by a factor on
+    the wind speed and an offset (degrees) on its direction.
+    """
+    wind_speed_scale = np.atleast_1d(1.0 if wind_speed_scale is None else wind_speed_scale)[:, None, None, None]
+    wind_direction_offset = np.atleast_1d(0.0 if wind_direction_offset is None else wind_direction_offset)[:, None, None, None]
+    elevation = layers['elevation']
+    shape = elevation.shape
+
+    base = P_H * layers['fuel'] * layers['burn_probability'] * max(0.0, 1.0 - layers['moisture'] / MOISTURE_OF_EXTINCTION)
+    d_rows, d_cols = NEIGHBOURS[:, 0], NEIGHBOURS[:, 1]
+    distance = np.hypot(d_rows, d_cols)[:, None, None] * layers['pixel_scale']
+    # bearing of the spread from the burning cell to the target, clockwise from north (row 0 is north)
+    bearing = np.degrees(np.arctan2(d_cols, -d_rows))[:, None, None]
+
+    # the source of each target cell, edge cells reuse their own elevation
+    padded = np.pad(elevation, 1, mode='edge')
+    source = np.stack([padded[1 - dr:1 - dr + shape[0], 1 - dc:1 - dc + shape[1]] for dr, dc in NEIGHBOURS])
+    slope = np.degrees(np.arctan((elevation - source) / distance))
+
+    speed = layers['wind_speed'] * MPH_TO_MS * wind_speed_scale
+    theta = np.radians(bearing - layers['wind_direction'] - wind_direction_offset)
+    wind = np.exp(WIND_C1 * speed) * np.exp(WIND_C2 * speed * (np.cos(theta) - 1))
+
+    probability = base * np.exp(SLOPE_A * slope) * wind
+    return np.clip(probability, 0, 1).astype(np.float32)
+
+
+def simulate(probabilities, ignitions, steps, duration, seed=None):
+    """
+    advances a batch of members together. probabilities is (B, 8, H, W) from
+    spread_probabilities, or (8, H, W) or (1, 8, H, W) shared by all members;
+    ignitions is (B, 2). only the burning cells are visited: the cells each
+    step ignited are kept as flat (member, row, col) indices for `duration`
+    steps, and every burning cell tries to ignite each unburned neighbour on
+    its own, which ignites a cell with 1 - prod(1 - p) over its burning
+    neighbours. all members advance in the same array operations, and the run
+    stops once none is burning.
+    returns (arrival, steps run, cell updates): the (B, H, W) int32 step each
+    cell caught fire, UNBURNED for cells that never did, and the number of
+    (burning cell, unburned neighbour) ignition draws made.
+    """
+    rng = np.random.default_rng(seed)
+    members = len(ignitions)
+    height, width = probabilities.shape[-2:]
+    cells = height * width
+    # a shared (8, H, W) or (1, 8, H, W) table is read by every member
+    member_stride = 0 if probabilities.ndim == 3 or probabilities.shape[0] == 1 else len(NEIGHBOURS) * cells
+    probabilities = np.ascontiguousarray(probabilities).reshape(-1)
+    arrival = np.full((members, height, width), UNBURNED, dtype=np.int32)
+    flat_arrival = arrival.reshape(-1)
+    offsets = NEIGHBOURS[:, 0] * width + NEIGHBOURS[:, 1]
+
+    ignited = np.arange(members, dtype=np.int64) * cells + ignitions[:, 0] * width + ignitions[:, 1]
+    flat_arrival[ignited] = 0
+    # the cells ignited by each of the last `duration` steps are the burning ones
+    fronts = deque([ignited], maxlen=duration)
+
+    step, updates = 0, 0
+    for step in range(1, steps + 1):
+        burning = np.concatenate(fronts) if fronts else np.zeros(0, dtype=np.int64)
+        if len(burning) == 0:
+            step -= 1
+            break
+        member, cell = np.divmod(burning, cells)
+        row, col = np.divmod(cell, width)
+
+        # every (burning cell, direction) pair whose target is on the grid and unburned
+        target_row = row[:, None] + NEIGHBOURS[:, 0]
+        target_col = col[:, None] + NEIGHBOURS[:, 1]
+        pair, direction = np.nonzero((target_row >= 0) & (target_row < height) & (target_col >= 0) & (target_col < width))
+        target_cell = cell[pair] + offsets[direction]
+        target = member[pair] * cells + target_cell
+        unburned = flat_arrival[target] == UNBURNED
+        pair, direction, target_cell, target = pair[unburned], direction[unburned], target_cell[unburned], target[unburned]
+
+        p = probabilities[member[pair] * member_stride + direction * cells + target_cell]
+        ignited = np.unique(target[rng.random(len(target), dtype=np.float32) < p])
+        flat_arrival[ignited] = step
+        fronts.append(ignited)
+        updates += len(target)
+    return arrival, step, updates
+
+
+def _run_batch(arguments):
+    layers, ignitions, wind_speed_scale, wind_direction_offset, steps, seed = arguments
+    probabilities = spread_probabilities(layers, wind_speed_scale, wind_direction_offset)
+    return simulate(probabilities, ignitions, steps, layers['duration'], seed)
+
+
+def run_ensemble(config, members, batch_size=16, processes=1, seed=0, wind_speed_spread=0.1, wind_direction_spread=10.0,
+                 steps=None):
+    """
+    runs `members` headless simulations of a config, batch_size members at a
+    time, over `processes` worker processes. members share the terrain and
+    fuel and differ by their random draws and a perturbed wind (lognormal
+    speed factor with sigma wind_speed_spread, normal direction offset with
+    sigma wind_direction_spread degrees). returns (arrival, steps run, cell
+    updates) with arrival the (members, H, W) int32 ignition steps and cell
+    updates the ignition draws of every batch (see simulate).
+    """
+    layers = build_layers(config)
+    steps = steps or layers['steps']
+    rng = np.random.default_rng(seed)
+    ignitions = ignition_positions(config['fire']['fire_initial_position'], layers['elevation'].shape, members)
+    speed_scale = rng.lognormal(0.0, wind_speed_spread, members)
+    direction_offset = rng.normal(0.0, wind_direction_spread, members)
+    batch_seeds = np.random.SeedSequence(seed).spawn((members + batch_size - 1) // batch_size)
+
+    batches = [(layers, ignitions[start:start + batch_size], speed_scale[start:start + batch_size],
+                direction_offset[start:start + batch_size], steps, batch_seed)
+               for start, batch_seed in zip(range(0, members, batch_size), batch_seeds)]
+    processes = processes or os.cpu_count()
+    if processes == 1 or len(batches) == 1:
+        results = list(map(_run_batch, batches))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(_run_batch, batches))
+    return (np.concatenate([arrival for arrival, _, _ in results]), max(steps_run for _, steps_run, _ in results),
+            sum(updates for _, _, updates in results))
+
+
+def burned_area_curve(arrival, steps):
+    """(members, steps + 1) count of cells burning or burned after each step."""
+    counts = np.stack([np.bincount(member[member != UNBURNED], minlength=steps + 1)[:steps + 1] for member in arrival])
+    return np.cumsum(counts, axis=1)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run an ensemble of headless fire spread simulations from a simfire config.")
+    parser.add_argument("--config", default=CONFIG_PATH)
+    parser.add_argument("--members", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="write the (members, H, W) arrival steps to this .npy file")
+    args = parser.parse_args()
+
+    arrival, steps_run, _ = run_ensemble(load_config(args.config), args.members, args.batch_size, args.workers, args.seed)
+    burned = (arrival != UNBURNED).sum(axis=(1, 2))
+    print(f"{args.members} members, {steps_run} steps: burned cells mean {burned.mean():.0f}, "
+          f"min {burned.min()}, max {burned.max()}")
+    if args.out:
+        np.save(args.out, arrival)
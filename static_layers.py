@@ -0,0 +1,178 @@
+import argparse
+import os
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from urllib.parse import quote
+
+import ee
+import numpy as np
+import pandas as pd
+
+from grid import DEFAULT_GRID
+from grid_coverage import cell_extents
+from perimeter_rasters import sample_extent
+
+# tiles written before the population epoch was chosen by year hold GPW 2010
+# for 2015, so the directory is versioned and they are not read back
+STATIC_LAYERS_DIR = "./data_filtered/static_layers_grid5070_v2"
+
+# layers fetched once per fire footprint instead of once per observation
+STATIC_LAYER_COLUMNS = ['elevation', 'landcover', 'road_density', 'population_density']
+NODATA = -9999.0
+# road pixels are painted at this resolution before being summed per cell
+ROAD_SCALE = 30
+
+
+def road_density_image():
+    """
+    length of TIGER 2016 roads inside each cell in meters per km2, estimated by
+    painting the roads at ROAD_SCALE and summing the painted pixels per cell.
+    this is the road_density of every extraction path: the tiles read it on the
+    grid, and the Earth Engine paths sample it with grid_sampling.
+    """
+    roads = ee.FeatureCollection('TIGER/2016/Roads')
+    road_length = (ee.Image().byte().paint(roads, 1).unmask(0)
+                   .multiply(ROAD_SCALE)
+                   .reproject(crs='EPSG:4326', scale=ROAD_SCALE)
+                   .reduceResolution(reducer=ee.Reducer.sum(), maxPixels=1024))
+    return road_length.divide(ee.Image.pixelArea().multiply(1e-6)).rename('road_density').toFloat()
+
+
+def grid_sampling(grid=DEFAULT_GRID):
+    """reduceRegion(s) arguments whose pixels are the grid's cells, so a point reads the value of its cell."""
+    return {'crs': grid.crs, 'crsTransform': [grid.cell_width, 0, 0, 0, grid.cell_height, 0]}
+
+
+def static_layer_image(year):
+    """
+    one multi-band image of the static layers of a year. population density is
+    the latest GPW epoch up to the year, the image retrieve_external_features
+    samples for any date of the year after 1 January. road density is
+    road_density_image.
+    """
+    elevation = ee.Image('CGIAR/SRTM90_V4').select('elevation')
+    landcover = ee.Image("USGS/NLCD_RELEASES/2020_REL/NALCMS").select('landcover')
+    population = ee.ImageCollection("CIESIN/GPWv411/GPW_Population_Density").filterDate(f"{year - 5}-12-31", f"{year}-12-31").first().select('population_density')
+
+    bands = [elevation, landcover, road_density_image(), population]
+    return ee.Image.cat([band.toFloat() for band in bands]).unmask(NODATA)
+
+
+def fire_tile_extents(perimeters, padding=1, grid=DEFAULT_GRID):
+    """
+    cell extent (row_min, row_max, col_min, col_max) of every fire's bounding
+    box on the shared grid, padded by `padding` cells.
+    """
+    row_min, row_max, col_min, col_max = cell_extents(perimeters.geometry, grid, padding)
+    extents = pd.DataFrame({
+        'uniquefire': perimeters['uniquefire'].to_numpy(),
+        'row_min': row_min,
+        'row_max': row_max,
+        'col_min': col_min,
+        'col_max': col_max,
+    })
+    return extents.drop_duplicates('uniquefire').reset_index(drop=True)
+
+
+def fetch_static_tile(image, row_min, row_max, col_min, col_max, grid=DEFAULT_GRID, scheduler=None):
+    """
+    downloads the static layers for a block of grid cells, with one
+    computePixels call per sub-tile for blocks over the pixel limit (see
+    perimeter_rasters.sample_extent). returns a (layers, rows, cols) float32
+    array with row 0 at row_max.
+    """
+    return sample_extent(image, STATIC_LAYER_COLUMNS, row_min, row_max, col_min, col_max, grid, NODATA, scheduler=scheduler)
+
+
+def _tile_path(root, uniquefire):
+    return os.path.join(root, f"{quote(str(uniquefire), safe='-_.')}.npz")
+
+
+def precompute_static_layers(perimeters, year, root=STATIC_LAYERS_DIR, scheduler=None, threads=8):
+    """
+    fetches the static layers once per fire bounding box and saves each tile
+    as an .npz. fires whose tile already exists are skipped, so reruns resume.
+    """
+    os.makedirs(root, exist_ok=True)
+    image = static_layer_image(year)
+    extents = fire_tile_extents(perimeters)
+    todo = [extent for extent in extents.itertuples(index=False) if not os.path.exists(_tile_path(root, extent.uniquefire))]
+    print(f"Static layers: {len(extents) - len(todo)} of {len(extents)} fire tiles already present")
+
+    def fetch(extent):
+        try:
+            layers = fetch_static_tile(image, extent.row_min, extent.row_max, extent.col_min, extent.col_max, scheduler=scheduler)
+        except Exception as e:
+            print(f"Failed to fetch static layers for {extent.uniquefire}: {e}")
+            return False
+        path = _tile_path(root, extent.uniquefire)
+        np.savez(path + ".tmp.npz", layers=layers, origin=np.array([extent.row_max, extent.col_min]))
+        os.replace(path + ".tmp.npz", path)
+        return True
+
+    with ThreadPool(threads) as pool:
+        fetched = sum(pool.map(fetch, todo))
+    print(f"Static layers: fetched {fetched} of {len(todo)} missing tiles")
+
+
+class StaticLayerTiles:
+    """reads precomputed static layer tiles and looks observations up in them."""
+
+    def __init__(self, root=STATIC_LAYERS_DIR, max_open=256):
+        self.root = root
+        self.max_open = max_open
+        self._tiles = OrderedDict()
+
+    def tile(self, uniquefire):
+        """(layers, row_max, col_min) for a fire, or None if it was not precomputed."""
+        if uniquefire in self._tiles:
+            self._tiles.move_to_end(uniquefire)
+            return self._tiles[uniquefire]
+
+        path = _tile_path(self.root, uniquefire)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            tile = (data['layers'], int(data['origin'][0]), int(data['origin'][1]))
+        self._tiles[uniquefire] = tile
+        if len(self._tiles) > self.max_open:
+            self._tiles.popitem(last=False)
+        return tile
+
+    def lookup(self, uniquefire, lats, lons):
+        """(n, layers) array of static values at the given points, NaN outside the tile."""
+        values = np.full((len(lats), len(STATIC_LAYER_COLUMNS)), np.nan, dtype=np.float32)
+        tile = self.tile(uniquefire)
+        if tile is None:
+            return values
+
+        layers, row_max, col_min = tile
+        rows, cols = DEFAULT_GRID.snap(lats, lons)
+        i = row_max - rows
+        j = cols - col_min
+        inside = (i >= 0) & (i < layers.shape[1]) & (j >= 0) & (j < layers.shape[2])
+        values[inside] = layers[:, i[inside], j[inside]].T
+        return values
+
+    def lookup_frame(self, observations):
+        """static values for every row of observations, indexed by observation_id."""
+        frames = []
+        for uniquefire, group in observations.groupby('uniquefire', sort=False, observed=True):
+            values = self.lookup(uniquefire, group['LATITUDE'].to_numpy(), group['LONGITUDE'].to_numpy())
+            frames.append(pd.DataFrame(values, columns=STATIC_LAYER_COLUMNS, index=group['observation_id'].to_numpy()))
+        if not frames:
+            return pd.DataFrame(columns=STATIC_LAYER_COLUMNS)
+        return pd.concat(frames)
+
+
+if __name__ == "__main__":
+    from merge_and_filter import load_largest_perimeters, parse_years
+
+    parser = argparse.ArgumentParser(description="Precompute static Earth Engine layers per fire footprint.")
+    parser.add_argument("--years", nargs="+", default=["2015"])
+    parser.add_argument("--root", default=STATIC_LAYERS_DIR)
+    args = parser.parse_args()
+
+    ee.Initialize()
+    for year in parse_years(args.years):
+        precompute_static_layers(load_largest_perimeters(year), year, args.root)
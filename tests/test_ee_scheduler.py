@@ -0,0 +1,142 @@
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from benchmarks.fake_ee import FakeEarthEngine, FakeEEException
+from ee_scheduler import (PERMANENT, SUCCESS, THROTTLE, TRANSIENT, AIMDLimiter, RequestScheduler, TokenBucket,
+                          classify_error)
+
+
+class FakeClock:
+    """monotonic clock that only moves when something sleeps on it."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+@pytest.mark.parametrize("error, kind", [
+    (FakeEEException("Too many concurrent aggregations."), THROTTLE),
+    (FakeEEException("Earth Engine memory capacity exceeded: quota"), THROTTLE),
+    (FakeEEException("Internal error."), TRANSIENT),
+    (FakeEEException("Computation timed out."), TRANSIENT),
+    (TimeoutError(), TRANSIENT),
+    (ValueError("No ERA5 data available for the specified date."), PERMANENT),
+    (KeyError("features"), PERMANENT),
+])
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+
+def test_token_bucket_allows_a_burst_then_paces_to_the_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=128.0, capacity=128.0, clock=clock, sleep=clock.sleep)
+
+    bucket.acquire(128)
+    assert clock.slept == 0.0
+
+    # eight calls of 32 round trips each need 256 tokens, 2 seconds at 128/s
+    for _ in range(8):
+        bucket.acquire(32)
+    assert clock.slept == pytest.approx(2.0)
+
+
+def test_token_bucket_caps_cost_at_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=8.0, capacity=8.0, clock=clock, sleep=clock.sleep)
+    bucket.acquire(8)
+    bucket.acquire(50)
+    assert clock.slept == pytest.approx(1.0)
+
+
+def test_aimd_limiter_grows_on_success_and_halves_on_throttle():
+    clock = FakeClock()
+    limiter = AIMDLimiter(initial=8, maximum=10, cooldown=1.0, clock=clock)
+
+    for _ in range(8):
+        limiter.acquire()
+        limiter.release(SUCCESS, 0.1)
+    assert limiter.limit == pytest.approx(9.0, abs=0.1)
+
+    limiter.acquire()
+    limiter.release(THROTTLE, 0.1)
+    assert limiter.limit == pytest.approx(4.5, abs=0.1)
+
+    # a second throttle from the same window is not applied again
+    limiter.acquire()
+    limiter.release(THROTTLE, 0.1)
+    assert limiter.limit == pytest.approx(4.5, abs=0.1)
+
+    clock.now += 1.0
+    limiter.acquire()
+    limiter.release(THROTTLE, 0.1)
+    assert limiter.limit == pytest.approx(2.25, abs=0.1)
+    assert limiter.in_flight == 0
+
+
+def test_aimd_limiter_stays_within_bounds():
+    limiter = AIMDLimiter(initial=2, minimum=1, maximum=3, cooldown=0.0)
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release(THROTTLE, 0.1)
+    assert limiter.limit == 1
+    for _ in range(100):
+        limiter.acquire()
+        limiter.release(SUCCESS, 0.1)
+    assert limiter.limit == 3
+
+
+def test_aimd_limiter_shrinks_on_slow_successes():
+    limiter = AIMDLimiter(initial=10, latency_target=1.0, latency_decrease=0.9, cooldown=0.0)
+    limiter.acquire()
+    limiter.release(SUCCESS, 2.0)
+    assert limiter.limit == pytest.approx(9.0)
+
+
+def test_scheduler_completes_every_request_against_a_throttling_fake():
+    client = FakeEarthEngine(latency=0.005, jitter=0.001, capacity=4, error_rate=0.05, seed=1)
+    scheduler = RequestScheduler(rate=10_000.0, initial_concurrency=16, max_concurrency=16, seed=0,
+                                 backoff={THROTTLE: (0.001, 0.02, 20), TRANSIENT: (0.001, 0.01, 10)})
+    with ThreadPool(16) as pool:
+        results = pool.map(lambda i: scheduler.call(client.get_info, i), range(200))
+
+    assert results == list(range(200))
+    assert client.throttled > 0
+    assert scheduler.counts[SUCCESS] == 200
+    assert scheduler.counts[THROTTLE] == client.throttled
+    assert scheduler.counts[TRANSIENT] == client.errors
+    # throttling pulled the concurrency limit down from where it started
+    assert scheduler.limiter.limit < 16
+    assert scheduler.limiter.in_flight == 0
+
+
+def test_scheduler_does_not_retry_permanent_errors():
+    calls = []
+
+    def missing(date_str):
+        calls.append(date_str)
+        raise ValueError("No ERA5 data available for the specified date.")
+
+    scheduler = RequestScheduler(rate=1000.0)
+    with pytest.raises(ValueError):
+        scheduler.call(missing, "2015-01-01")
+    assert calls == ["2015-01-01"]
+    assert scheduler.counts[PERMANENT] == 1
+
+
+def test_scheduler_gives_up_after_the_retry_budget():
+    client = FakeEarthEngine(latency=0.0, jitter=0.0, capacity=0, seed=0)
+    clock = FakeClock()
+    scheduler = RequestScheduler(rate=1000.0, backoff={THROTTLE: (1.0, 4.0, 3), TRANSIENT: (1.0, 4.0, 3)},
+                                 clock=clock, sleep=clock.sleep, seed=0)
+    with pytest.raises(FakeEEException):
+        scheduler.call(client.get_info, 0)
+    assert client.calls == 4
+    assert scheduler.counts[THROTTLE] == 4
@@ -0,0 +1,17 @@
+import numpy as np
+
+from spread_eval import score_runs
+
+
+def test_score_runs_bins_simulated_arrivals_by_day_started():
+    # a cell burning 0.4 days in has burned on day 0, as it would be observed
+    scores = score_runs([[0]], [[[0.4]]], 2)
+    assert scores['iou'].tolist() == [[1, 1]]
+
+
+def test_score_runs_counts_never_burned_cells():
+    observed = np.array([[0, 1], [-1, -1]])
+    simulated = np.array([[[0.0, 1.5], [np.nan, -1.0]]])
+    scores = score_runs(observed, simulated, 2)
+    assert scores['simulated_cells'].tolist() == [[1, 2]]
+    assert scores['iou'].tolist() == [[1, 1]]
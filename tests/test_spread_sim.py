@@ -0,0 +1,14 @@
+import numpy as np
+import pytest
+
+from spread_sim import simulate
+
+
+@pytest.mark.parametrize("shape", [(8, 20, 30), (1, 8, 20, 30), (2, 8, 20, 30)])
+def test_simulate_reaches_every_cell_at_its_chebyshev_distance(shape):
+    ignitions = np.array([[0, 0], [10, 15]])
+    arrival, _, updates = simulate(np.ones(shape, dtype=np.float32), ignitions, 50, 3)
+    rows, cols = np.indices(shape[-2:])
+    for member, (row, col) in enumerate(ignitions):
+        assert np.array_equal(arrival[member], np.maximum(abs(rows - row), abs(cols - col)))
+    assert updates > 0
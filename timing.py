@@ -0,0 +1,31 @@
+import time
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """Collects wall-clock timings for the named stages of a pipeline run."""
+
+    def __init__(self):
+        self.timings = {}
+        self.items = {}
+
+    @contextmanager
+    def stage(self, name, items=None):
+        """times a stage; with items, the report also shows its throughput."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+            if items is not None:
+                self.items[name] = self.items.get(name, 0) + items
+
+    def report(self, title=None):
+        """Print each stage's time and the total."""
+        if title:
+            print(title)
+        width = max((len(name) for name in self.timings), default=0)
+        for name, seconds in self.timings.items():
+            rate = f"  ({self.items[name] / seconds:,.0f}/s)" if name in self.items and seconds > 0 else ""
+            print(f"  {name:<{width}}  {seconds:8.2f}s{rate}")
+        print(f"  {'total':<{width}}  {sum(self.timings.values()):8.2f}s")